@@ -0,0 +1,200 @@
+"""
+Admission control for calls to the speech and LLM providers.
+
+Each provider ("stt", "llm", "tts") has an AdaptiveLimiter. Its concurrency
+limit follows AIMD: every call that succeeds within the provider's latency
+target raises the limit by 1/limit (about +1 per window of calls), and a
+failed or slow call cuts it by ADMISSION_BACKOFF, at most once per
+ADMISSION_BACKOFF_INTERVAL seconds so one burst of errors counts once.
+Calls over the limit wait in a FIFO queue of at most ADMISSION_MAX_QUEUE
+entries for up to ADMISSION_QUEUE_TIMEOUT seconds. A full queue or a
+missed deadline raises Overloaded at once instead of piling more requests
+onto a provider that is already struggling; callers turn that into a 503,
+or drop the audio and reply with text only. Safety escalations are never
+shed: their audio is synthesized with a priority slot, and a turn whose
+keyword prescreen matched escalates without an intent label when the LLM
+is saturated.
+
+Latency targets are per provider: ADMISSION_STT_LATENCY,
+ADMISSION_LLM_LATENCY and ADMISSION_TTS_LATENCY (seconds).
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+ADMISSION_INITIAL_LIMIT = float(os.getenv("ADMISSION_INITIAL_LIMIT", "8"))
+ADMISSION_MIN_LIMIT = float(os.getenv("ADMISSION_MIN_LIMIT", "1"))
+ADMISSION_MAX_LIMIT = float(os.getenv("ADMISSION_MAX_LIMIT", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", "0.75"))
+ADMISSION_BACKOFF_INTERVAL = float(os.getenv("ADMISSION_BACKOFF_INTERVAL", "1"))
+
+LATENCY_TARGETS = {
+    "stt": float(os.getenv("ADMISSION_STT_LATENCY", "5")),
+    "llm": float(os.getenv("ADMISSION_LLM_LATENCY", "8")),
+    "tts": float(os.getenv("ADMISSION_TTS_LATENCY", "3")),
+}
+
+
+class Overloaded(Exception):
+    """A provider call was shed: its queue was full or its deadline passed."""
+
+    def __init__(self, provider, reason):
+        super().__init__(f"{provider} overloaded ({reason})")
+        self.provider = provider
+        self.reason = reason
+
+
+class Permit:
+    """One admitted call. Mark it failed when the provider answered with an error result."""
+
+    def __init__(self):
+        self.ok = True
+
+    def fail(self):
+        self.ok = False
+
+
+class AdaptiveLimiter:
+    def __init__(self, name, latency_target, initial_limit=ADMISSION_INITIAL_LIMIT,
+                 min_limit=ADMISSION_MIN_LIMIT, max_limit=ADMISSION_MAX_LIMIT,
+                 max_queue=ADMISSION_MAX_QUEUE, queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+                 backoff=ADMISSION_BACKOFF, backoff_interval=ADMISSION_BACKOFF_INTERVAL,
+                 clock=time.monotonic):
+        self.name = name
+        self.latency_target = latency_target
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.backoff_interval = backoff_interval
+        self.clock = clock
+        self.inflight = 0
+        self._waiters = deque()
+        self._last_backoff = None
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.failed = 0
+        self.slow = 0
+        self.backoffs = 0
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def _has_room(self):
+        return self.inflight < max(int(self.limit), 1)
+
+    async def acquire(self, timeout=None, priority=False):
+        """
+        Wait for a slot; raises Overloaded when none comes in time. Priority
+        calls (safety escalations) are admitted at once, even over the limit.
+        """
+        if priority or (self._has_room() and not self._waiters):
+            self.inflight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(self.name, "queue full")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return  # granted just as the deadline passed; the slot is ours
+            self.timed_out += 1
+            raise Overloaded(self.name, "queue timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def release(self, latency, ok):
+        """Return a slot and adjust the limit from how the call went."""
+        now = self.clock()
+        if not ok or latency > self.latency_target:
+            if ok:
+                self.slow += 1
+            else:
+                self.failed += 1
+            if self._last_backoff is None or now - self._last_backoff >= self.backoff_interval:
+                self._last_backoff = now
+                self.backoffs += 1
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                logging.info(f"Admission {self.name}: backing off to limit {self.limit:.1f}")
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._release()
+
+    def abandon(self):
+        """Return a slot with no verdict on the provider (the caller gave up)."""
+        self._release()
+
+    def _release(self):
+        self.inflight -= 1
+        # Hand freed slots straight to the oldest waiters
+        while self._waiters and self._has_room():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.inflight += 1
+                self.admitted += 1
+
+    @asynccontextmanager
+    async def slot(self, timeout=None, priority=False):
+        """
+        Hold a slot around one provider call. An exception from the body
+        counts as a failed call; cancellation gives no feedback.
+        """
+        await self.acquire(timeout, priority)
+        permit = Permit()
+        started = self.clock()
+        try:
+            yield permit
+        except (asyncio.CancelledError, GeneratorExit):
+            # Abandoned by the caller (e.g. a discarded stream): no verdict on the provider
+            self.abandon()
+            raise
+        except BaseException:
+            self.release(self.clock() - started, ok=False)
+            raise
+        self.release(self.clock() - started, ok=permit.ok)
+
+    def stats(self):
+        return {
+            "limit": round(self.limit, 2),
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "failed": self.failed,
+            "slow": self.slow,
+            "backoffs": self.backoffs,
+            "latency_target": self.latency_target,
+        }
+
+
+# One limiter per provider, shared by the whole process
+limiters = {name: AdaptiveLimiter(name, target) for name, target in LATENCY_TARGETS.items()}
+
+
+def stats():
+    return {name: limiter.stats() for name, limiter in limiters.items()}
@@ -0,0 +1,35 @@
+"""create conversation_logs
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "conversation_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("session_id", sa.String()),
+        sa.Column("user_transcript", sa.Text()),
+        sa.Column("bot_response", sa.Text()),
+        sa.Column("intent", sa.String()),
+        sa.Column("emotion", sa.String()),
+        sa.Column("escalate", sa.Boolean()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        if_not_exists=True,
+    )
+    op.create_index("ix_conversation_logs_id", "conversation_logs", ["id"], if_not_exists=True)
+    op.create_index("ix_conversation_logs_session_id", "conversation_logs", ["session_id"], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_table("conversation_logs")
@@ -0,0 +1,28 @@
+"""index conversation_logs on (session_id, created_at)
+
+Session history is read newest first per session with keyset pagination;
+the composite index serves that and makes the session_id index redundant.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_conversation_logs_session_id_created_at", "conversation_logs", ["session_id", "created_at"]
+    )
+    op.drop_index("ix_conversation_logs_session_id", table_name="conversation_logs")
+
+
+def downgrade():
+    op.create_index("ix_conversation_logs_session_id", "conversation_logs", ["session_id"])
+    op.drop_index("ix_conversation_logs_session_id_created_at", table_name="conversation_logs")
@@ -0,0 +1,108 @@
+"""partition conversation_logs by month
+
+conversation_logs becomes a table partitioned by range on created_at, one
+partition per calendar month (conversation_logs_yYYYYmMM) plus a default
+partition as a safety net. Existing rows are copied across. Partitions for
+the coming months are created here and then kept ahead by
+`python retention.py maintain`, which also archives and drops old ones.
+
+PostgreSQL only; on other databases this revision does nothing.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+COLUMNS = "id, session_id, user_transcript, bot_response, intent, emotion, escalate, created_at"
+MONTHS_AHEAD = 3
+
+
+def upgrade():
+    if op.get_context().dialect.name != "postgresql":
+        return
+    op.execute("ALTER TABLE conversation_logs RENAME TO conversation_logs_unpartitioned")
+    op.execute("ALTER INDEX ix_conversation_logs_session_id_created_at RENAME TO ix_conversation_logs_unpartitioned_session")
+    op.execute("ALTER INDEX ix_conversation_logs_id RENAME TO ix_conversation_logs_unpartitioned_id")
+    # The partition key has to be part of the primary key; ids still come from one sequence
+    op.execute("""
+        CREATE TABLE conversation_logs (
+            id BIGSERIAL,
+            session_id VARCHAR,
+            user_transcript TEXT,
+            bot_response TEXT,
+            intent VARCHAR,
+            emotion VARCHAR,
+            escalate BOOLEAN,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("CREATE INDEX ix_conversation_logs_session_id_created_at ON conversation_logs (session_id, created_at)")
+
+    # Computed on the server, so `alembic upgrade --sql` can emit it too
+    op.execute(f"""
+        DO $$
+        DECLARE
+            start_month timestamp;
+        BEGIN
+            FOR start_month IN
+                SELECT generate_series(
+                    date_trunc('month', COALESCE((SELECT min(created_at) FROM conversation_logs_unpartitioned), now())
+                                        AT TIME ZONE 'UTC'),
+                    date_trunc('month', now() AT TIME ZONE 'UTC') + interval '{MONTHS_AHEAD} months',
+                    interval '1 month')
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF conversation_logs FOR VALUES FROM (%L) TO (%L)',
+                    to_char(start_month, '"conversation_logs_y"YYYY"m"MM'),
+                    to_char(start_month, 'YYYY-MM-DD') || ' 00:00:00+00',
+                    to_char(start_month + interval '1 month', 'YYYY-MM-DD') || ' 00:00:00+00');
+            END LOOP;
+        END
+        $$
+    """)
+    op.execute("CREATE TABLE conversation_logs_default PARTITION OF conversation_logs DEFAULT")
+
+    op.execute(
+        f"INSERT INTO conversation_logs ({COLUMNS}) "
+        f"SELECT {COLUMNS.replace('created_at', 'COALESCE(created_at, now())')} FROM conversation_logs_unpartitioned"
+    )
+    op.execute(
+        "SELECT setval(pg_get_serial_sequence('conversation_logs', 'id'), "
+        "COALESCE((SELECT max(id) FROM conversation_logs), 0) + 1, false)"
+    )
+    op.execute("DROP TABLE conversation_logs_unpartitioned")
+
+
+def downgrade():
+    if op.get_context().dialect.name != "postgresql":
+        return
+    op.execute("ALTER TABLE conversation_logs RENAME TO conversation_logs_partitioned")
+    op.execute("ALTER INDEX ix_conversation_logs_session_id_created_at RENAME TO ix_conversation_logs_partitioned_session")
+    op.execute("""
+        CREATE TABLE conversation_logs (
+            id SERIAL PRIMARY KEY,
+            session_id VARCHAR,
+            user_transcript TEXT,
+            bot_response TEXT,
+            intent VARCHAR,
+            emotion VARCHAR,
+            escalate BOOLEAN,
+            created_at TIMESTAMPTZ DEFAULT now()
+        )
+    """)
+    op.execute(f"INSERT INTO conversation_logs ({COLUMNS}) SELECT {COLUMNS} FROM conversation_logs_partitioned")
+    op.execute(
+        "SELECT setval(pg_get_serial_sequence('conversation_logs', 'id'), "
+        "COALESCE((SELECT max(id) FROM conversation_logs), 0) + 1, false)"
+    )
+    op.execute("DROP TABLE conversation_logs_partitioned CASCADE")
+    op.execute("CREATE INDEX ix_conversation_logs_id ON conversation_logs (id)")
+    op.execute("CREATE INDEX ix_conversation_logs_session_id_created_at ON conversation_logs (session_id, created_at)")
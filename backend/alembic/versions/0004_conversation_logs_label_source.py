@@ -0,0 +1,28 @@
+"""add conversation_logs.label_source
+
+Records which tier produced a turn's intent/emotion ("llm", "local",
+"phatic" or "prescreen"), so the local classifier is trained only on LLM
+labels. Rows logged before this revision have no source and are not
+trained on.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # On the partitioned table this reaches every partition
+    op.add_column("conversation_logs", sa.Column("label_source", sa.String()))
+
+
+def downgrade():
+    op.drop_column("conversation_logs", "label_source")
@@ -0,0 +1,180 @@
+"""
+Managed store for audio artifacts on local disk.
+
+Nothing in a turn writes audio files any more (uploads are decoded in
+memory and replies come from the TTS cache), so the store serves and
+sweeps what earlier versions left behind. Files live in two levels of shard directories under ARTIFACT_DIR
+(ab/cd/abcd1234....mp3) so no single directory grows huge. A background
+sweeper deletes artifacts older than ARTIFACT_TTL seconds and then, oldest
+first, whatever is needed to keep the store under ARTIFACT_MAX_BYTES. It
+also clears expired loose files left in ARTIFACT_LEGACY_DIR by older
+versions that wrote straight into tmp/.
+
+Files are served with a content type from their extension, an ETag and
+Range support, through Starlette's FileResponse (which uses sendfile or
+the ASGI pathsend extension where the server offers it).
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from fastapi.responses import FileResponse, Response
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "tmp/artifacts")
+ARTIFACT_TTL = float(os.getenv("ARTIFACT_TTL", str(24 * 3600)))
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(1024 * 1024 * 1024)))
+ARTIFACT_SWEEP_INTERVAL = float(os.getenv("ARTIFACT_SWEEP_INTERVAL", "300"))
+ARTIFACT_LEGACY_DIR = os.getenv("ARTIFACT_LEGACY_DIR", "tmp")
+
+CONTENT_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".webm": "audio/webm",
+    ".ogg": "audio/ogg",
+    ".m4a": "audio/mp4",
+    ".pcm": "application/octet-stream",
+}
+# Loose files the legacy sweep may delete
+_LEGACY_EXTENSIONS = set(CONTENT_TYPES) | {".log"}
+# Artifact names: hex id plus a known extension; anything else is not ours
+_NAME = re.compile(r"^([0-9a-f]{4})[0-9a-f]{4,60}(\.[a-z0-9]+)$")
+
+
+def content_type(name):
+    return CONTENT_TYPES.get(os.path.splitext(name)[1].lower(), "application/octet-stream")
+
+
+def shard_path(root, name):
+    """root/ab/cd/name for a name starting with at least four hex digits."""
+    return os.path.join(root, name[:2], name[2:4], name)
+
+
+def file_response(path, name, request_headers=None, cache_control=None):
+    """
+    Response for an existing file, or None if it is gone: 304 when the
+    client's If-None-Match matches, otherwise a FileResponse (which handles
+    Range requests itself).
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    etag = '"' + hashlib.md5(f"{stat.st_mtime}-{stat.st_size}".encode(), usedforsecurity=False).hexdigest() + '"'
+    headers = {"etag": etag}
+    if cache_control:
+        headers["cache-control"] = cache_control
+    if request_headers is not None and etag in request_headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    # Passing the stat result saves FileResponse a second stat call
+    return FileResponse(path, media_type=content_type(name), stat_result=stat, headers=headers)
+
+
+class ArtifactStore:
+    def __init__(self, root=ARTIFACT_DIR, ttl=ARTIFACT_TTL, max_bytes=ARTIFACT_MAX_BYTES,
+                 legacy_dir=ARTIFACT_LEGACY_DIR):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.legacy_dir = legacy_dir
+        self.swept_expired = 0
+        self.swept_for_size = 0
+        self.last_sweep = None
+        os.makedirs(root, exist_ok=True)
+
+    def valid_name(self, name):
+        match = _NAME.match(name)
+        return match is not None and match.group(2) in CONTENT_TYPES
+
+    def path(self, name):
+        """Path for an artifact name, or None if the name is not a valid one."""
+        if not self.valid_name(name):
+            return None
+        return shard_path(self.root, name)
+
+    def response(self, name, request_headers=None):
+        path = self.path(name)
+        if path is None:
+            return None
+        return file_response(path, name, request_headers, cache_control=f"private, max-age={int(self.ttl)}")
+
+    def sweep(self, now=None):
+        """Delete expired artifacts, then the oldest until under the size cap."""
+        now = time.time() if now is None else now
+        survivors = []
+        expired = 0
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.ttl:
+                    expired += self._unlink(path)
+                else:
+                    survivors.append((stat.st_mtime, stat.st_size, path))
+            if dirpath != self.root and not os.listdir(dirpath):
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass  # a writer just created a file in it
+
+        total = sum(size for _, size, _ in survivors)
+        over_cap = 0
+        for _, size, path in sorted(survivors):
+            if total <= self.max_bytes:
+                break
+            over_cap += self._unlink(path)
+            total -= size
+
+        expired += self._sweep_legacy(now)
+        self.swept_expired += expired
+        self.swept_for_size += over_cap
+        self.last_sweep = {"at": now, "expired": expired, "over_cap": over_cap, "bytes": total}
+        if expired or over_cap:
+            logging.info(f"Artifact sweep removed {expired} expired and {over_cap} over-cap files")
+        return self.last_sweep
+
+    def _sweep_legacy(self, now):
+        if not self.legacy_dir or not os.path.isdir(self.legacy_dir):
+            return 0
+        removed = 0
+        for entry in os.scandir(self.legacy_dir):
+            if (entry.is_file() and os.path.splitext(entry.name)[1] in _LEGACY_EXTENSIONS
+                    and now - entry.stat().st_mtime > self.ttl):
+                removed += self._unlink(entry.path)
+        return removed
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+            return 1
+        except FileNotFoundError:
+            return 0
+
+    async def run_sweeper(self, interval=None):
+        """Sweep every `interval` seconds until cancelled."""
+        interval = interval or ARTIFACT_SWEEP_INTERVAL
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # Walking the tree is blocking I/O, so keep it off the event loop
+                await loop.run_in_executor(None, self.sweep)
+            except Exception as e:
+                logging.error(f"Artifact sweep failed: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self):
+        return {
+            "ttl": self.ttl,
+            "max_bytes": self.max_bytes,
+            "swept_expired": self.swept_expired,
+            "swept_for_size": self.swept_for_size,
+            "last_sweep": self.last_sweep,
+        }
+
+
+# Process-wide store for per-turn audio files
+artifact_store = ArtifactStore()
@@ -0,0 +1,85 @@
+"""
+Inline audio delivery over WebSocket.
+
+A client that connects with ?audio=binary gets each reply segment's audio
+as binary frames on the same socket instead of a URL to fetch. Every
+segment is announced by a JSON message
+
+    {"tts_segment": {"index", "text", "turn_id", "delivery": "binary",
+                     "bytes", "content_type", "tts_audio_url"}}
+
+followed by its bytes in frames of WS_AUDIO_CHUNK_BYTES, each starting
+with a 23-byte big-endian header:
+
+    turn id (16 bytes, UUID) | segment index (uint16) | chunk seq (uint32) | flags (uint8, 1 = last)
+
+`tts_audio_url` is still included so a client can fall back to fetching.
+Clients that do not ask for binary keep getting URLs only.
+"""
+import asyncio
+import os
+import struct
+import uuid
+import services
+from artifacts import content_type
+from tts_cache import speech_cache
+
+WS_AUDIO_CHUNK_BYTES = int(os.getenv("WS_AUDIO_CHUNK_BYTES", str(16 * 1024)))
+DELIVERY_MODES = ("url", "binary")
+
+FRAME_HEADER = struct.Struct(">16sHIB")
+FLAG_LAST = 1
+
+
+def negotiate(query_params):
+    """Delivery mode asked for at connect time; URLs unless binary is requested."""
+    mode = (query_params.get("audio") or "url").lower()
+    return mode if mode in DELIVERY_MODES else "url"
+
+
+def encode_frame(turn_id, index, seq, last, payload):
+    return FRAME_HEADER.pack(uuid.UUID(turn_id).bytes, index, seq, FLAG_LAST if last else 0) + payload
+
+
+def decode_frame(frame):
+    """(turn_id, index, seq, last, payload) of one binary frame."""
+    turn, index, seq, flags = FRAME_HEADER.unpack_from(frame)
+    return str(uuid.UUID(bytes=turn)), index, seq, bool(flags & FLAG_LAST), frame[FRAME_HEADER.size:]
+
+
+class BinaryAudioSender:
+    """Sends TTS cache files as tagged binary frames on one WebSocket."""
+
+    def __init__(self, websocket, chunk_size=None):
+        self.websocket = websocket
+        self.chunk_size = chunk_size or WS_AUDIO_CHUNK_BYTES
+
+    async def send_segment(self, turn_id, index, text, filename):
+        loop = asyncio.get_running_loop()
+        try:
+            # Cache files are small, but reading them is still blocking I/O
+            data = await loop.run_in_executor(None, _read, speech_cache.path(filename))
+        except FileNotFoundError:
+            # Evicted in the meantime; let the client try the URL
+            await self.websocket.send_json({"tts_segment": {
+                "index": index, "text": text, "turn_id": turn_id, "tts_audio_url": services.tts_url(filename)
+            }})
+            return
+        await self.websocket.send_json({"tts_segment": {
+            "index": index,
+            "text": text,
+            "turn_id": turn_id,
+            "delivery": "binary",
+            "bytes": len(data),
+            "content_type": content_type(filename),
+            "tts_audio_url": services.tts_url(filename)
+        }})
+        chunks = range(0, max(len(data), 1), self.chunk_size)
+        for seq, start in enumerate(chunks):
+            payload = data[start:start + self.chunk_size]
+            await self.websocket.send_bytes(encode_frame(turn_id, index, seq, seq == len(chunks) - 1, payload))
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
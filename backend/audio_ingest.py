@@ -0,0 +1,278 @@
+import asyncio
+import os
+import tempfile
+import time
+from streaming_stt import FFMPEG_DECODE_CMD
+from transcoding import transcode_pool, TranscodeError
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "60"))
+PCM_BYTES_PER_SECOND = 16000 * 2  # 16 kHz mono s16le
+PCM_READ_SIZE = 64 * 1024
+# Encoded audio one /ws/audio connection may hold; Opus at 32 kbit/s is ~4 KB/s
+WS_AUDIO_BUFFER_BYTES = int(os.getenv("WS_AUDIO_BUFFER_BYTES", str(1024 * 1024)))
+# Minimum seconds between status messages sent to a /ws/audio client
+WS_STATUS_INTERVAL = float(os.getenv("WS_STATUS_INTERVAL", "1.0"))
+# MP4-family containers may keep their index at the end of the file, which
+# ffmpeg cannot reach through a pipe; these are spooled to a temporary file
+SEEKABLE_CONTENT_TYPES = {"audio/mp4", "audio/m4a", "audio/x-m4a", "video/mp4", "video/quicktime", "audio/3gpp"}
+SEEKABLE_EXTENSIONS = {".mp4", ".m4a", ".mov", ".3gp"}
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeded MAX_UPLOAD_BYTES."""
+
+
+class AudioTooLong(Exception):
+    """The decoded audio exceeded MAX_AUDIO_SECONDS."""
+
+
+class MissingAudioField(Exception):
+    """The multipart body had no file part with the expected field name."""
+
+
+async def iter_multipart_file(request, field_name="audio", upload=None):
+    """
+    Yield the bytes of one file field from a multipart request body as the
+    body arrives, without spooling the upload to memory or disk first.
+    If given, `upload` is filled with the part's filename and content_type
+    before its first bytes are yielded.
+    """
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise MissingAudioField("Request is not multipart/form-data")
+
+    state = {"header_field": b"", "header_value": b"", "in_field": False, "found": False, "part": {}}
+    pending = []
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        header = state["header_field"].lower()
+        if header == b"content-disposition":
+            _, options = parse_options_header(state["header_value"])
+            state["in_field"] = options.get(b"name") == field_name.encode()
+            state["found"] = state["found"] or state["in_field"]
+            state["part"]["filename"] = options.get(b"filename", b"").decode(errors="replace")
+        elif header == b"content-type":
+            content_type, _ = parse_options_header(state["header_value"])
+            state["part"]["content_type"] = content_type.decode(errors="replace").lower()
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_headers_finished():
+        if state["in_field"] and upload is not None:
+            upload.update(state["part"])
+        state["part"] = {}
+
+    def on_part_data(data, start, end):
+        if state["in_field"]:
+            pending.append(data[start:end])
+
+    def on_part_end():
+        state["in_field"] = False
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    async for body_chunk in request.stream():
+        parser.write(body_chunk)
+        for piece in pending:
+            yield piece
+        pending.clear()
+    parser.finalize()
+    for piece in pending:
+        yield piece
+    if not state["found"]:
+        raise MissingAudioField(f"No '{field_name}' file in upload")
+
+
+def needs_seeking(head, content_type=None, filename=None):
+    """Whether audio starting with `head` is in a container ffmpeg may not decode from a pipe."""
+    if head[4:8] == b"ftyp":
+        return True
+    return content_type in SEEKABLE_CONTENT_TYPES or os.path.splitext(filename or "")[1].lower() in SEEKABLE_EXTENSIONS
+
+
+async def decode_to_pcm(chunks, pool=transcode_pool, max_bytes=None, max_seconds=None, cmd=FFMPEG_DECODE_CMD,
+                        upload=None):
+    """
+    Pipe an async iterator of encoded audio through the decoder and collect
+    16 kHz mono PCM from its stdout. Limits are enforced while streaming, so
+    an oversized upload is cut off as soon as it crosses the cap.
+
+    MP4-family audio (sniffed, or named so by `upload`'s content_type or
+    filename) is spooled to a temporary file first and the decoder reads
+    that in place of pipe:0, since it may need to seek.
+    """
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    max_pcm = int((max_seconds or MAX_AUDIO_SECONDS) * PCM_BYTES_PER_SECOND)
+    chunks = aiter(chunks)
+    head = await anext(chunks, b"")
+    chunks = _chain(head, chunks)
+    if not needs_seeking(head, **(upload or {})):
+        return await _decode(chunks, pool, max_bytes, max_pcm, cmd)
+    path = await _spool(chunks, max_bytes)
+    try:
+        return await _decode(_no_input(), pool, max_bytes, max_pcm, [path if arg == "pipe:0" else arg for arg in cmd])
+    finally:
+        os.unlink(path)
+
+
+async def _chain(head, chunks):
+    if head:
+        yield head
+    async for chunk in chunks:
+        yield chunk
+
+
+async def _no_input():
+    return
+    yield
+
+
+async def _spool(chunks, max_bytes):
+    fd, path = tempfile.mkstemp(suffix=".audio")
+    received = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            async for chunk in chunks:
+                received += len(chunk)
+                if received > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+async def _decode(chunks, pool, max_bytes, max_pcm, cmd):
+    async with pool.open(cmd) as (proc, job):
+        async def feed():
+            received = 0
+            try:
+                async for chunk in chunks:
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                    proc.stdin.write(chunk)
+                    await proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # Decoder gave up early; its exit status tells us why
+                pass
+            finally:
+                proc.stdin.close()
+
+        async def collect():
+            pcm = bytearray()
+            while True:
+                data = await proc.stdout.read(PCM_READ_SIZE)
+                if not data:
+                    return pcm
+                pcm += data
+                if len(pcm) > max_pcm:
+                    raise AudioTooLong(f"Audio exceeds {max_pcm // PCM_BYTES_PER_SECOND} seconds")
+
+        tasks = [asyncio.ensure_future(feed()), asyncio.ensure_future(collect()), asyncio.ensure_future(proc.stderr.read())]
+        try:
+            _, pcm, stderr = await asyncio.wait_for(asyncio.gather(*tasks), pool.job_timeout)
+        except asyncio.TimeoutError:
+            raise TranscodeError(f"Decoder timed out after {pool.job_timeout}s")
+        finally:
+            for task in tasks:
+                task.cancel()
+        await proc.wait()
+        if proc.returncode != 0:
+            raise TranscodeError(f"Decoder exited with code {proc.returncode}", proc.returncode, stderr)
+        return pcm
+
+
+class AudioBuffer:
+    """
+    One in-memory copy of the encoded audio received on a connection,
+    capped at `max_bytes` so per-connection memory has a known upper bound.
+    Space is reserved up front in blocks instead of growing per chunk.
+    """
+
+    def __init__(self, max_bytes=None, block_size=64 * 1024):
+        self.max_bytes = max_bytes or WS_AUDIO_BUFFER_BYTES
+        self.block_size = block_size
+        self._data = bytearray()
+        self.size = 0
+
+    def append(self, chunk):
+        end = self.size + len(chunk)
+        if end > self.max_bytes:
+            raise UploadTooLarge(f"Audio exceeds {self.max_bytes} bytes")
+        if end > len(self._data):
+            blocks = -(-end // self.block_size)
+            self._data.extend(bytes(min(blocks * self.block_size, self.max_bytes) - len(self._data)))
+        self._data[self.size:end] = chunk
+        self.size = end
+
+    def view(self):
+        return memoryview(self._data)[:self.size]
+
+    async def chunks(self, size=PCM_READ_SIZE):
+        """Async iterator over the buffered audio, for decode_to_pcm; no copies."""
+        view = self.view()
+        for start in range(0, self.size, size):
+            yield view[start:start + size]
+
+    def release(self):
+        self._data = bytearray()
+        self.size = 0
+
+
+class StatusThrottle:
+    """
+    Sends status messages at most once per `interval` seconds. Messages in
+    between are coalesced: only the latest is kept, and it goes out with
+    the next call after the interval or on flush().
+    """
+
+    def __init__(self, send, interval=None, clock=time.monotonic):
+        self._send = send
+        self.interval = WS_STATUS_INTERVAL if interval is None else interval
+        self._clock = clock
+        self._last = None
+        self._pending = None
+        self.sent = 0
+        self.coalesced = 0
+
+    async def send(self, message):
+        now = self._clock()
+        if self._last is not None and now - self._last < self.interval:
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = message
+            return
+        if self._pending is not None:
+            self.coalesced += 1  # superseded by this one
+        self._pending = None
+        self._last = now
+        self.sent += 1
+        await self._send(message)
+
+    async def flush(self):
+        if self._pending is not None:
+            message, self._pending = self._pending, None
+            self._last = self._clock()
+            self.sent += 1
+            await self._send(message)
@@ -0,0 +1,71 @@
+"""
+How many concurrent turns can one worker sustain?
+
+Each turn makes the two LLM calls a normal turn makes (intent analysis and
+response generation) against a local stand-in server with fixed latency.
+"per-call sync" reproduces the old code path: a new synchronous client per
+call, invoked from inside the event loop. "pooled async" goes through
+llm_clients. Run from backend/:
+
+    python -m benchmarks.bench_llm_clients --latency 0.2 --turns 200
+"""
+import argparse
+import asyncio
+import os
+import time
+import openai
+from benchmarks.fake_providers import FakeProviderServer
+
+
+async def _old_style_turn():
+    for model in ("gpt-4o", "gpt-4o-mini"):
+        client = openai.OpenAI(api_key="bench", base_url=os.environ["OPENAI_BASE_URL"])
+        client.chat.completions.create(model=model, messages=[{"role": "user", "content": "مرحبا"}])
+        client.close()
+
+
+async def _pooled_turn():
+    from services import analyze_intent, dual_model_response
+    intent, emotion, _ = await analyze_intent("مرحبا")
+    await dual_model_response("مرحبا", intent, emotion)
+
+
+async def _run(turn, turns, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await turn()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(turns)))
+    return time.perf_counter() - started
+
+
+async def main(latency, turns, levels):
+    # Separate thread: the old code path blocks this loop while it waits
+    server = FakeProviderServer(latency=latency).start_in_thread()
+    os.environ["OPENAI_BASE_URL"] = server.base_url + "/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    import llm_clients
+
+    print(f"stand-in latency {latency * 1000:.0f} ms per call, {turns} turns per run")
+    print(f"{'mode':<16}{'concurrency':>12}{'turns/s':>10}{'connections':>13}")
+    for concurrency in levels:
+        for name, turn in (("per-call sync", _old_style_turn), ("pooled async", _pooled_turn)):
+            before = server.connections
+            # The old path serializes everything, so keep its run short
+            n = min(turns, 20) if turn is _old_style_turn else turns
+            elapsed = await _run(turn, n, concurrency)
+            print(f"{name:<16}{concurrency:>12}{n / elapsed:>10.1f}{server.connections - before:>13}")
+    await llm_clients.aclose()
+    server.stop_thread()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64, 256])
+    args = parser.parse_args()
+    asyncio.run(main(args.latency, args.turns, args.concurrency))
@@ -0,0 +1,65 @@
+"""
+Reply latency during a provider brownout, with and without hedging.
+
+The primary provider answers in ~0.3 s but stalls for several seconds on a
+share of requests; the secondary is a little slower but steady. Compares
+p50/p95/p99 of LLMRouter.complete with hedging off and on. Run from
+backend/:
+
+    python -m benchmarks.bench_llm_router
+"""
+import argparse
+import asyncio
+import random
+import time
+from llm_router import LLMRouter, Provider, CircuitBreaker
+
+
+def _provider(name, latency):
+    async def complete(messages, **params):
+        await asyncio.sleep(latency())
+        return f"reply from {name}"
+
+    async def stream(messages, **params):
+        yield await complete(messages, **params)
+
+    # A brownout is slow, not failing, so keep the breaker from opening here
+    return Provider(name, complete, stream, breaker=CircuitBreaker(slow_seconds=60))
+
+
+async def _run(hedge, requests, concurrency, stall_rate, stall, seed):
+    rng = random.Random(seed)
+    primary = _provider("primary", lambda: stall if rng.random() < stall_rate else rng.uniform(0.25, 0.35))
+    secondary = _provider("secondary", lambda: rng.uniform(0.4, 0.5))
+    router = LLMRouter([primary, secondary], hedge=hedge, min_delay=0.3, max_delay=3)
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with gate:
+            started = time.perf_counter()
+            await router.complete([])
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    return pick(0.5), pick(0.95), pick(0.99), router.hedged
+
+
+def main(requests, concurrency, stall_rate, stall):
+    print(f"{requests} requests, {concurrency} at a time, {stall_rate:.0%} of primary calls stall {stall}s")
+    print(f"{'hedging':>8}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'hedged':>8}")
+    for hedge in (False, True):
+        p50, p95, p99, hedged = asyncio.run(_run(hedge, requests, concurrency, stall_rate, stall, seed=1))
+        print(f"{'on' if hedge else 'off':>8}{p50:>8.2f}{p95:>8.2f}{p99:>8.2f}{hedged:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--stall-rate", type=float, default=0.03)
+    parser.add_argument("--stall", type=float, default=5.0)
+    args = parser.parse_args()
+    main(args.requests, args.concurrency, args.stall_rate, args.stall)
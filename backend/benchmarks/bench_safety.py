@@ -0,0 +1,70 @@
+"""
+Safety keyword check: compiled matcher vs. the previous per-keyword scan.
+
+The previous implementation ran `any(k in text for k in keywords)` once
+per category on every turn. Lexicons of each size are padded with
+synthetic Arabic phrases around the real keywords. Run from backend/:
+
+    python -m benchmarks.bench_safety
+"""
+import argparse
+import random
+import time
+from safety import SafetyMatcher, normalize_arabic
+
+LETTERS = "ابتثجحخدذرزسشصضطظعغفقكلمنهوي"
+TEXT = "والله يا دكتور هالأيام أحس بضيق وما أقدر أنام زين، الشغل واجد والأهل ما يفهموني وأبغى أحد يسمعني بس"
+
+
+def _synthetic_lexicon(size, seed=7):
+    rng = random.Random(seed)
+    per_category = max(1, size // 3)
+    lexicon = {}
+    for category in ("crisis", "violence", "referral"):
+        words = set()
+        while len(words) < per_category:
+            words.add(" ".join(
+                "".join(rng.choice(LETTERS) for _ in range(rng.randint(5, 8)))
+                for _ in range(rng.randint(1, 3))
+            ))
+        lexicon[category] = sorted(words)
+    return lexicon
+
+
+def _legacy_check(text, lexicon):
+    # The scan the old safety_check did: one substring search per keyword
+    for category in ("crisis", "violence", "referral"):
+        if any(k in text for k in lexicon[category]):
+            return category
+    return None
+
+
+def _time(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main(sizes, iterations):
+    print(f"text of {len(TEXT)} chars with no keyword (worst case for both), {iterations} iterations")
+    print(f"{'keywords':>9}{'legacy us':>12}{'matcher us':>12}{'compile ms':>12}{'speedup':>9}")
+    for size in sizes:
+        lexicon = _synthetic_lexicon(size)
+        started = time.perf_counter()
+        matcher = SafetyMatcher(lexicon)
+        compile_ms = (time.perf_counter() - started) * 1000
+        # The legacy path did not normalize, so give it pre-normalized keywords
+        normalized = {c: [normalize_arabic(k) for k in ks] for c, ks in lexicon.items()}
+        assert _legacy_check(normalize_arabic(TEXT), normalized) == (matcher.first(TEXT) or (None,))[0]
+        legacy = _time(lambda: _legacy_check(TEXT, normalized), iterations)
+        compiled = _time(lambda: matcher.first(TEXT), iterations)
+        print(f"{size:>9}{legacy:>12.1f}{compiled:>12.1f}{compile_ms:>12.1f}{legacy / compiled:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.sizes, args.iterations)
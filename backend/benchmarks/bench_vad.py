@@ -0,0 +1,50 @@
+"""
+Voice activity detection cost per stream.
+
+Feeds synthetic 16 kHz PCM (tone bursts separated by low noise) to the
+streaming detector in chunks the size MediaRecorder delivers after
+decoding, and reports how many real-time streams one core could gate.
+Run from backend/:
+
+    python -m benchmarks.bench_vad
+"""
+import argparse
+import time
+import numpy as np
+from vad import SAMPLE_RATE, SpeechGate, VoiceActivityDetector, trim_silence
+
+
+def _audio(seconds, seed=3):
+    rng = np.random.default_rng(seed)
+    t = np.arange(SAMPLE_RATE * seconds) / SAMPLE_RATE
+    # One second of "speech" out of every three
+    envelope = ((t % 3) < 1).astype(np.float32)
+    signal = 8000 * np.sin(2 * np.pi * 220 * t) * envelope + rng.normal(0, 30, len(t))
+    return signal.astype("<i2").tobytes()
+
+
+def main(seconds, chunk_ms):
+    audio = _audio(seconds)
+    chunk = SAMPLE_RATE * chunk_ms // 1000 * 2
+    print(f"{seconds} s of audio in {chunk_ms} ms chunks")
+    print(f"{'path':>10}{'ms total':>10}{'x realtime':>12}")
+    for name, make in (("detector", VoiceActivityDetector), ("gate", lambda: SpeechGate(VoiceActivityDetector(silence_ms=10 ** 9)))):
+        target = make()
+        push = target.process if name == "detector" else target.push
+        started = time.perf_counter()
+        for i in range(0, len(audio), chunk):
+            push(audio[i:i + chunk])
+        elapsed = time.perf_counter() - started
+        print(f"{name:>10}{elapsed * 1000:>10.1f}{seconds / elapsed:>11.0f}x")
+    started = time.perf_counter()
+    trim_silence(audio)
+    elapsed = time.perf_counter() - started
+    print(f"{'trim':>10}{elapsed * 1000:>10.1f}{seconds / elapsed:>11.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--chunk-ms", type=int, default=250)
+    args = parser.parse_args()
+    main(args.seconds, args.chunk_ms)
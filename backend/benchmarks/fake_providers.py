@@ -0,0 +1,206 @@
+"""
+Local stand-ins for the OpenAI and Anthropic HTTP APIs.
+
+A minimal keep-alive HTTP/1.1 server on 127.0.0.1 that answers
+/v1/chat/completions and /v1/messages with canned replies after a
+configurable delay, and counts connections so pooling can be observed.
+"""
+import asyncio
+import json
+import threading
+import time
+
+DEFAULT_REPLY = "مرحبا، كيف أقدر أساعدك اليوم؟"
+
+
+class FakeProviderServer:
+    def __init__(self, latency=0.2, reply=DEFAULT_REPLY, token_delay=0.02, error=None):
+        # latency is seconds, or a callable returning seconds per request;
+        # it is the time to the first token when the client asks to stream.
+        # reply may also be a callable returning the text for each request.
+        # error is an HTTP status line such as "529 Overloaded" (or a
+        # callable returning one, or None) to fail requests with instead.
+        self.latency = latency
+        self.reply = reply
+        self.token_delay = token_delay
+        self.error = error
+        self.connections = 0
+        self.requests = 0
+        self._server = None
+        self._writers = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def stop(self):
+        self._server.close()
+        # Keep-alive connections would otherwise outlive the server
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+
+    def start_in_thread(self):
+        """
+        Serve from a private event loop on a daemon thread, so that clients
+        which block their own loop can still be answered.
+        """
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _delay(self):
+        return self.latency() if callable(self.latency) else self.latency
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                await asyncio.sleep(self._delay())
+                body = json.loads(body or b"{}")
+                error = self.error() if callable(self.error) else self.error
+                if error:
+                    status, payload = error, {"type": "error", "error": {"type": "overloaded_error", "message": error}}
+                elif body.get("stream") and path.endswith("/chat/completions"):
+                    await self._stream_chat(writer, body)
+                    continue
+                elif body.get("stream") and path.endswith("/messages"):
+                    await self._stream_messages(writer, body)
+                    continue
+                else:
+                    status, payload = self._route(method, path, body)
+                data = json.dumps(payload, ensure_ascii=False).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _stream_chat(self, writer, body):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n"
+        )
+        words = self._reply_for(body).split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if i == len(words) - 1 else word + " "},
+                    "finish_reason": None
+                }]
+            }
+            self._write_chunk(writer, f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            await writer.drain()
+        self._write_chunk(writer, "data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _stream_messages(self, writer, body):
+        """Anthropic-style server-sent events for a streamed message."""
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n"
+        )
+
+        def event(name, data):
+            self._write_chunk(writer, f"event: {name}\ndata: {json.dumps({'type': name, **data}, ensure_ascii=False)}\n\n")
+
+        event("message_start", {"message": {
+            "id": "msg-fake", "type": "message", "role": "assistant", "model": body.get("model", "fake"),
+            "content": [], "stop_reason": None, "stop_sequence": None,
+            "usage": {"input_tokens": 20, "output_tokens": 1}
+        }})
+        event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+        words = self._text().split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            text = word if i == len(words) - 1 else word + " "
+            event("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": text}})
+            await writer.drain()
+        event("content_block_stop", {"index": 0})
+        event("message_delta", {"delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": 20}})
+        event("message_stop", {})
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def _write_chunk(self, writer, text):
+        data = text.encode()
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def _route(self, method, path, body):
+        if path.endswith("/chat/completions"):
+            return "200 OK", {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self._reply_for(body)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 20, "completion_tokens": 20, "total_tokens": 40}
+            }
+        if path.endswith("/messages"):
+            return "200 OK", {
+                "id": "msg-fake",
+                "type": "message",
+                "role": "assistant",
+                "model": body.get("model", "fake"),
+                "content": [{"type": "text", "text": self._text()}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": 20, "output_tokens": 20}
+            }
+        return "404 Not Found", {"error": {"message": f"No route for {method} {path}"}}
+
+    def _reply_for(self, body):
+        # Intent analysis expects a JSON object back
+        system = next((m["content"] for m in body.get("messages", []) if m["role"] == "system"), "")
+        if "JSON" in system:
+            return json.dumps({"intent": "دعم", "emotion": "قلق"}, ensure_ascii=False)
+        return self._text()
+
+    def _text(self):
+        return self.reply() if callable(self.reply) else self.reply
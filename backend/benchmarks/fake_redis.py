@@ -0,0 +1,184 @@
+"""
+Local stand-in for a Redis server.
+
+Speaks RESP on 127.0.0.1 and implements the handful of string and list
+commands the storage and session backends use, with key expiry, so
+several app instances can share state in tests and load runs without a
+real Redis. Can also be started from the command line:
+
+    python -m benchmarks.fake_redis --port 6379
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+
+class FakeRedisServer:
+    def __init__(self, password=None, clock=time.monotonic):
+        self.password = password
+        self.clock = clock
+        self.data = {}
+        self.expires = {}
+        self.commands = 0
+        self.connections = 0
+        self._server = None
+        self._writers = set()
+
+    async def start(self, port=0):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.url = f"redis://127.0.0.1:{self.port}/0"
+        return self
+
+    async def stop(self):
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+
+    def start_in_thread(self, port=0):
+        """Serve from a private event loop on a daemon thread."""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start(port))
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        authed = self.password is None
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                self.commands += 1
+                name = command[0].decode().upper()
+                if name == "AUTH":
+                    authed = command[-1].decode() == self.password
+                    reply = "+OK" if authed else "-WRONGPASS invalid password"
+                elif not authed:
+                    reply = "-NOAUTH Authentication required."
+                else:
+                    reply = self._run(name, command[1:])
+                writer.write(_encode_reply(reply))
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            size = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    def _live(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and self.clock() >= expires:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def _run(self, name, args):
+        if name == "PING":
+            return "+PONG"
+        if name == "SELECT":
+            return "+OK"
+        if name == "GET":
+            value = self._live(args[0])
+            if isinstance(value, list):
+                return "-WRONGTYPE Operation against a key holding the wrong kind of value"
+            return value
+        if name == "SET":
+            self.data[args[0]] = args[1]
+            self.expires.pop(args[0], None)
+            options = [a.decode().upper() for a in args[2:]]
+            if "EX" in options:
+                self.expires[args[0]] = self.clock() + int(options[options.index("EX") + 1])
+            return "+OK"
+        if name == "DEL":
+            removed = sum(1 for key in args if self._live(key) is not None)
+            for key in args:
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return removed
+        if name == "EXISTS":
+            return sum(1 for key in args if self._live(key) is not None)
+        if name == "EXPIRE":
+            if self._live(args[0]) is None:
+                return 0
+            self.expires[args[0]] = self.clock() + int(args[1])
+            return 1
+        if name in ("RPUSH", "LPUSH"):
+            values = self._live(args[0])
+            if values is None:
+                values = self.data[args[0]] = []
+            for value in args[1:]:
+                if name == "RPUSH":
+                    values.append(value)
+                else:
+                    values.insert(0, value)
+            return len(values)
+        if name in ("LRANGE", "LTRIM"):
+            values = self._live(args[0]) or []
+            start, stop = _index(int(args[1]), len(values)), _index(int(args[2]), len(values))
+            kept = values[start:stop + 1]
+            if name == "LRANGE":
+                return kept
+            if kept:
+                self.data[args[0]] = kept
+            else:
+                self.data.pop(args[0], None)
+            return "+OK"
+        return f"-ERR unknown command '{name}'"
+
+
+def _index(i, length):
+    return max(0, length + i) if i < 0 else i
+
+
+def _encode_reply(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, str):
+        return (reply + "\r\n").encode()
+    if isinstance(reply, list):
+        return f"*{len(reply)}\r\n".encode() + b"".join(_encode_reply(bytes(item)) for item in reply)
+    return f"${len(reply)}\r\n".encode() + reply + b"\r\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--password")
+    args = parser.parse_args()
+
+    async def serve():
+        server = await FakeRedisServer(password=args.password).start(args.port)
+        print(f"Serving on {server.url}")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
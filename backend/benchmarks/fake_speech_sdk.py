@@ -0,0 +1,281 @@
+"""
+Stand-in for the parts of azure.cognitiveservices.speech the backend uses.
+
+Recognition and synthesis take a configurable latency (a number of
+seconds or a callable returning one per call) and fail with a configurable
+probability, the same way the real SDK reports failures: a Canceled
+result, not an exception. Blocking calls block the calling thread, like
+the real ones, so executor and thread-pool effects show up in benchmarks.
+An object's first call also pays `connect_latency` unless its Connection
+was opened beforehand, as with the service's connection setup.
+
+    from benchmarks import fake_speech_sdk
+    fake_speech_sdk.configure(stt_latency=fake_speech_sdk.lognormal(0.4, 0.3), error_rate=0.01)
+    fake_speech_sdk.install()   # patches services and streaming_stt
+"""
+import enum
+import math
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+DEFAULT_TRANSCRIPT = "ضايق شوي اليوم من الشغل وما أعرف شو أسوي"
+
+settings = {
+    "stt_latency": 0.3,
+    "tts_latency": 0.2,
+    "connect_latency": 0.0,
+    "error_rate": 0.0,
+    "transcript": DEFAULT_TRANSCRIPT,
+    "audio_bytes_per_char": 400,  # ~32 kbit/s MP3 at a normal speaking rate
+    "partial_every_bytes": 16000,  # one partial hypothesis per 0.5 s of PCM
+}
+calls = {"recognize": 0, "synthesize": 0, "continuous": 0, "failed": 0, "connect": 0}
+_rng = random.Random()
+_lock = threading.Lock()
+
+
+def configure(seed=None, **values):
+    unknown = set(values) - set(settings)
+    if unknown:
+        raise TypeError(f"Unknown settings: {sorted(unknown)}")
+    settings.update(values)
+    if seed is not None:
+        _rng.seed(seed)
+    for key in calls:
+        calls[key] = 0
+
+
+def lognormal(median, sigma):
+    """Latency distribution with the given median and a long right tail."""
+    return lambda: _rng.lognormvariate(math.log(median), sigma)
+
+
+def _latency(name):
+    value = settings[name]
+    return value() if callable(value) else value
+
+
+def _fails(kind):
+    with _lock:
+        calls[kind] += 1
+        failed = _rng.random() < settings["error_rate"]
+        if failed:
+            calls["failed"] += 1
+    return failed
+
+
+def install():
+    """Point the backend modules at this fake instead of the Azure SDK."""
+    import sys
+    import services
+    import speech_pool
+    import streaming_stt
+    module = sys.modules[__name__]
+    services.speechsdk = module
+    speech_pool.speechsdk = module
+    streaming_stt.speechsdk = module
+
+
+class ResultReason(enum.Enum):
+    RecognizedSpeech = 3
+    NoMatch = 0
+    Canceled = 1
+    SynthesizingAudioCompleted = 10
+
+
+class CancellationReason(enum.Enum):
+    Error = 1
+
+
+class SpeechSynthesisOutputFormat(enum.Enum):
+    Audio16Khz32KBitRateMonoMp3 = 3
+
+
+class SpeechConfig:
+    def __init__(self, subscription=None, region=None):
+        self.subscription = subscription
+        self.region = region
+        self.speech_recognition_language = None
+        self.speech_synthesis_language = None
+        self.speech_synthesis_voice_name = None
+        self.output_format = None
+
+    def set_speech_synthesis_output_format(self, output_format):
+        self.output_format = output_format
+
+
+class AudioStreamFormat:
+    def __init__(self, samples_per_second=16000, bits_per_sample=16, channels=1):
+        self.samples_per_second = samples_per_second
+
+
+class PushAudioInputStream:
+    def __init__(self, stream_format=None):
+        self.received = 0
+        self.closed = False
+        self._listeners = []
+
+    def write(self, data):
+        self.received += len(data)
+        for listener in self._listeners:
+            listener.on_audio(len(data))
+
+    def close(self):
+        self.closed = True
+        for listener in self._listeners:
+            listener.on_close()
+
+
+class AudioConfig:
+    def __init__(self, filename=None, stream=None, use_default_microphone=False):
+        self.filename = filename
+        self.stream = stream
+
+
+audio = SimpleNamespace(AudioStreamFormat=AudioStreamFormat, PushAudioInputStream=PushAudioInputStream,
+                        AudioConfig=AudioConfig)
+
+
+class _Result:
+    def __init__(self, reason, text="", audio_data=b""):
+        self.reason = reason
+        self.text = text
+        self.audio_data = audio_data
+        self.error_details = "fake provider error" if reason == ResultReason.Canceled else ""
+
+
+class CancellationDetails:
+    def __init__(self, result):
+        self.reason = CancellationReason.Error
+        self.error_details = result.error_details
+
+
+class _Future:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def get(self):
+        return self._fn()
+
+
+class _Signal:
+    def __init__(self):
+        self._handlers = []
+
+    def connect(self, handler):
+        self._handlers.append(handler)
+
+    def fire(self, evt):
+        for handler in self._handlers:
+            handler(evt)
+
+
+class _Connectable:
+    connected = False
+
+    def _ensure_connected(self):
+        if not self.connected:
+            with _lock:
+                calls["connect"] += 1
+            time.sleep(_latency("connect_latency"))
+            self.connected = True
+
+
+class Connection:
+    def __init__(self, target):
+        self.target = target
+        self.connected = _Signal()
+        self.disconnected = _Signal()
+
+    @classmethod
+    def from_recognizer(cls, recognizer):
+        return cls(recognizer)
+
+    @classmethod
+    def from_speech_synthesizer(cls, synthesizer):
+        return cls(synthesizer)
+
+    def open(self, for_continuous_recognition):
+        self.target._ensure_connected()
+        self.connected.fire(SimpleNamespace())
+
+    def close(self):
+        self.target.connected = False
+        self.disconnected.fire(SimpleNamespace())
+
+
+class SpeechRecognizer(_Connectable):
+    def __init__(self, speech_config=None, audio_config=None):
+        self.audio_config = audio_config
+        self.recognizing = _Signal()
+        self.recognized = _Signal()
+        self.session_stopped = _Signal()
+        self.canceled = _Signal()
+        self._heard = 0
+        self._stopped = False
+
+    def recognize_once(self):
+        self._ensure_connected()
+        failed = _fails("recognize")
+        time.sleep(_latency("stt_latency"))
+        if failed:
+            return _Result(ResultReason.Canceled)
+        return _Result(ResultReason.RecognizedSpeech, settings["transcript"])
+
+    # Continuous recognition over a push stream
+
+    def start_continuous_recognition_async(self):
+        def start():
+            self._ensure_connected()
+            calls["continuous"] += 1
+            self.audio_config.stream._listeners.append(self)
+        return _Future(start)
+
+    def stop_continuous_recognition_async(self):
+        def stop():
+            self._stopped = True
+        return _Future(stop)
+
+    def on_audio(self, size):
+        before = self._heard // settings["partial_every_bytes"]
+        self._heard += size
+        after = self._heard // settings["partial_every_bytes"]
+        if after > before:
+            words = settings["transcript"].split()
+            partial = " ".join(words[:min(after, len(words))])
+            self.recognizing.fire(SimpleNamespace(result=_Result(ResultReason.RecognizedSpeech, partial)))
+
+    def on_close(self):
+        failed = _fails("recognize")
+
+        def finish():
+            time.sleep(_latency("stt_latency"))
+            if self._stopped:
+                return
+            if failed:
+                self.canceled.fire(SimpleNamespace(result=_Result(ResultReason.Canceled)))
+                return
+            if self._heard:
+                self.recognized.fire(SimpleNamespace(result=_Result(ResultReason.RecognizedSpeech, settings["transcript"])))
+            self.session_stopped.fire(SimpleNamespace())
+
+        # The service answers from its own thread once the stream is flushed
+        threading.Thread(target=finish, daemon=True).start()
+
+
+class SpeechSynthesizer(_Connectable):
+    def __init__(self, speech_config=None, audio_config=None):
+        self.speech_config = speech_config
+
+    def speak_text_async(self, text):
+        def speak():
+            self._ensure_connected()
+            failed = _fails("synthesize")
+            time.sleep(_latency("tts_latency"))
+            if failed:
+                return _Result(ResultReason.Canceled)
+            return _Result(ResultReason.SynthesizingAudioCompleted,
+                           audio_data=b"\xff\xfb" + bytes(len(text) * settings["audio_bytes_per_char"]))
+        return _Future(speak)
@@ -0,0 +1,424 @@
+"""
+Offline load test of the whole voice backend.
+
+Starts the app under uvicorn with every external dependency replaced by a
+local stand-in: fake OpenAI and Anthropic servers (fake_providers), a fake
+Azure speech SDK (fake_speech_sdk), SQLite for conversation logs and `cat`
+as the audio decoder, so clients send 16 kHz PCM. Latencies of the fakes
+are drawn from lognormal distributions and each can fail at a given rate.
+
+N concurrent sessions per endpoint each run a number of turns against
+/api/voice, /ws and /ws/audio. The report has throughput, outcomes and
+p50/p95/p99 of what the client saw (total, first response delta, first
+audio segment) and of each server stage, interpolated from the
+voice_stage_seconds histograms on /metrics. Run from backend/:
+
+    python -m benchmarks.load_test --sessions 20 --turns 3 --output run.json
+    python -m benchmarks.load_test --baseline run.json --tolerance 0.2
+
+With --baseline the run exits non-zero when a p95/p99 or the throughput
+is worse than the baseline by more than the tolerance.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from benchmarks import fake_speech_sdk
+from benchmarks.fake_providers import FakeProviderServer
+
+ENDPOINTS = ("api_voice", "ws", "ws_audio")
+QUANTILES = (0.5, 0.95, 0.99)
+SAMPLE_RATE = 16000
+CHUNK_BYTES = 3200  # 100 ms of PCM per WebSocket frame
+# Differences below this are noise at these latencies, whatever the ratio
+REGRESSION_FLOOR = 0.01
+
+TRANSCRIPT = "ضايق شوي اليوم من الشغل وما أعرف شو أسوي"
+_replies = itertools.count()
+
+
+def _reply():
+    # A different second sentence each time, so the TTS cache cannot absorb the load
+    return f"الله يعينك، أنا هنا معك. خبرني أكثر عن اللي صار معك اليوم رقم {next(_replies)}."
+
+
+def _pcm(speech_seconds=1.5, silence_seconds=0.3):
+    t = np.arange(int(SAMPLE_RATE * speech_seconds)) / SAMPLE_RATE
+    speech = 8000 * np.sin(2 * np.pi * 220 * t)
+    silence = np.zeros(int(SAMPLE_RATE * silence_seconds))
+    return np.concatenate([speech, silence]).astype("<i2").tobytes()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _pick(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def _summary(values):
+    return {"count": len(values), **{f"p{round(q * 100)}": _pick(values, q) for q in QUANTILES}}
+
+
+# /metrics parsing
+
+_SAMPLE = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def scrape_histogram(text, name):
+    """{labels without le: {le: cumulative count}} for histogram `name`."""
+    series = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if not match or match.group(1) != f"{name}_bucket":
+            continue
+        labels = dict(_LABEL.findall(match.group(2)))
+        le = float(labels.pop("le"))
+        series.setdefault(tuple(sorted(labels.items())), {})[le] = float(match.group(3))
+    return series
+
+
+def histogram_quantile(q, buckets):
+    """
+    Prometheus-style quantile from cumulative bucket counts {le: count},
+    interpolating linearly inside the bucket. None without observations.
+    """
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]] if bounds else 0
+    if not total:
+        return None
+    rank = q * total
+    lower, below = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if math.isinf(bound):
+                # Past the last finite bucket; its bound is the best estimate
+                return lower
+            return lower + (bound - lower) * (rank - below) / max(count - below, 1e-9)
+        lower, below = bound, count
+    return lower
+
+
+def stage_report(before, after):
+    """Per endpoint and stage quantiles of what was observed between two scrapes."""
+    start = scrape_histogram(before, "voice_stage_seconds")
+    report = {}
+    for labels, buckets in scrape_histogram(after, "voice_stage_seconds").items():
+        earlier = start.get(labels, {})
+        delta = {le: count - earlier.get(le, 0) for le, count in buckets.items()}
+        labels = dict(labels)
+        count = int(delta[float("inf")])
+        if count:
+            report.setdefault(labels["endpoint"], {})[labels["stage"]] = {
+                "count": count, **{f"p{round(q * 100)}": histogram_quantile(q, delta) for q in QUANTILES}
+            }
+    return report
+
+
+# The system under test
+
+def _prepare_environment(workdir, openai_url, anthropic_url):
+    """Point the backend at the stand-ins. Must run before `main` is imported."""
+    os.environ.update({
+        "OPENAI_BASE_URL": openai_url + "/v1",
+        "OPENAI_API_KEY": "load-test",
+        "ANTHROPIC_BASE_URL": anthropic_url,
+        "ANTHROPIC_API_KEY": "load-test",
+        "AZURE_SPEECH_KEY": "load-test",
+        "AZURE_SERVICE_REGION": "local",
+        "AUDIO_DECODE_CMD": "cat",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{workdir}/load_test.db",
+        "TTS_CACHE_DIR": f"{workdir}/tts_cache",
+        "ARTIFACT_DIR": f"{workdir}/artifacts",
+        "ARTIFACT_LEGACY_DIR": f"{workdir}/legacy",
+        "LOG_SPILL_PATH": f"{workdir}/conversation_logs.spill.jsonl",
+    })
+
+
+async def _create_tables():
+    from sqlalchemy.ext.asyncio import create_async_engine
+    import database
+    import models  # noqa: F401  registers the tables
+    engine = create_async_engine(database.DATABASE_URL)
+    async with engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.create_all)
+    await engine.dispose()
+
+
+def _start_app(port):
+    import uvicorn
+    import main
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning",
+                                           access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("App failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+
+# Clients
+
+class Turn:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.outcome = "error"
+        self.started = time.perf_counter()
+        self.marks = {}
+
+    def mark(self, name):
+        self.marks.setdefault(name, time.perf_counter() - self.started)
+
+
+async def _api_voice_session(base, client, turns, pcm, results):
+    session = None
+    for _ in range(turns):
+        turn = Turn("api_voice")
+        headers = {"X-Session-Token": session} if session else {}
+        try:
+            response = await client.post(f"{base}/api/voice", headers=headers,
+                                         files={"audio": ("turn.pcm", pcm, "application/octet-stream")})
+            turn.mark("total")
+            if response.status_code == 200:
+                turn.outcome = "ok"
+                session = response.json()["session_token"]
+            elif response.status_code == 503:
+                turn.outcome = "shed"
+        except Exception as e:
+            logging.warning(f"/api/voice turn failed: {e!r}")
+        results.append(turn)
+
+
+async def _read_turn(ws, turn, final_key):
+    """Read one turn's messages, marking first delta and first audio, until its final reply."""
+    while True:
+        message = await ws.recv()
+        if isinstance(message, bytes):
+            turn.mark("first_audio")
+            continue
+        data = json.loads(message)
+        if "response_delta" in data:
+            turn.mark("first_delta")
+        if "tts_segment" in data:
+            turn.mark("first_audio")
+        if "error" in data:
+            turn.outcome = "shed" if "busy" in data["error"] else "error"
+            return
+        if final_key in data:
+            turn.mark("total")
+            turn.outcome = "ok"
+            return
+
+
+async def _ws_session(base, turns, delivery, results):
+    import websockets
+    turn = None
+    try:
+        async with websockets.connect(f"{base}/ws?audio={delivery}", max_size=None) as ws:
+            await ws.recv()
+            for _ in range(turns):
+                turn = Turn("ws")
+                await ws.send(json.dumps({"message": TRANSCRIPT}))
+                await _read_turn(ws, turn, "response")
+                results.append(turn)
+                turn = None
+    except Exception as e:
+        logging.warning(f"/ws session failed: {e!r}")
+    if turn is not None:
+        results.append(turn)
+
+
+async def _ws_audio_session(base, turns, delivery, pcm, pace, results):
+    import websockets
+    session = ""
+    for _ in range(turns):
+        turn = None
+        try:
+            # One connection per utterance, as the browser client does
+            async with websockets.connect(f"{base}/ws/audio?audio={delivery}&session={session}", max_size=None) as ws:
+                session = json.loads(await ws.recv())["session_token"]
+                for i in range(0, len(pcm), CHUNK_BYTES):
+                    await ws.send(pcm[i:i + CHUNK_BYTES])
+                    if pace:
+                        await asyncio.sleep(CHUNK_BYTES / 2 / SAMPLE_RATE / pace)
+                # Latency counts from the end of the utterance
+                turn = Turn("ws_audio")
+                await ws.send(json.dumps({"event": "end"}))
+                await _read_turn(ws, turn, "final_transcript")
+        except Exception as e:
+            logging.warning(f"/ws/audio turn failed: {e!r}")
+            turn = turn or Turn("ws_audio")
+        results.append(turn)
+
+
+async def _drive(port, endpoints, sessions, turns, delivery, pace):
+    import httpx
+    http, ws = f"http://127.0.0.1:{port}", f"ws://127.0.0.1:{port}"
+    pcm = _pcm()
+    results = []
+    limits = httpx.Limits(max_connections=sessions, max_keepalive_connections=sessions)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        before = (await client.get(f"{http}/metrics")).text
+        jobs = []
+        for _ in range(sessions):
+            if "api_voice" in endpoints:
+                jobs.append(_api_voice_session(http, client, turns, pcm, results))
+            if "ws" in endpoints:
+                jobs.append(_ws_session(ws, turns, delivery, results))
+            if "ws_audio" in endpoints:
+                jobs.append(_ws_audio_session(ws, turns, delivery, pcm, pace, results))
+        started = time.perf_counter()
+        await asyncio.gather(*jobs)
+        elapsed = time.perf_counter() - started
+        after = (await client.get(f"{http}/metrics")).text
+    return results, elapsed, stage_report(before, after)
+
+
+def _report(results, elapsed, stages):
+    report = {}
+    for endpoint in sorted({turn.endpoint for turn in results}):
+        turns = [turn for turn in results if turn.endpoint == endpoint]
+        ok = [turn for turn in turns if turn.outcome == "ok"]
+        milestones = sorted({name for turn in ok for name in turn.marks})
+        report[endpoint] = {
+            "turns": len(turns),
+            "ok": len(ok),
+            "shed": sum(1 for turn in turns if turn.outcome == "shed"),
+            "errors": sum(1 for turn in turns if turn.outcome == "error"),
+            "throughput": len(ok) / elapsed,
+            "client": {name: _summary([turn.marks[name] for turn in ok if name in turn.marks]) for name in milestones},
+            "stages": stages.get(endpoint, {}),
+        }
+    return report
+
+
+def compare(current, baseline, tolerance):
+    """Regressions of `current` against `baseline` as human-readable strings."""
+    regressions = []
+    for endpoint, base in baseline["endpoints"].items():
+        now = current["endpoints"].get(endpoint)
+        if now is None:
+            continue
+        if now["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{endpoint} throughput {base['throughput']:.2f} -> {now['throughput']:.2f} turns/s")
+        for group in ("client", "stages"):
+            for name, was in base[group].items():
+                stat = now[group].get(name)
+                if not stat:
+                    continue
+                for key in ("p95", "p99"):
+                    if was.get(key) is None or stat.get(key) is None:
+                        continue
+                    if stat[key] > was[key] * (1 + tolerance) and stat[key] - was[key] > REGRESSION_FLOOR:
+                        regressions.append(f"{endpoint} {name} {key} {was[key] * 1000:.0f} -> {stat[key] * 1000:.0f} ms")
+    return regressions
+
+
+def _print(report):
+    for endpoint, data in report["endpoints"].items():
+        print(f"\n{endpoint}: {data['turns']} turns, {data['ok']} ok, {data['shed']} shed, "
+              f"{data['errors']} errors, {data['throughput']:.2f} turns/s")
+        print(f"{'':>22}{'n':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        rows = [(f"client {k}", v) for k, v in data["client"].items()] + [(f"stage {k}", v) for k, v in data["stages"].items()]
+        for name, stat in rows:
+            cells = "".join(f"{stat[k] * 1000:>9.0f}" if stat[k] is not None else f"{'-':>9}" for k in ("p50", "p95", "p99"))
+            print(f"{name:>22}{stat['count']:>6}{cells}")
+
+
+def main(args):
+    logging.basicConfig(level=logging.WARNING)
+    random.seed(args.seed)
+    fake_speech_sdk.configure(seed=args.seed,
+                              stt_latency=fake_speech_sdk.lognormal(args.stt_latency, args.sigma),
+                              tts_latency=fake_speech_sdk.lognormal(args.tts_latency, args.sigma),
+                              error_rate=args.speech_error_rate, transcript=TRANSCRIPT)
+    llm_latency = fake_speech_sdk.lognormal(args.llm_latency, args.sigma)
+    llm_error = lambda: "529 Overloaded" if random.random() < args.llm_error_rate else None
+    openai_server = FakeProviderServer(latency=llm_latency, reply=_reply, token_delay=args.token_delay,
+                                       error=llm_error).start_in_thread()
+    anthropic_server = FakeProviderServer(latency=llm_latency, reply=_reply, token_delay=args.token_delay,
+                                          error=llm_error).start_in_thread()
+
+    with tempfile.TemporaryDirectory(prefix="load_test_") as workdir:
+        _prepare_environment(workdir, openai_server.base_url, anthropic_server.base_url)
+        asyncio.run(_create_tables())
+        fake_speech_sdk.install()
+        port = _free_port()
+        server, thread = _start_app(port)
+        # The app configures INFO logging when imported; keep the run readable
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+        try:
+            results, elapsed, stages = asyncio.run(
+                _drive(port, args.endpoints, args.sessions, args.turns, args.audio_delivery, args.pace))
+        finally:
+            server.should_exit = True
+            thread.join(timeout=30)
+            openai_server.stop_thread()
+            anthropic_server.stop_thread()
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "elapsed": elapsed,
+        "endpoints": _report(results, elapsed, stages),
+        "fakes": {
+            "speech": dict(fake_speech_sdk.calls),
+            "openai_requests": openai_server.requests,
+            "anthropic_requests": anthropic_server.requests,
+        },
+    }
+    print(f"{args.sessions} sessions x {args.turns} turns on {', '.join(args.endpoints)} in {elapsed:.1f}s")
+    _print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%} of the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%} of the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent sessions per endpoint")
+    parser.add_argument("--turns", type=int, default=3, help="turns per session")
+    parser.add_argument("--endpoints", type=lambda s: s.split(","), default=list(ENDPOINTS))
+    parser.add_argument("--audio-delivery", choices=("url", "binary"), default="url")
+    parser.add_argument("--pace", type=float, default=1.0, help="audio send speed, x real time; 0 sends at once")
+    parser.add_argument("--stt-latency", type=float, default=0.3, help="median seconds")
+    parser.add_argument("--tts-latency", type=float, default=0.2, help="median seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="median seconds to first token")
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--sigma", type=float, default=0.4, help="lognormal spread of the fake latencies")
+    parser.add_argument("--speech-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true")
+    sys.exit(main(parser.parse_args()))
@@ -1,17 +1,24 @@
+from sqlalchemy import insert, tuple_
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from models import ConversationLog
 
-async def log_conversation(db: AsyncSession, session_id: str, user_transcript: str, bot_response: str, intent: str, emotion: str, escalate: bool):
-    log = ConversationLog(
-        session_id=session_id,
-        user_transcript=user_transcript,
-        bot_response=bot_response,
-        intent=intent,
-        emotion=emotion,
-        escalate=escalate
-    )
-    db.add(log)
+async def insert_conversation_logs(db: AsyncSession, rows: list):
+    """Insert many log rows with one multi-row INSERT in one transaction."""
+    if not rows:
+        return
+    await db.execute(insert(ConversationLog).values(rows))
     await db.commit()
-    await db.refresh(log)
-    return log
+
+async def conversation_history(db: AsyncSession, session_id: str, before: tuple = None, limit: int = 50):
+    """
+    One page of a session's turns, newest first. Keyset pagination: `before`
+    is the (created_at, id) of the last row of the previous page, so every
+    page is a range scan on (session_id, created_at) however deep it is.
+    """
+    query = select(ConversationLog).where(ConversationLog.session_id == session_id)
+    if before is not None:
+        query = query.where(tuple_(ConversationLog.created_at, ConversationLog.id) < tuple_(*before))
+    query = query.order_by(ConversationLog.created_at.desc(), ConversationLog.id.desc()).limit(limit)
+    result = await db.execute(query)
+    return result.scalars().all()
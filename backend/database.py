@@ -4,6 +4,9 @@ import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+asyncpg://postgres:postgres@db:5432/omani_therapist")
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Statement logging is for debugging only; it costs a log line per query
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
+
+engine = create_async_engine(DATABASE_URL, echo=SQL_ECHO)
 SessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
@@ -0,0 +1,65 @@
+"""
+Local stand-ins for the Azure speech services, used by tests and offline runs.
+"""
+import asyncio
+import time
+
+
+class FakeStreamingRecognizer:
+    """
+    Recognizer with the same push interface as AzureStreamingRecognizer.
+    Every `bytes_per_word` bytes of PCM reveals the next word of `script`
+    as a partial; closing the stream finalizes the whole script.
+    """
+
+    def __init__(self, script="السلام عليكم", bytes_per_word=3200):
+        self.words = script.split()
+        self.bytes_per_word = bytes_per_word
+        self.received = 0
+        self.started = False
+        self.stopped = False
+
+    def start(self, on_partial, on_final, on_stopped):
+        self.on_partial = on_partial
+        self.on_final = on_final
+        self.on_stopped = on_stopped
+        self.started = True
+
+    def write(self, pcm):
+        before = self.received // self.bytes_per_word
+        self.received += len(pcm)
+        after = self.received // self.bytes_per_word
+        if after > before and before < len(self.words):
+            self.on_partial(" ".join(self.words[:after]))
+
+    def close(self):
+        if self.received:
+            self.on_final(" ".join(self.words))
+        self.on_stopped()
+
+    def stop(self):
+        self.stopped = True
+
+
+class FakeSynthesizer:
+    """
+    Async stand-in for tts_omani. Takes `base_latency` plus `per_char`
+    seconds per call and returns a fake URL numbered in call order.
+    Records (text, started_at, finished_at) so tests can check overlap.
+    """
+
+    def __init__(self, base_latency=0.05, per_char=0.0, fail_on=None):
+        self.base_latency = base_latency
+        self.per_char = per_char
+        self.fail_on = fail_on
+        self.calls = []
+
+    async def __call__(self, text):
+        started = time.perf_counter()
+        index = len(self.calls)
+        self.calls.append([text, started, None])
+        await asyncio.sleep(self.base_latency + self.per_char * len(text))
+        self.calls[index][2] = time.perf_counter()
+        if self.fail_on and self.fail_on in text:
+            raise RuntimeError("synthesis failed")
+        return f"fake://tts/{index}"
@@ -0,0 +1,329 @@
+"""
+Local intent/emotion classifier, the first tier in front of the GPT-4o
+analyze_intent call.
+
+Transcripts are turned into character n-gram features (after the same
+Arabic normalization the safety matcher uses) and scored by two softmax
+linear models, one for intent and one for emotion. A prediction is used
+only when both heads are at least INTENT_LOCAL_THRESHOLD confident;
+anything less goes to the LLM.
+
+The model is trained offline from the intent/emotion columns already
+stored in conversation_logs, using only turns the LLM labelled
+(label_source "llm"): rows from this classifier itself or from the phatic
+allow-list would only teach it what it already says.
+
+    python intent_classifier.py train --out intent_model.json
+    python intent_classifier.py evaluate --model intent_model.json
+
+Both commands read the database at DATABASE_URL, or a JSONL file of
+{"user_transcript", "intent", "emotion", "label_source"} rows given with --input.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import math
+import os
+import random
+import time
+import zlib
+from safety import normalize_arabic
+
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "intent_model.json")
+INTENT_LOCAL_THRESHOLD = float(os.getenv("INTENT_LOCAL_THRESHOLD", "0.85"))
+NGRAM_SIZES = (2, 3, 4)
+MIN_FEATURE_COUNT = 2
+
+# Labels the LLM falls back to when it could not decide; not worth learning
+_UNLABELLED = {None, "", "unknown"}
+# The only label_source trained on
+TRAINING_LABEL_SOURCE = "llm"
+
+
+def features(text):
+    """L2-normalized character n-gram counts of the normalized text."""
+    padded = f" {' '.join(normalize_arabic(text).split())} "
+    counts = {}
+    for n in NGRAM_SIZES:
+        for i in range(len(padded) - n + 1):
+            gram = padded[i:i + n]
+            counts[gram] = counts.get(gram, 0) + 1
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {gram: v / norm for gram, v in counts.items()}
+
+
+def _softmax(scores):
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+class LinearHead:
+    """Multinomial logistic regression over sparse features."""
+
+    def __init__(self, labels, weights, bias):
+        self.labels = labels
+        self.weights = weights  # feature -> per-label weight list
+        self.bias = bias
+
+    def probabilities(self, feats):
+        scores = list(self.bias)
+        for gram, value in feats.items():
+            row = self.weights.get(gram)
+            if row is not None:
+                for k, w in enumerate(row):
+                    scores[k] += w * value
+        return _softmax(scores)
+
+    def predict(self, feats):
+        """Return (label, probability) for the most likely label."""
+        probs = self.probabilities(feats)
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.labels[best], probs[best]
+
+    @classmethod
+    def train(cls, examples, labels, epochs=15, learning_rate=0.5, l2=1e-4, seed=0):
+        """
+        Plain SGD on (features, label) pairs. Features seen fewer than
+        MIN_FEATURE_COUNT times are dropped to keep the model small.
+        """
+        label_names = sorted(set(labels))
+        index = {label: k for k, label in enumerate(label_names)}
+        seen = {}
+        for feats in examples:
+            for gram in feats:
+                seen[gram] = seen.get(gram, 0) + 1
+        weights = {gram: [0.0] * len(label_names) for gram, n in seen.items() if n >= MIN_FEATURE_COUNT}
+        bias = [0.0] * len(label_names)
+        head = cls(label_names, weights, bias)
+
+        order = list(range(len(examples)))
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            rate = learning_rate / (1 + epoch)
+            decay = 1 - rate * l2
+            for i in order:
+                feats = examples[i]
+                probs = head.probabilities(feats)
+                probs[index[labels[i]]] -= 1.0  # gradient of the log loss
+                for k, g in enumerate(probs):
+                    bias[k] -= rate * g
+                for gram, value in feats.items():
+                    row = weights.get(gram)
+                    if row is not None:
+                        for k, g in enumerate(probs):
+                            row[k] = row[k] * decay - rate * g * value
+        return head
+
+    def to_dict(self):
+        return {"labels": self.labels, "bias": self.bias, "weights": self.weights}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["labels"], data["weights"], data["bias"])
+
+
+class IntentClassifier:
+    def __init__(self, intent_head, emotion_head, threshold=None):
+        self.intent_head = intent_head
+        self.emotion_head = emotion_head
+        self.threshold = INTENT_LOCAL_THRESHOLD if threshold is None else threshold
+
+    def predict(self, text):
+        """Return (intent, emotion, confidence); confidence is the weaker head's."""
+        feats = features(text)
+        intent, p_intent = self.intent_head.predict(feats)
+        emotion, p_emotion = self.emotion_head.predict(feats)
+        return intent, emotion, min(p_intent, p_emotion)
+
+    def classify(self, text):
+        """(intent, emotion) if confident enough, otherwise None."""
+        intent, emotion, confidence = self.predict(text)
+        if confidence >= self.threshold:
+            return intent, emotion
+        return None
+
+    @classmethod
+    def train(cls, rows, **kwargs):
+        """Train from (transcript, intent, emotion) rows."""
+        examples = [features(text) for text, _, _ in rows]
+        return cls(
+            LinearHead.train(examples, [intent for _, intent, _ in rows], **kwargs),
+            LinearHead.train(examples, [emotion for _, _, emotion in rows], **kwargs)
+        )
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "ngram_sizes": list(NGRAM_SIZES),
+                "intent": self.intent_head.to_dict(),
+                "emotion": self.emotion_head.to_dict()
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path, threshold=None):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(LinearHead.from_dict(data["intent"]), LinearHead.from_dict(data["emotion"]), threshold)
+
+
+class TierStats:
+    def __init__(self):
+        self.local = 0
+        self.llm = 0
+
+    def stats(self):
+        total = self.local + self.llm
+        return {
+            "model_loaded": intent_model is not None,
+            "threshold": INTENT_LOCAL_THRESHOLD,
+            "local": self.local,
+            "llm": self.llm,
+            "local_rate": self.local / total if total else 0.0,
+        }
+
+
+def _load_default():
+    if not os.path.exists(INTENT_MODEL_PATH):
+        logging.info(f"No intent model at {INTENT_MODEL_PATH}; every turn goes to the LLM")
+        return None
+    try:
+        return IntentClassifier.load(INTENT_MODEL_PATH)
+    except Exception as e:
+        logging.error(f"Failed to load intent model {INTENT_MODEL_PATH}: {e}")
+        return None
+
+
+# Process-wide model used by services.analyze_intent (None: LLM only)
+intent_model = _load_default()
+tier_stats = TierStats()
+
+
+# Offline training and evaluation
+
+def _labelled(rows):
+    return [
+        (text, intent, emotion) for text, intent, emotion in rows
+        if text and intent not in _UNLABELLED and emotion not in _UNLABELLED
+    ]
+
+
+def read_jsonl(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return _labelled(
+        (r.get("user_transcript"), r.get("intent"), r.get("emotion")) for r in rows
+        if r.get("label_source") == TRAINING_LABEL_SOURCE
+    )
+
+
+async def read_database(database_url):
+    from sqlalchemy import select
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from models import ConversationLog
+
+    engine = create_async_engine(database_url)
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                select(ConversationLog.user_transcript, ConversationLog.intent, ConversationLog.emotion)
+                .where(ConversationLog.label_source == TRAINING_LABEL_SOURCE)
+            )
+            return _labelled(result.all())
+    finally:
+        await engine.dispose()
+
+
+def split_holdout(rows, fraction):
+    """Deterministic split by transcript hash, so reruns see the same holdout."""
+    train, holdout = [], []
+    for row in rows:
+        bucket = zlib.crc32(row[0].encode()) % 1000
+        (holdout if bucket < fraction * 1000 else train).append(row)
+    return train, holdout
+
+
+def evaluate(model, rows, thresholds=(0.5, 0.7, 0.8, 0.85, 0.9, 0.95)):
+    """
+    Accuracy of both heads, plus for each threshold the share of turns the
+    local tier would answer and how accurate it is on those.
+    """
+    predictions = []
+    started = time.perf_counter()
+    for text, intent, emotion in rows:
+        predictions.append((model.predict(text), intent, emotion))
+    elapsed = time.perf_counter() - started
+
+    def correct(p, intent, emotion):
+        return p[0] == intent and p[1] == emotion
+
+    report = {
+        "examples": len(rows),
+        "intent_accuracy": sum(p[0] == i for p, i, _ in predictions) / len(rows),
+        "emotion_accuracy": sum(p[1] == e for p, _, e in predictions) / len(rows),
+        "mean_predict_us": elapsed / len(rows) * 1e6,
+        "thresholds": []
+    }
+    for threshold in thresholds:
+        covered = [(p, i, e) for p, i, e in predictions if p[2] >= threshold]
+        report["thresholds"].append({
+            "threshold": threshold,
+            "coverage": len(covered) / len(rows),
+            "accuracy": sum(correct(*c) for c in covered) / len(covered) if covered else None
+        })
+    return report
+
+
+def _print_report(report):
+    print(f"examples:          {report['examples']}")
+    print(f"intent accuracy:   {report['intent_accuracy']:.3f}")
+    print(f"emotion accuracy:  {report['emotion_accuracy']:.3f}")
+    print(f"mean predict time: {report['mean_predict_us']:.1f} us")
+    print("threshold  coverage  accuracy")
+    for t in report["thresholds"]:
+        accuracy = "-" if t["accuracy"] is None else f"{t['accuracy']:.3f}"
+        print(f"{t['threshold']:>9.2f}  {t['coverage']:>8.3f}  {accuracy:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("train", "evaluate"):
+        cmd = sub.add_parser(name)
+        cmd.add_argument("--input", help="JSONL(.gz) of logged turns instead of the database")
+        cmd.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+        cmd.add_argument("--holdout", type=float, default=0.2, help="fraction held out for evaluation")
+    sub.choices["train"].add_argument("--out", default=INTENT_MODEL_PATH)
+    sub.choices["train"].add_argument("--epochs", type=int, default=15)
+    sub.choices["evaluate"].add_argument("--model", default=INTENT_MODEL_PATH)
+    sub.choices["evaluate"].add_argument("--all", action="store_true", help="evaluate on every row, not just the holdout")
+    args = parser.parse_args(argv)
+
+    if args.input:
+        rows = read_jsonl(args.input)
+    elif args.database_url:
+        rows = asyncio.run(read_database(args.database_url))
+    else:
+        parser.error("give --input or set DATABASE_URL")
+    if not rows:
+        parser.error("no labelled turns found")
+    train_rows, holdout = split_holdout(rows, args.holdout)
+
+    if args.command == "train":
+        model = IntentClassifier.train(train_rows, epochs=args.epochs)
+        model.save(args.out)
+        print(f"trained on {len(train_rows)} turns, saved to {args.out}")
+        if holdout:
+            _print_report(evaluate(model, holdout))
+    else:
+        model = IntentClassifier.load(args.model)
+        _print_report(evaluate(model, rows if args.all else holdout or rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Process-wide async clients for the LLM providers.
+
+Each provider gets one client backed by one pooled HTTP connection pool, so
+turns reuse warm keep-alive connections instead of paying a TLS handshake
+per call. Clients are created lazily and closed by the app lifespan.
+"""
+import logging
+import os
+import anthropic
+import httpx
+import openai
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+
+_clients = {}
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+    )
+
+
+def _timeout():
+    # Per-call timeouts passed to create() override the read timeout
+    return httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def get_openai():
+    """Shared AsyncOpenAI client. OPENAI_BASE_URL points it at a stand-in server."""
+    client = _clients.get("openai")
+    if client is None:
+        client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            max_retries=LLM_MAX_RETRIES,
+            http_client=openai.DefaultAsyncHttpxClient(limits=_limits(), timeout=_timeout())
+        )
+        _clients["openai"] = client
+    return client
+
+
+def get_anthropic():
+    """Shared AsyncAnthropic client. ANTHROPIC_BASE_URL points it at a stand-in server."""
+    client = _clients.get("anthropic")
+    if client is None:
+        client = anthropic.AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            base_url=os.getenv("ANTHROPIC_BASE_URL") or None,
+            max_retries=LLM_MAX_RETRIES,
+            http_client=anthropic.DefaultAsyncHttpxClient(limits=_limits(), timeout=_timeout())
+        )
+        _clients["anthropic"] = client
+    return client
+
+
+async def aclose():
+    """Close every pooled client; called on app shutdown."""
+    while _clients:
+        name, client = _clients.popitem()
+        try:
+            await client.close()
+        except Exception as e:
+            logging.error(f"Failed to close {name} client: {e}")
@@ -0,0 +1,342 @@
+"""
+Reply generation across several LLM providers.
+
+Providers are tried in LLM_PROVIDERS order. Each has a CircuitBreaker over
+a rolling window of its recent calls: when too many of them failed or were
+slow, the provider is skipped for LLM_BREAKER_OPEN_SECONDS, after which a
+single probe call decides whether it comes back.
+
+Every request goes to the first healthy provider. If no answer has come
+back after a hedge delay (that provider's recent p95, kept within
+LLM_HEDGE_MIN_DELAY..LLM_HEDGE_MAX_DELAY), the same request is also sent to
+the next provider; the first acceptable answer wins and the other call is
+cancelled. A provider that fails outright is replaced at once. For streams
+"answer" means the first text delta, so the hedge races time to first
+token and the winner's stream is the one passed on.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from llm_clients import get_openai, get_anthropic
+
+LLM_PROVIDERS = [p.strip() for p in os.getenv("LLM_PROVIDERS", "openai,anthropic").split(",") if p.strip()]
+OPENAI_REPLY_MODEL = os.getenv("OPENAI_REPLY_MODEL", "gpt-4o-mini")
+ANTHROPIC_REPLY_MODEL = os.getenv("ANTHROPIC_REPLY_MODEL", "claude-haiku-4-5")
+LLM_HEDGE = os.getenv("LLM_HEDGE", "true").lower() == "true"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "3"))
+LLM_BREAKER_WINDOW = float(os.getenv("LLM_BREAKER_WINDOW", "30"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_SLOW_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "5"))
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "15"))
+
+
+class AllProvidersFailed(Exception):
+    """No provider produced an acceptable answer (or none was available)."""
+
+
+class EmptyReply(Exception):
+    """A provider answered with no text."""
+
+
+class CircuitBreaker:
+    def __init__(self, window=LLM_BREAKER_WINDOW, min_calls=LLM_BREAKER_MIN_CALLS,
+                 error_rate=LLM_BREAKER_ERROR_RATE, slow_seconds=LLM_BREAKER_SLOW_SECONDS,
+                 open_seconds=LLM_BREAKER_OPEN_SECONDS, clock=time.monotonic):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.state = "closed"
+        self.opened = 0
+        self._opened_at = None
+        self._probing = False
+        self._calls = deque()  # (time, ok, latency, lost)
+
+    def _prune(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def allow(self):
+        """Whether a call may go to this provider now."""
+        if self.state == "open" and self.clock() - self._opened_at >= self.open_seconds:
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open":
+            if self._probing:
+                return False
+            self._probing = True
+        return self.state != "open"
+
+    def _bad(self, ok, latency, lost):
+        return not ok or lost or latency > self.slow_seconds
+
+    def record(self, ok, latency, lost=False):
+        """
+        Add a finished call. `lost` marks one cancelled because a hedge
+        answered first: it counts as slow, whatever its cut-short latency.
+        """
+        now = self.clock()
+        bad = self._bad(ok, latency, lost)
+        if self.state == "half_open":
+            self._probing = False
+            if bad:
+                self._open(now)
+            else:
+                self.state = "closed"
+                self._calls.clear()
+        self._calls.append((now, ok, latency, lost))
+        self._prune(now)
+        if self.state == "closed" and len(self._calls) >= self.min_calls:
+            failures = sum(1 for _, ok, latency, lost in self._calls if self._bad(ok, latency, lost))
+            if failures / len(self._calls) >= self.error_rate:
+                self._open(now)
+
+    def abandon(self):
+        """A call was cancelled before it finished; a half-open probe may go again."""
+        self._probing = False
+
+    def _open(self, now):
+        self.state = "open"
+        self.opened += 1
+        self._opened_at = now
+        logging.warning(f"Circuit opened after {len(self._calls)} calls in the window")
+
+    def p95(self):
+        """p95 latency of recent successful calls, or None without enough of them."""
+        self._prune(self.clock())
+        latencies = sorted(latency for _, ok, latency, lost in self._calls if ok and not lost)
+        if len(latencies) < self.min_calls:
+            return None
+        return latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)]
+
+    def stats(self):
+        self._prune(self.clock())
+        return {
+            "state": self.state,
+            "calls": len(self._calls),
+            "errors": sum(1 for _, ok, _, _ in self._calls if not ok),
+            "lost": sum(1 for _, _, _, lost in self._calls if lost),
+            "p95": self.p95(),
+            "opened": self.opened,
+        }
+
+
+class Provider:
+    """
+    One LLM backend: `complete(messages, **params)` returns the reply text
+    and `stream(messages, **params)` yields text deltas. Messages are in
+    OpenAI chat format, system prompt first.
+    """
+
+    def __init__(self, name, complete, stream, enabled=lambda: True, breaker=None):
+        self.name = name
+        self.complete = complete
+        self.stream = stream
+        self.enabled = enabled
+        self.breaker = breaker or CircuitBreaker()
+        self.wins = 0
+
+
+class LLMRouter:
+    def __init__(self, providers, hedge=LLM_HEDGE, min_delay=LLM_HEDGE_MIN_DELAY, max_delay=LLM_HEDGE_MAX_DELAY):
+        self.providers = providers
+        self.hedge = hedge
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.exhausted = 0
+
+    def hedge_delay(self, provider):
+        p95 = provider.breaker.p95()
+        return self.max_delay if p95 is None else min(self.max_delay, max(self.min_delay, p95))
+
+    def _candidates(self):
+        # allow() reserves a half-open probe, so only ask providers as they are needed
+        for provider in self.providers:
+            if provider.enabled() and provider.breaker.allow():
+                yield provider
+
+    async def complete(self, messages, **params):
+        async def attempt(provider):
+            text = (await provider.complete(messages, **params) or "").strip()
+            if not text:
+                raise EmptyReply(provider.name)
+            return text
+
+        _, text = await self._race(attempt)
+        return text
+
+    async def stream(self, messages, **params):
+        """Yield deltas from whichever provider produced a first delta first."""
+        async def attempt(provider):
+            deltas = provider.stream(messages, **params).__aiter__()
+            try:
+                first = await deltas.__anext__()
+            except StopAsyncIteration:
+                raise EmptyReply(provider.name)
+            except BaseException:
+                await deltas.aclose()
+                raise
+            return first, deltas
+
+        async def discard(result):
+            await result[1].aclose()
+
+        _, (first, deltas) = await self._race(attempt, discard)
+        try:
+            yield first
+            async for delta in deltas:
+                yield delta
+        finally:
+            await deltas.aclose()
+
+    async def _race(self, attempt, discard=None):
+        candidates = self._candidates()
+        running = {}
+        launched = {}
+        errors = []
+        won = False
+
+        def launch():
+            provider = next(candidates, None)
+            if provider is None:
+                return False
+            task = asyncio.ensure_future(self._timed(provider, attempt))
+            running[task] = provider
+            launched[task] = time.perf_counter()
+            return True
+
+        if not launch():
+            self.exhausted += 1
+            raise AllProvidersFailed("No LLM provider available")
+        primary = next(iter(running.values()))
+        hedging = self.hedge
+        try:
+            while running:
+                delay = self.hedge_delay(primary) if hedging else None
+                done, _ = await asyncio.wait(running, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The primary is slower than usual; ask the next provider too
+                    hedging = False
+                    if launch():
+                        self.hedged += 1
+                        logging.info(f"Hedging LLM request after {delay:.2f}s")
+                    continue
+                for task in done:
+                    provider = running.pop(task)
+                    if task.exception() is None:
+                        won = True
+                        provider.wins += 1
+                        if provider is not primary:
+                            self.hedge_wins += 1
+                        return provider, task.result()
+                    errors.append(f"{provider.name}: {task.exception()!r}")
+                if not running and launch():
+                    self.failovers += 1
+                    logging.warning(f"LLM failover after {errors[-1]}")
+            self.exhausted += 1
+            raise AllProvidersFailed("; ".join(errors))
+        finally:
+            for task in running:
+                task.cancel()
+            for task, provider in running.items():
+                try:
+                    result = await task
+                except asyncio.CancelledError:
+                    if won:
+                        # Beaten by a hedge: a slow call, or a provider that is
+                        # always hedged could never trip its breaker on latency
+                        provider.breaker.record(True, time.perf_counter() - launched[task], lost=True)
+                    continue
+                except BaseException:
+                    continue
+                if discard is not None:
+                    await discard(result)
+
+    async def _timed(self, provider, attempt):
+        started = time.perf_counter()
+        try:
+            result = await attempt(provider)
+        except asyncio.CancelledError:
+            # No verdict yet; _race records a call that lost to a hedge
+            provider.breaker.abandon()
+            raise
+        except Exception:
+            provider.breaker.record(False, time.perf_counter() - started)
+            raise
+        provider.breaker.record(True, time.perf_counter() - started)
+        return result
+
+    def stats(self):
+        return {
+            "providers": {p.name: {**p.breaker.stats(), "wins": p.wins, "enabled": p.enabled()} for p in self.providers},
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "exhausted": self.exhausted,
+        }
+
+
+# Provider adapters. Clients are looked up per call so they stay lazily created.
+
+async def _openai_complete(messages, max_tokens, temperature, timeout):
+    response = await get_openai().chat.completions.create(
+        model=OPENAI_REPLY_MODEL, messages=messages,
+        max_tokens=max_tokens, temperature=temperature, timeout=timeout
+    )
+    return response.choices[0].message.content
+
+
+async def _openai_stream(messages, max_tokens, temperature, timeout):
+    stream = await get_openai().chat.completions.create(
+        model=OPENAI_REPLY_MODEL, messages=messages,
+        max_tokens=max_tokens, temperature=temperature, timeout=timeout, stream=True
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def _anthropic_params(messages, max_tokens, temperature, timeout):
+    # Current SDKs no longer take a sampling temperature; the model default is used
+    system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+    return {
+        "model": ANTHROPIC_REPLY_MODEL,
+        "system": system,
+        "messages": [m for m in messages if m["role"] != "system"],
+        "max_tokens": max_tokens,
+        "timeout": timeout,
+    }
+
+
+async def _anthropic_complete(messages, max_tokens, temperature, timeout):
+    response = await get_anthropic().messages.create(**_anthropic_params(messages, max_tokens, temperature, timeout))
+    return "".join(block.text for block in response.content if block.type == "text")
+
+
+async def _anthropic_stream(messages, max_tokens, temperature, timeout):
+    stream = await get_anthropic().messages.create(
+        **_anthropic_params(messages, max_tokens, temperature, timeout), stream=True
+    )
+    async for event in stream:
+        if event.type == "content_block_delta" and getattr(event.delta, "text", None):
+            yield event.delta.text
+
+
+_ADAPTERS = {
+    "openai": lambda: Provider("openai", _openai_complete, _openai_stream),
+    # Only used once a key is configured
+    "anthropic": lambda: Provider("anthropic", _anthropic_complete, _anthropic_stream,
+                                  enabled=lambda: bool(os.getenv("ANTHROPIC_API_KEY"))),
+}
+
+router = LLMRouter([_ADAPTERS[name]() for name in LLM_PROVIDERS if name in _ADAPTERS])
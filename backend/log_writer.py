@@ -0,0 +1,162 @@
+"""
+Write-behind conversation logging.
+
+Turns hand their log row to a bounded in-memory queue and move on. A
+background task writes the queue out with one multi-row INSERT per batch,
+flushing when LOG_BATCH_SIZE rows are waiting or LOG_FLUSH_INTERVAL seconds
+after the first one arrived, and straight away for escalation rows. When
+the database is slow or down the batch is retried, the queue fills up and
+submit() waits, so turns slow down instead of memory growing without bound.
+On shutdown the queue is drained; rows that still cannot be written are
+appended to LOG_SPILL_PATH as JSON lines rather than dropped.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from crud import insert_conversation_logs
+import metrics
+
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "100"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "5000"))
+LOG_RETRY_DELAY = float(os.getenv("LOG_RETRY_DELAY", "1.0"))
+LOG_DRAIN_TIMEOUT = float(os.getenv("LOG_DRAIN_TIMEOUT", "10"))
+LOG_SPILL_PATH = os.getenv("LOG_SPILL_PATH", "tmp/conversation_logs.spill.jsonl")
+
+
+class ConversationLogWriter:
+    def __init__(self, session_factory=None, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL,
+                 max_queue=LOG_QUEUE_MAX, retry_delay=LOG_RETRY_DELAY, spill_path=LOG_SPILL_PATH):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.spill_path = spill_path
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.spilled = 0
+        self._queue = asyncio.Queue(max_queue)
+        self._inflight = []
+        self._task = None
+        self._closing = False
+
+    def _sessions(self):
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, session_id, user_transcript, bot_response, intent, emotion, escalate, label_source=None):
+        """Queue one turn for writing; waits only while the queue is full."""
+        if self._closing:
+            raise RuntimeError("Conversation log writer is closed")
+        self.start()
+        await self._queue.put({
+            "session_id": session_id,
+            "user_transcript": user_transcript,
+            "bot_response": bot_response,
+            "intent": intent,
+            "emotion": emotion,
+            "escalate": escalate,
+            "label_source": label_source,
+            # Stamped now, not when the batch is written
+            "created_at": datetime.now(timezone.utc),
+        })
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._write(batch)
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        urgent = batch[0]["escalate"]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and not urgent:
+            try:
+                row = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._closing:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(row)
+            urgent = row["escalate"]
+        return batch
+
+    async def _write(self, batch):
+        self._inflight = batch
+        while True:
+            started = time.perf_counter()
+            try:
+                async with self._sessions()() as session:
+                    await insert_conversation_logs(session, batch)
+                metrics.db_write_seconds.labels("ok").observe(time.perf_counter() - started)
+                metrics.db_rows.labels("written").inc(len(batch))
+                self.written += len(batch)
+                self.batches += 1
+                break
+            except Exception as e:
+                metrics.db_write_seconds.labels("error").observe(time.perf_counter() - started)
+                self.failures += 1
+                logging.error(f"Writing {len(batch)} conversation logs failed: {e}")
+                if self._closing:
+                    self._spill(batch)
+                    break
+                await asyncio.sleep(self.retry_delay)
+        self._inflight = []
+        for _ in batch:
+            self._queue.task_done()
+
+    def _spill(self, rows):
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        with open(self.spill_path, "a", encoding="utf-8") as out:
+            for row in rows:
+                out.write(json.dumps(dict(row, created_at=row["created_at"].isoformat()), ensure_ascii=False) + "\n")
+        self.spilled += len(rows)
+        metrics.db_rows.labels("spilled").inc(len(rows))
+        logging.error(f"Spilled {len(rows)} conversation logs to {self.spill_path}")
+
+    async def close(self, timeout=None):
+        """Stop accepting rows, write out everything queued, then stop."""
+        self._closing = True
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout or LOG_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.error("Timed out draining conversation logs")
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        leftover = list(self._inflight)
+        while not self._queue.empty():
+            leftover.append(self._queue.get_nowait())
+        if leftover:
+            self._spill(leftover)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "spilled": self.spilled,
+        }
+
+
+# Process-wide writer used by the turn pipeline; started on first use and
+# drained by the app lifespan
+conversation_logs = ConversationLogWriter()
@@ -1,21 +1,89 @@
 import logging
 logging.basicConfig(level=logging.INFO)
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request
-from fastapi.responses import JSONResponse
-import aiofiles
-import uuid
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import PlainTextResponse
 import logging
 import os
-import subprocess
-from services import stt_omani, analyze_intent_and_safety, dual_model_response, tts_omani, safety_check
-from sqlalchemy.ext.asyncio import AsyncSession
-from database import SessionLocal
-from crud import log_conversation
+import time
+from services import stt_omani_pcm, prewarm_tts, maintain_speech_pools, STATIC_PHRASES, STT_LANGUAGE, phatic_cache
+from speech_pool import speech_pools
+from pipeline import run_turn, StageFailed, speculation_stats
+from tts_cache import speech_cache
+from artifacts import artifact_store, file_response
+from streaming_stt import StreamingTranscriber
+from tts_pipeline import split_sentences
+from transcoding import transcode_pool, TranscodeError, TranscodeQueueTimeout
+from audio_ingest import iter_multipart_file, decode_to_pcm, UploadTooLarge, AudioTooLong, MissingAudioField, MAX_UPLOAD_BYTES
+from audio_ingest import AudioBuffer, StatusThrottle, WS_AUDIO_BUFFER_BYTES
 from fastapi import WebSocket, WebSocketDisconnect
-import tempfile
 import json
+import asyncio
+from contextlib import asynccontextmanager
+import llm_clients
+from llm_router import router as llm_router
+import intent_classifier
+import log_writer
+import base64
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import SessionLocal
+from crud import conversation_history
+from sessions import session_store, session_token, session_from_token
+from audio_delivery import negotiate, BinaryAudioSender
+from vad import SpeechGate, trim_silence, VAD_AUTO_ENDPOINT
+import admission
+from admission import Overloaded
+import metrics
+import storage
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Render the fixed safety and fallback replies (and their sentences, as
+    # the TTS pipeline requests them) in the background so startup is not held up
+    phrases = []
+    for phrase in STATIC_PHRASES:
+        phrases += [phrase] + [s for s in split_sentences(phrase) if s != phrase]
+    speech_task = asyncio.create_task(maintain_speech_pools(streaming=STT_MODE == "streaming"))
+    prewarm_task = asyncio.create_task(prewarm_tts(phrases))
+    sweeper_task = asyncio.create_task(artifact_store.run_sweeper())
+    yield
+    speech_task.cancel()
+    prewarm_task.cancel()
+    sweeper_task.cancel()
+    speech_pools.close()
+    # Write out queued conversation logs before the database goes away
+    await log_writer.conversation_logs.close()
+    # Drain pooled provider connections on shutdown
+    await llm_clients.aclose()
+    await storage.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+# Client-facing error for a turn that failed at a given pipeline stage
+STAGE_ERRORS = {
+    "prescreen": "Safety check failed.",
+    "intent": "Intent/emotion analysis or safety check failed.",
+    "safety": "Safety check failed.",
+    "respond": "Response generation failed.",
+    "speak": "Text-to-speech failed.",
+    "escalation_audio": "Text-to-speech failed.",
+    "log": "Failed to log conversation.",
+}
+
+# Provider load and circuit state are read from their owners at scrape time
+metrics.watch_admission(admission.limiters)
+metrics.watch_router(llm_router)
+
+BUSY_MESSAGE = "Service busy, please retry."
 
-app = FastAPI()
+def _overloaded(error):
+    """True when a turn was shed by admission control rather than broken."""
+    if isinstance(error, StageFailed):
+        error = error.error
+    return isinstance(error, Overloaded)
+
+# "streaming" recognizes /ws/audio chunks as they arrive, "batch" decodes at the end
+STT_MODE = os.getenv("STT_MODE", "streaming")
 
 # Add CORS middleware
 from fastapi.middleware.cors import CORSMiddleware
@@ -27,113 +95,218 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Dependency to get DB session
-async def get_db():
-    async with SessionLocal() as session:
-        yield session
+async def _cancel_on_disconnect(receive, coro):
+    """
+    Await `coro` while watching the connection; if the client goes away the
+    job is cancelled, which kills any transcoder it started.
+    """
+    task = asyncio.ensure_future(coro)
+
+    async def watch():
+        while True:
+            message = await receive()
+            if message["type"] in ("http.disconnect", "websocket.disconnect"):
+                logging.info("Client disconnected, cancelling transcode")
+                task.cancel()
+                return
 
-@app.post("/api/voice")
-async def process_voice(
-    audio: UploadFile = File(...),
-    db: AsyncSession = Depends(get_db)
-):
+    watcher = asyncio.create_task(watch())
     try:
-        # Save uploaded audio file
-        audio_id = str(uuid.uuid4())
-        ext = os.path.splitext(audio.filename)[1].lower()
-        raw_path = f"tmp/{audio_id}{ext}"
-        async with aiofiles.open(raw_path, 'wb') as out_file:
-            content = await audio.read()
-            await out_file.write(content)
-        # Always convert to wav using ffmpeg (force PCM 16kHz mono)
-        audio_path = f"tmp/{audio_id}.wav"
-        ffmpeg_cmd = [
-            'ffmpeg', '-y', '-i', raw_path, '-ar', '16000', '-ac', '1', '-f', 'wav', audio_path
-        ]
-        ffmpeg_log_path = f"tmp/{audio_id}_ffmpeg.log"
-        with open(ffmpeg_log_path, 'w') as ffmpeg_log:
-            proc = subprocess.run(ffmpeg_cmd, stdout=ffmpeg_log, stderr=ffmpeg_log)
-        if proc.returncode != 0:
-            logging.error(f"ffmpeg conversion failed, see {ffmpeg_log_path}")
-            raise HTTPException(status_code=500, detail="Audio conversion failed.")
-        else:
-            audio_path = raw_path
+        return await task
+    finally:
+        watcher.cancel()
+
+@app.post("/api/voice", openapi_extra={
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"audio": {"type": "string", "format": "binary"}},
+            "required": ["audio"]
+        }}}
+    }
+})
+async def process_voice(request: Request, response: Response):
+    trace_id = metrics.new_trace_id()
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await _voice_turn(request, trace_id)
+        outcome = "ok"
+        response.headers["X-Trace-Id"] = trace_id
+        return result
+    except HTTPException as e:
+        outcome = "shed" if e.status_code == 503 else "error"
+        e.headers = {**(e.headers or {}), "X-Trace-Id": trace_id}
+        raise
+    finally:
+        metrics.turn_seconds.labels("api_voice", outcome).observe(time.perf_counter() - started)
+
+async def _voice_turn(request: Request, trace_id: str):
+    # Clients that keep a conversation going send back the X-Session-Token they were given
+    session_id = session_store.open(request.headers.get("x-session-token"))
+    content_length = int(request.headers.get("content-length") or 0)
+    if content_length > MAX_UPLOAD_BYTES + 64 * 1024:
+        raise HTTPException(status_code=413, detail="Audio upload too large.")
+    try:
+        # Stream the "audio" form field straight into ffmpeg and keep the
+        # 16 kHz mono PCM it produces in memory; only MP4-family uploads,
+        # which ffmpeg may need to seek, are spooled to disk
+        upload = {}
+        with metrics.timed("api_voice", "decode"):
+            pcm = await decode_to_pcm(iter_multipart_file(request, "audio", upload), upload=upload)
+    except (UploadTooLarge, AudioTooLong) as e:
+        logging.warning(f"Rejected upload: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except MissingAudioField as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except TranscodeQueueTimeout:
+        logging.warning("Transcoder queue full, rejecting upload")
+        raise HTTPException(status_code=503, detail="Audio service busy, please retry.")
+    except TranscodeError as e:
+        logging.error(f"ffmpeg conversion failed: {e.stderr.decode(errors='replace')}")
+        raise HTTPException(status_code=500, detail="Audio conversion failed.")
     except Exception as e:
-        logging.exception("Failed to save or convert audio file.")
+        logging.exception("Failed to receive or convert audio.")
         raise HTTPException(status_code=500, detail="Failed to save or convert audio file.")
 
     try:
-        # 1. Speech-to-Text (Omani Arabic)
-        transcript = await stt_omani(audio_path)
+        # 1. Speech-to-Text (Omani Arabic), on the speech only
+        with metrics.timed("api_voice", "stt"):
+            transcript = await stt_omani_pcm(trim_silence(pcm))
+    except Overloaded as e:
+        logging.warning(f"Shedding request: {e}")
+        raise HTTPException(status_code=503, detail=BUSY_MESSAGE, headers={"Retry-After": "1"})
     except Exception as e:
         logging.exception("Speech-to-text failed.")
         raise HTTPException(status_code=500, detail="Speech-to-text failed.")
 
     try:
-        # 2. Intent & Emotion Analysis + Safety Check (parallelized)
-        intent, emotion, safety_result = await analyze_intent_and_safety(transcript)
-        escalate = safety_result["escalate"]
-        if escalate:
-            # Log conversation with escalation
-            await log_conversation(db, audio_id, transcript, safety_result["message"], intent, emotion, True)
-            return JSONResponse({"response": safety_result["message"], "transcript": transcript, "tts_audio_url": ""})
-    except Exception as e:
-        logging.exception("Intent/emotion analysis or safety check failed.")
-        raise HTTPException(status_code=500, detail="Intent/emotion analysis or safety check failed.")
+        # 2-5. Intent, safety, response, TTS and logging as one pipeline
+        ctx = await run_turn(transcript, session_id=session_id, log=True, turn_id=trace_id, endpoint="api_voice")
+    except StageFailed as e:
+        if _overloaded(e):
+            logging.warning(f"Shedding request: {e.error}")
+            raise HTTPException(status_code=503, detail=BUSY_MESSAGE, headers={"Retry-After": "1"})
+        logging.exception(f"Turn failed at stage {e.stage}.")
+        raise HTTPException(status_code=500, detail=STAGE_ERRORS.get(e.stage, "Turn processing failed."))
 
-    try:
-        # 3. Safety & Crisis Check
-        safety_result = await safety_check(transcript, intent, emotion)
-        escalate = safety_result["escalate"]
-        if escalate:
-            # Log conversation with escalation
-            await log_conversation(db, audio_id, transcript, safety_result["message"], intent, emotion, True)
-            return JSONResponse({"response": safety_result["message"], "transcript": transcript, "tts_audio_url": ""})
-    except Exception as e:
-        logging.exception("Safety check failed.")
-        raise HTTPException(status_code=500, detail="Safety check failed.")
+    return {
+        "session_id": session_id,
+        "session_token": session_token(session_id),
+        "trace_id": trace_id,
+        "transcript": transcript,
+        "response": ctx.response_text,
+        "tts_audio_url": ctx.tts_audio_urls[0]
+    }
 
-    try:
-        # 4. Generate bot response using dual-model fallback (GPT-4o primary, Claude Opus 4 fallback)
-        response_text = await dual_model_response(transcript, intent, emotion)
-    except Exception as e:
-        logging.exception("Response generation failed.")
-        raise HTTPException(status_code=500, detail="Response generation failed.")
+# Dependency to get DB session
+async def get_db():
+    async with SessionLocal() as session:
+        yield session
+
+def _encode_cursor(row):
+    return base64.urlsafe_b64encode(f"{row.created_at.isoformat()}|{row.id}".encode()).decode()
+
+def _decode_cursor(cursor):
+    created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(created_at), int(row_id)
 
+@app.get("/api/sessions/{session_id}/history")
+async def session_history(session_id: str, request: Request, before: str = None, limit: int = 20,
+                          db: AsyncSession = Depends(get_db)):
+    """A page of a session's turns, newest first; pass `next` back as `before` for the next page"""
+    # Only the holder of the session's token may read it: Authorization: Bearer <session_token>
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or session_from_token(token.strip()) != session_id:
+        raise HTTPException(status_code=401, detail="A valid session token is required.",
+                            headers={"WWW-Authenticate": "Bearer"})
+    limit = max(1, min(limit, 100))
     try:
-        # 5. Synthesize TTS (Omani Arabic)
-        tts_audio_url = await tts_omani(response_text)
-    except Exception as e:
-        logging.exception("Text-to-speech failed.")
-        raise HTTPException(status_code=500, detail="Text-to-speech failed.")
+        cursor = _decode_cursor(before) if before else None
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=422, detail="Invalid cursor.")
+    rows = await conversation_history(db, session_id, before=cursor, limit=limit)
+    return {
+        "session_id": session_id,
+        "turns": [{
+            "id": row.id,
+            "user_transcript": row.user_transcript,
+            "bot_response": row.bot_response,
+            "intent": row.intent,
+            "emotion": row.emotion,
+            "escalate": row.escalate,
+            "created_at": row.created_at.isoformat() if row.created_at else None
+        } for row in rows],
+        "next": _encode_cursor(rows[-1]) if len(rows) == limit else None
+    }
+
 
-    # Log conversation (no escalation)
-    await log_conversation(db, audio_id, transcript, response_text, intent, emotion, False)
-    return {"transcript": transcript, "response": response_text, "tts_audio_url": tts_audio_url}
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Stage latencies, connections and provider load in Prometheus text format"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
+@app.get("/api/stats")
+async def stats():
+    """Runtime counters for the audio pipeline"""
+    return {
+        "transcode": transcode_pool.stats(),
+        "tts_cache": speech_cache.stats(),
+        "speculation": speculation_stats.stats(),
+        "intent": intent_classifier.tier_stats.stats(),
+        "phatic_cache": phatic_cache.stats(),
+        "conversation_logs": log_writer.conversation_logs.stats(),
+        "sessions": session_store.stats(),
+        "artifacts": artifact_store.stats(),
+        "storage": storage.stats(),
+        "speech_pools": speech_pools.stats(),
+        "admission": admission.stats(),
+        "llm_router": llm_router.stats()
+    }
 
 @app.get("/test")
 async def test_endpoint():
     return {"message": "Test endpoint"}
 
+@app.get("/api/audio/cache/{filename}")
+async def serve_cached_audio(filename: str, request: Request):
+    """Serve synthesized speech from the TTS cache"""
+    response = None
+    if speech_cache.valid_filename(filename):
+        if not os.path.exists(speech_cache.path(filename)):
+            # Synthesized on another node; copy it into this node's cache
+            audio_data = await storage.fetch_audio(filename)
+            if audio_data:
+                await speech_cache.put(filename[:-len(speech_cache.extension)], audio_data)
+        # Content-addressed, so a given URL never changes
+        response = file_response(
+            speech_cache.path(filename), filename, request.headers, cache_control="public, max-age=31536000, immutable"
+        )
+    if response is None:
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    return response
+
 @app.get("/api/audio/{filename}")
-async def serve_audio(filename: str):
-    """Serve audio files for TTS playback"""
-    from fastapi.responses import FileResponse
-    import os
-    
-    file_path = f"tmp/{filename}"
-    if os.path.exists(file_path):
-        return FileResponse(file_path, media_type="audio/wav")
-    else:
+async def serve_audio(filename: str, request: Request):
+    """Serve per-turn audio artifacts"""
+    response = artifact_store.response(filename, request.headers)
+    if response is None and os.path.basename(filename) == filename and not filename.startswith("."):
+        # Files written to tmp/ by older versions, until the sweeper expires them
+        response = file_response(os.path.join(artifact_store.legacy_dir, filename), filename, request.headers)
+    if response is None:
         raise HTTPException(status_code=404, detail="Audio file not found")
+    return response
 
 
 @app.websocket("/ws")
 async def websocket_text_endpoint(websocket: WebSocket):
     """WebSocket endpoint for text-based conversations"""
+    with metrics.track_connection("ws"):
+        await _text_conversation(websocket)
+
+async def _text_conversation(websocket: WebSocket):
     logging.info("Text WebSocket connection attempt received")
-    logging.info(f"WebSocket headers: {websocket.headers}")
     try:
         # Accept connection without origin restrictions
         await websocket.accept()
@@ -141,48 +314,51 @@ async def websocket_text_endpoint(websocket: WebSocket):
     except Exception as e:
         logging.error(f"Failed to accept WebSocket connection: {e}")
         return
+    # One session per connection, or the token of an earlier one to resume it
+    session_id = session_store.open(websocket.query_params.get("session"))
+    # ?audio=binary sends reply audio as frames on this socket instead of URLs
+    delivery = negotiate(websocket.query_params)
+    send_audio = BinaryAudioSender(websocket).send_segment if delivery == "binary" else None
+    await websocket.send_json({"session_id": session_id, "session_token": session_token(session_id),
+                               "audio_delivery": delivery})
     
     try:
         while True:
             # Receive text message
             data = await websocket.receive_text()
-            logging.info(f"Received text message: {data}")
+            logging.debug(f"Received text message of {len(data)} chars")
             
             try:
                 message_data = json.loads(data)
                 user_message = message_data.get("message", "")
                 
                 if user_message:
-                    # 1. Intent & Emotion Analysis
-                    intent, emotion, safety_result = await analyze_intent_and_safety(user_message)
-                    logging.info(f"Intent: {intent}, Emotion: {emotion}")
-                    
-                    # 2. Safety Check
-                    safety_result = await safety_check(user_message, intent, emotion)
-                    escalate = safety_result["escalate"]
-                    
-                    if escalate:
-                        response_text = safety_result["message"]
-                        tts_audio_url = ""
-                    else:
-                        # 3. Generate response
-                        response_text = await dual_model_response(user_message, intent, emotion)
-                        logging.info(f"Response: {response_text}")
-                        
-                        # 4. Text-to-Speech
-                        tts_audio_url = await tts_omani(response_text)
-                        logging.info(f"TTS URL: {tts_audio_url}")
+                    trace_id = metrics.new_trace_id()
+                    started = time.perf_counter()
+                    # Intent, safety, streamed response and per-sentence TTS
+                    ctx = await run_turn(user_message, session_id=session_id, log=True, emit=websocket.send_json,
+                                         send_audio=send_audio, turn_id=trace_id, endpoint="ws")
+                    logging.info(f"Turn {trace_id}: intent {ctx.intent}, emotion {ctx.emotion}")
+                    metrics.turn_seconds.labels("ws", "ok").observe(time.perf_counter() - started)
                     
                     # Send response
                     await websocket.send_text(json.dumps({
+                        "trace_id": trace_id,
                         "transcript": user_message,
-                        "response": response_text,
-                        "tts_audio_url": tts_audio_url
+                        "response": ctx.response_text,
+                        "tts_audio_urls": ctx.tts_audio_urls
                     }))
                     
             except json.JSONDecodeError:
-                logging.error(f"Invalid JSON received: {data}")
+                logging.error(f"Invalid JSON received ({len(data)} chars)")
                 await websocket.send_text(json.dumps({"error": "Invalid JSON format"}))
+            except StageFailed as e:
+                metrics.turn_seconds.labels("ws", "shed" if _overloaded(e) else "error").observe(time.perf_counter() - started)
+                if not _overloaded(e):
+                    raise
+                # Keep the connection; the client can send the message again
+                logging.warning(f"Shedding turn: {e.error}")
+                await websocket.send_json({"error": BUSY_MESSAGE})
                 
     except WebSocketDisconnect:
         logging.info("Text WebSocket disconnected")
@@ -192,125 +368,194 @@ async def websocket_text_endpoint(websocket: WebSocket):
 
 @app.websocket("/ws/audio")
 async def websocket_audio_endpoint(websocket: WebSocket):
+    with metrics.track_connection("ws_audio"):
+        await _audio_conversation(websocket)
+
+async def _audio_conversation(websocket: WebSocket):
     logging.info("WebSocket connection attempt received")
     await websocket.accept()
     logging.info("WebSocket connection accepted")
+    # The client opens one connection per utterance, so it passes back its session token to stay in one session
+    session_id = session_store.open(websocket.query_params.get("session"))
+    # ?audio=binary sends reply audio as frames on this socket instead of URLs
+    delivery = negotiate(websocket.query_params)
+    send_audio = BinaryAudioSender(websocket).send_segment if delivery == "binary" else None
+    await websocket.send_json({"session_id": session_id, "session_token": session_token(session_id),
+                               "audio_delivery": delivery})
     
-    # Create a temporary file to store audio chunks
-    temp_audio = tempfile.NamedTemporaryFile(delete=False, suffix=".webm")
-    audio_chunks = []
+    transcriber = None
+    partials_task = None
+    audio = None
+    received = 0
+    status = StatusThrottle(websocket.send_json)
+    if STT_MODE == "streaming":
+        try:
+            # A pre-connected recognizer from the pool; the gate keeps silence away from
+            # it and detects end of speech
+            transcriber = StreamingTranscriber(recognizers=speech_pools.streaming_recognizers(STT_LANGUAGE),
+                                               gate=SpeechGate(), limiter=admission.limiters["stt"],
+                                               executor=speech_pools.executor)
+            await transcriber.start()
+        except Overloaded as e:
+            # Same admission control as the batch path: shed the stream before any audio is sent
+            logging.warning(f"Shedding audio stream: {e}")
+            await transcriber.aclose()
+            await websocket.send_json({"error": BUSY_MESSAGE})
+            await websocket.close()
+            return
+        except Exception:
+            logging.exception("Streaming STT unavailable, falling back to batch decoding")
+            # Hand back whatever start() got hold of: the stt slot, the recognizer, the decoder
+            if transcriber is not None:
+                await transcriber.aclose()
+            transcriber = None
+    if transcriber is not None:
+        partials_task = asyncio.create_task(_forward_partials(websocket, transcriber))
+    else:
+        # Batch mode keeps one capped in-memory copy of the encoded audio
+        audio = AudioBuffer()
     
     try:
         while True:
             # Use receive() to handle both binary and text messages
-            message = await websocket.receive()
+            message = await _receive_or_endpoint(websocket, transcriber)
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             
-            if "bytes" in message:
+            if message.get("bytes") is not None:
                 # Handle binary audio data
                 data = message["bytes"]
-                logging.info(f"Received {len(data)} bytes")
-                temp_audio.write(data)
-                audio_chunks.append(data)
-                # Send partial transcript update
-                await websocket.send_json({"partial_transcript": "Processing your speech..."})
+                received += len(data)
+                logging.debug(f"Received {len(data)} bytes")
+                if received > WS_AUDIO_BUFFER_BYTES:
+                    logging.warning(f"Audio stream exceeded {WS_AUDIO_BUFFER_BYTES} bytes, closing")
+                    await websocket.send_json({"error": "Audio too long."})
+                    break
+                if transcriber is not None:
+                    # Partial transcripts are pushed by _forward_partials
+                    await transcriber.feed(data)
+                else:
+                    audio.append(data)
+                    # At most one status update per WS_STATUS_INTERVAL, not one per chunk
+                    await status.send({"partial_transcript": "Processing your speech..."})
                 
-            elif "text" in message:
+            elif message.get("text") is not None:
                 # Handle text messages (like end signal)
                 text_data = message["text"]
-                logging.info(f"Received text: {text_data}")
+                logging.debug(f"Received text: {text_data[:200]}")
                 
                 try:
                     json_data = json.loads(text_data)
                     if json_data.get("event") == "end":
                         logging.info("Received end signal from client")
-                        # Close the temp file
-                        temp_audio.close()
+                        pcm = None
+                        trace_id = metrics.new_trace_id()
+                        turn_started = time.perf_counter()
+                        await status.flush()
                         
-                        # Process the complete audio file
-                        audio_id = str(uuid.uuid4())
-                        wav_path = f"tmp/{audio_id}.wav"
-                        
-                        # Convert to wav using ffmpeg
-                        ffmpeg_cmd = [
-                            'ffmpeg', '-y', '-i', temp_audio.name, '-ar', '16000', '-ac', '1', '-f', 'wav', wav_path
-                        ]
-                        proc = subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                        
-                        if proc.returncode != 0:
-                            logging.error(f"ffmpeg conversion failed: {proc.stderr.decode()}")
-                            await websocket.send_json({"error": "Audio conversion failed."})
-                            break
+                        if transcriber is None:
+                            # Decode straight from the buffer; only MP4-family audio is spooled to disk
+                            try:
+                                with metrics.timed("ws_audio", "decode"):
+                                    pcm = await _cancel_on_disconnect(websocket.receive, decode_to_pcm(audio.chunks()))
+                            except TranscodeQueueTimeout:
+                                logging.warning("Transcoder queue full, rejecting audio")
+                                await websocket.send_json({"error": "Audio service busy, please retry."})
+                                break
+                            except AudioTooLong as e:
+                                logging.warning(f"Rejected audio: {e}")
+                                await websocket.send_json({"error": "Audio too long."})
+                                break
+                            except TranscodeError as e:
+                                logging.error(f"ffmpeg conversion failed: {e.stderr.decode(errors='replace')}")
+                                await websocket.send_json({"error": "Audio conversion failed."})
+                                break
+                            finally:
+                                audio.release()
                             
                         # Process the audio with STT
                         try:
-                            # 1. Speech-to-Text (Omani Arabic)
-                            transcript = await stt_omani(wav_path)
-                            logging.info(f"Transcript: {transcript}")
+                            # 1. Speech-to-Text (Omani Arabic), on the speech only
+                            if pcm is not None:
+                                with metrics.timed("ws_audio", "stt"):
+                                    transcript = await stt_omani_pcm(trim_silence(pcm))
+                            else:
+                                # Audio has been recognized while it streamed in
+                                with metrics.timed("ws_audio", "stt"):
+                                    transcript = await transcriber.finish()
+                                partials_task.cancel()
+                            logging.info(f"Turn {trace_id}: transcript of {len(transcript)} chars")
                             
-                            # 2. Intent & Emotion Analysis
-                            intent, emotion, safety_result = await analyze_intent_and_safety(transcript)
-                            logging.info(f"Intent: {intent}, Emotion: {emotion}")
+                            # 2-5. Intent, safety, streamed response and per-sentence TTS
+                            ctx = await run_turn(transcript, session_id=session_id, log=True, emit=websocket.send_json,
+                                                 send_audio=send_audio, turn_id=trace_id, endpoint="ws_audio")
+                            logging.info(f"Turn {trace_id}: intent {ctx.intent}, emotion {ctx.emotion}")
                             
-                            # 3. Safety Check
-                            safety_result = await safety_check(transcript, intent, emotion)
-                            escalate = safety_result["escalate"]
+                            # Send final response
+                            await websocket.send_json({
+                                "trace_id": trace_id,
+                                "final_transcript": transcript,
+                                "response": ctx.response_text,
+                                "tts_audio_urls": ctx.tts_audio_urls
+                            })
                             
-                            if escalate:
-                                await websocket.send_json({
-                                    "final_transcript": transcript,
-                                    "response": safety_result["message"],
-                                    "tts_audio_url": ""
-                                })
-                                
-                                # Close the WebSocket connection gracefully
-                                await websocket.close()
-                            else:
-                                # 4. Generate response
-                                response_text = await dual_model_response(transcript, intent, emotion)
-                                logging.info(f"Response: {response_text}")
-                                
-                                # 5. Text-to-Speech
-                                tts_audio_url = await tts_omani(response_text)
-                                logging.info(f"TTS URL: {tts_audio_url}")
-                                
-                                # Send final response
-                                await websocket.send_json({
-                                    "final_transcript": transcript,
-                                    "response": response_text,
-                                    "tts_audio_url": tts_audio_url
-                                })
-                                
-                                # Close the WebSocket connection gracefully
-                                await websocket.close()
+                            metrics.turn_seconds.labels("ws_audio", "ok").observe(time.perf_counter() - turn_started)
+                            
+                            # Close the WebSocket connection gracefully
+                            await websocket.close()
                                 
                         except Exception as process_error:
-                            logging.exception(f"Error processing audio: {process_error}")
-                            await websocket.send_json({"error": "Failed to process audio."})
+                            metrics.turn_seconds.labels("ws_audio", "shed" if _overloaded(process_error) else "error").observe(
+                                time.perf_counter() - turn_started)
+                            if _overloaded(process_error):
+                                logging.warning(f"Shedding turn: {process_error}")
+                                await websocket.send_json({"error": BUSY_MESSAGE})
+                            else:
+                                logging.exception(f"Error processing audio: {process_error}")
+                                await websocket.send_json({"error": "Failed to process audio."})
                         
-                        # Clean up
-                        try:
-                            os.unlink(temp_audio.name)
-                            os.unlink(wav_path)
-                        except:
-                            pass
-                            
                         break
                         
                 except json.JSONDecodeError:
-                    logging.error(f"Invalid JSON received: {text_data}")
+                    logging.error(f"Invalid JSON received ({len(text_data)} chars)")
                     
     except WebSocketDisconnect:
         logging.info("WebSocket disconnected")
     except Exception as e:
         logging.exception(f"WebSocket error: {e}")
     finally:
-        try:
-            # Make sure temp file is closed and removed
-            if 'temp_audio' in locals():
-                try:
-                    temp_audio.close()
-                    os.unlink(temp_audio.name)
-                except:
-                    pass
-        except Exception as cleanup_error:
-            logging.error(f"Cleanup error: {cleanup_error}")
+        if partials_task is not None:
+            partials_task.cancel()
+        if transcriber is not None:
+            await transcriber.aclose()
+        if audio is not None:
+            audio.release()
+
+
+async def _receive_or_endpoint(websocket: WebSocket, transcriber):
+    """
+    Next client message or, once the VAD hears the speaker stop, an end
+    event of our own so the turn starts without waiting for the client.
+    """
+    if transcriber is None or not VAD_AUTO_ENDPOINT:
+        return await websocket.receive()
+    receive = asyncio.ensure_future(websocket.receive())
+    endpoint = asyncio.ensure_future(transcriber.endpointed.wait())
+    try:
+        await asyncio.wait({receive, endpoint}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        endpoint.cancel()
+        if not receive.done():
+            receive.cancel()
+    if receive.done() and not receive.cancelled():
+        return receive.result()
+    logging.info("End of speech detected, finishing turn")
+    await websocket.send_json({"endpoint": True})
+    return {"type": "websocket.receive", "text": json.dumps({"event": "end", "reason": "endpoint"})}
+
+
+async def _forward_partials(websocket: WebSocket, transcriber: StreamingTranscriber):
+    """Relay recognizer hypotheses to the client as they are produced."""
+    while True:
+        text = await transcriber.partials.get()
+        await websocket.send_json({"partial_transcript": text})
@@ -0,0 +1,228 @@
+"""
+Prometheus metrics for the voice pipeline, served at /metrics.
+
+A small in-process registry that writes the Prometheus text exposition
+format (0.0.4) itself, so the hot path is a dict lookup and a bisect per
+observation, with no extra dependency. Values that other modules already
+track (admission queues, caches, sessions) are read when /metrics is
+scraped rather than mirrored on every change.
+
+Each turn gets a trace id (the pipeline's turn_id). It is returned to the
+client (X-Trace-Id on /api/voice, trace_id in WebSocket messages) and put
+on log lines, so one slow turn can be followed through the logs.
+"""
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Stage and request latencies in seconds: 5 ms .. 30 s
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def new_trace_id():
+    return str(uuid.uuid4())
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} takes labels {self.label_names}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._children.items():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.label_names, values)} {_number(child.value)}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = f'le="{_number(bound) if bound != float("inf") else "+Inf"}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}")
+        labels = _format_labels(self.label_names, values)
+        lines.append(f"{self.name}_sum{labels} {_number(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Callback(_Metric):
+    """A gauge or counter whose samples are read from `fn()` at scrape time."""
+
+    def __init__(self, name, help, labels, fn, kind="gauge"):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in self.fn():
+            lines.append(f"{self.name}{_format_labels(self.label_names, values)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "voice_stage_seconds", "Time spent in one stage of a voice turn.", ("endpoint", "stage")))
+turn_seconds = registry.register(Histogram(
+    "voice_turn_seconds", "Time from receiving a turn's audio or text to its final reply.", ("endpoint", "outcome")))
+db_write_seconds = registry.register(Histogram(
+    "conversation_log_write_seconds", "Time to write one batch of conversation logs.", ("outcome",)))
+db_rows = registry.register(Counter(
+    "conversation_log_rows_total", "Conversation log rows by how they were stored.", ("outcome",)))
+websocket_connections = registry.register(Gauge(
+    "websocket_connections", "Open WebSocket connections.", ("endpoint",)))
+
+
+def observe_stages(endpoint, timings):
+    """Record the finished stages of a pipeline run (TurnContext.timings)."""
+    for stage, timing in timings.items():
+        if timing["status"] in ("ok", "error"):
+            stage_seconds.labels(endpoint, stage).observe(timing["ms"] / 1000)
+
+
+@contextmanager
+def timed(endpoint, stage):
+    """Observe the duration of the block as `stage` of a turn on `endpoint`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.labels(endpoint, stage).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def track_connection(endpoint):
+    """Count an open WebSocket on `endpoint` for the duration of the block."""
+    gauge = websocket_connections.labels(endpoint)
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+def watch_admission(limiters):
+    """Expose the admission limiters' in-flight calls, queues and shedding."""
+    def sample(attr):
+        return lambda: [((name,), getattr(limiter, attr)) for name, limiter in limiters.items()]
+
+    registry.register(Callback("provider_inflight_calls", "Provider calls in flight.", ("provider",), sample("inflight")))
+    registry.register(Callback("provider_queued_calls", "Provider calls waiting for admission.", ("provider",), sample("queued")))
+    registry.register(Callback("provider_concurrency_limit", "Current adaptive concurrency limit.", ("provider",), sample("limit")))
+    registry.register(Callback("provider_rejected_total", "Calls shed because the queue was full.", ("provider",),
+                               sample("rejected"), kind="counter"))
+    registry.register(Callback("provider_queue_timeouts_total", "Calls shed at their queue deadline.", ("provider",),
+                               sample("timed_out"), kind="counter"))
+
+
+def watch_router(router):
+    """Expose each LLM provider's circuit state (0 closed, 1 half open, 2 open) and hedging."""
+    states = {"closed": 0, "half_open": 1, "open": 2}
+    registry.register(Callback("llm_circuit_state", "Circuit breaker state per LLM provider.", ("provider",),
+                               lambda: [((p.name,), states[p.breaker.state]) for p in router.providers]))
+    registry.register(Callback("llm_hedged_requests_total", "LLM requests also sent to a second provider.", (),
+                               lambda: [((), router.hedged)], kind="counter"))
@@ -1,14 +1,32 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean
+from sqlalchemy import Column, BigInteger, Integer, String, Text, DateTime, Boolean, Index, PrimaryKeyConstraint, FetchedValue
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql import func
 from database import Base
 
 class ConversationLog(Base):
+    # On PostgreSQL the table is partitioned by month on created_at, so the
+    # partition key is part of the primary key; see alembic revision 0003 and retention.py
     __tablename__ = "conversation_logs"
-    id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String, index=True)
+    # Serves session history reads in time order; its session_id prefix
+    # also covers plain lookups by session
+    __table_args__ = (Index("ix_conversation_logs_session_id_created_at", "session_id", "created_at"),)
+    # Generated by the database: BIGSERIAL on PostgreSQL, the rowid on SQLite
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, server_default=FetchedValue())
+    session_id = Column(String)
     user_transcript = Column(Text)
     bot_response = Column(Text)
     intent = Column(String)
     emotion = Column(String)
+    # Tier that produced intent/emotion ("llm", "local", "phatic", "prescreen");
+    # the local classifier is trained only on "llm" rows
+    label_source = Column(String)
     escalate = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
+
+
+@compiles(PrimaryKeyConstraint, "sqlite")
+def _sqlite_primary_key(constraint, compiler, **kw):
+    # SQLite (tests, local runs) only generates ids for a lone INTEGER PRIMARY KEY
+    if constraint.table.name == ConversationLog.__tablename__:
+        return "PRIMARY KEY (id)"
+    return compiler.visit_primary_key_constraint(constraint, **kw)
@@ -0,0 +1,425 @@
+"""
+Turn pipeline: the stages of one conversational turn, declared once with
+their dependencies and run as a DAG.
+
+Each stage starts as soon as the stages it depends on have finished, so
+independent stages overlap. A stage whose `when` predicate is false is
+skipped. Every stage is timed and the timings are kept on the context.
+
+With SPECULATIVE_RESPONSE=true, a turn whose transcript passes the keyword
+prescreen starts generating its reply at the same time as intent analysis.
+The draft is buffered and only released to the client once the safety
+decision clears it; if the turn escalates the draft is cancelled.
+"""
+import asyncio
+import logging
+import os
+import time
+import services
+import log_writer
+import sessions
+import metrics
+from safety import safety_matcher
+from admission import Overloaded
+from tts_pipeline import pipeline_events
+
+SPECULATIVE_RESPONSE = os.getenv("SPECULATIVE_RESPONSE", "false").lower() == "true"
+
+
+class StageFailed(Exception):
+    """A stage raised; `stage` names it and the original error is chained."""
+
+    def __init__(self, stage, error):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class Stage:
+    def __init__(self, name, fn, deps=(), when=None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.when = when
+
+
+class TurnContext:
+    """
+    State for one turn. Stage results are stored in `results` by stage
+    name; `emit`, when set, is an async callable used to stream messages
+    to the client (WebSocket turns). `send_audio`, when also set, delivers
+    each audio segment's bytes itself instead of a tts_segment URL.
+    `turn_id` doubles as the trace id; `endpoint` labels the stage metrics.
+    """
+
+    def __init__(self, transcript, session_id=None, log=False, emit=None, send_audio=None,
+                 turn_id=None, endpoint="other"):
+        self.turn_id = turn_id or metrics.new_trace_id()
+        self.endpoint = endpoint
+        self.transcript = transcript
+        self.session_id = session_id or self.turn_id
+        self.log = log
+        self.emit = emit
+        self.send_audio = send_audio
+        self.results = {}
+        self.timings = {}
+        # Work started by a stage that may outlive it; cancelled when the turn ends
+        self.background = []
+
+    @property
+    def intent(self):
+        return self.results["intent"][0]
+
+    @property
+    def emotion(self):
+        return self.results["intent"][1]
+
+    @property
+    def label_source(self):
+        """Which tier labelled the turn: "llm", "local", "phatic" or "prescreen"."""
+        return self.results["intent"][2]
+
+    @property
+    def safety(self):
+        return self.results["safety"]
+
+    @property
+    def escalate(self):
+        return self.results["safety"]["escalate"]
+
+    @property
+    def response_text(self):
+        if self.escalate:
+            return self.safety["message"]
+        return self.results["respond"]["text"]
+
+    @property
+    def tts_audio_urls(self):
+        if self.escalate:
+            return [self.results["escalation_audio"]]
+        respond = self.results["respond"]
+        if "audio_urls" in respond:
+            return respond["audio_urls"]
+        return [self.results["speak"]]
+
+
+class TurnPipeline:
+    def __init__(self, stages):
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = self._topological_order()
+
+    def _topological_order(self):
+        order = []
+        state = {}
+
+        def visit(name, path):
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}' required by '{path[-1]}'")
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Stage cycle: {' -> '.join(path + [name])}")
+            state[name] = "visiting"
+            for dep in self.stages[name].deps:
+                visit(dep, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, [name])
+        return order
+
+    async def run(self, ctx):
+        started = time.perf_counter()
+        tasks = {}
+        for name in self.order:
+            stage = self.stages[name]
+            tasks[name] = asyncio.create_task(
+                self._run_stage(stage, ctx, [tasks[dep] for dep in stage.deps], started)
+            )
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            for task in ctx.background:
+                task.cancel()
+            total_ms = (time.perf_counter() - started) * 1000
+            summary = ", ".join(
+                f"{name}={t['ms']:.0f}ms" if t["status"] == "ok" else f"{name}={t['status']}"
+                for name, t in ctx.timings.items()
+            )
+            logging.info(f"Turn {ctx.turn_id} finished in {total_ms:.0f} ms: {summary}")
+            metrics.observe_stages(ctx.endpoint, ctx.timings)
+        return ctx
+
+    async def _run_stage(self, stage, ctx, deps, turn_started):
+        if deps:
+            await asyncio.gather(*deps)
+        if stage.when is not None and not stage.when(ctx):
+            ctx.timings[stage.name] = {"status": "skipped", "start_ms": 0.0, "ms": 0.0}
+            return
+        started = time.perf_counter()
+        timing = {"status": "running", "start_ms": (started - turn_started) * 1000, "ms": 0.0}
+        ctx.timings[stage.name] = timing
+        try:
+            ctx.results[stage.name] = await stage.fn(ctx)
+            timing["status"] = "ok"
+        except asyncio.CancelledError:
+            timing["status"] = "cancelled"
+            raise
+        except Exception as e:
+            timing["status"] = "error"
+            raise StageFailed(stage.name, e) from e
+        finally:
+            timing["ms"] = (time.perf_counter() - started) * 1000
+
+
+class SpeculativeReply:
+    """
+    A response stream started ahead of the safety decision. Deltas are
+    buffered as they arrive and replayed from the start by `deltas()`, so
+    nothing reaches the client until a stage that ran after safety reads it.
+    """
+
+    def __init__(self, deltas):
+        self.parts = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._consume(deltas))
+
+    async def _consume(self, deltas):
+        try:
+            async for delta in deltas:
+                self.parts.append(delta)
+                self._changed.set()
+        except Exception as e:
+            # Raised again to whoever replays the draft
+            self.error = e
+        finally:
+            self.done = True
+            self._changed.set()
+
+    async def deltas(self):
+        index = 0
+        while True:
+            if index < len(self.parts):
+                yield self.parts[index]
+                index += 1
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                self._changed.clear()
+                await self._changed.wait()
+
+    def tokens(self):
+        """Estimated tokens received so far, by the same estimate as the session budget."""
+        text = "".join(self.parts)
+        return sessions.estimate_tokens(text) if text else 0
+
+    def discard(self):
+        """Cancel the draft; returns the estimated tokens it had already produced."""
+        self.task.cancel()
+        return self.tokens()
+
+
+class SpeculationStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.used_tokens = 0
+        self.wasted_tokens = 0
+
+    def stats(self):
+        speculated = self.hits + self.misses
+        return {
+            "enabled": SPECULATIVE_RESPONSE,
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hit_rate": self.hits / speculated if speculated else 0.0,
+            # Estimated from the draft text received; tokens still in flight
+            # when a draft is cancelled are not seen
+            "used_tokens": self.used_tokens,
+            "wasted_tokens": self.wasted_tokens,
+        }
+
+
+speculation_stats = SpeculationStats()
+
+
+# Stage implementations. Services are looked up at call time so they can
+# be swapped out in tests.
+
+async def _prescreen(ctx):
+    # Keyword scan needs no model output, so it overlaps intent analysis
+    return safety_matcher.first(ctx.transcript)
+
+
+async def _phatic(ctx):
+    # Allow-listed small talk: fixed labels, and a cached reply once one exists
+    eligible = services.phatic_cache.classify(ctx.transcript)
+    if eligible is None:
+        return None
+    key, intent, emotion = eligible
+    return {"key": key, "intent": intent, "emotion": emotion, "reply": services.phatic_cache.get(key)}
+
+
+async def _intent(ctx):
+    phatic = ctx.results["phatic"]
+    if phatic is not None:
+        return phatic["intent"], phatic["emotion"], "phatic"
+    try:
+        return await services.analyze_intent(ctx.transcript)
+    except Overloaded:
+        if ctx.results["prescreen"] is None:
+            raise
+        # The keyword match alone escalates; never shed a crisis turn
+        return "unknown", "unknown", "prescreen"
+
+
+def _speculate(ctx):
+    if not SPECULATIVE_RESPONSE or ctx.results["phatic"] is not None:
+        return False
+    if ctx.results["prescreen"] is not None:
+        speculation_stats.skipped += 1
+        return False
+    return True
+
+
+async def _history(ctx):
+    return await sessions.session_store.history(ctx.session_id)
+
+
+async def _draft(ctx):
+    draft = SpeculativeReply(
+        services.dual_model_response_stream(ctx.transcript, None, None, ctx.results["history"])
+    )
+    ctx.background.append(draft.task)
+    return draft
+
+
+async def _safety(ctx):
+    decision = services.safety_decision(ctx.results["prescreen"], ctx.intent, ctx.emotion)
+    draft = ctx.results.get("draft")
+    if draft is not None and decision["escalate"]:
+        speculation_stats.misses += 1
+        speculation_stats.wasted_tokens += draft.discard()
+    return decision
+
+
+async def _replay(parts):
+    for part in parts:
+        yield part
+
+
+async def _respond(ctx):
+    phatic = ctx.results["phatic"]
+    if phatic is None:
+        return await _generate(ctx, ctx.results["history"])
+    if phatic["reply"] is not None:
+        return await _deliver(ctx, _replay([phatic["reply"]]))
+    # The reply is cached for everyone who says the same thing, so it must
+    # not be written around this session's earlier turns
+    result = await _generate(ctx, [])
+    if result["text"] != services.FALLBACK_RESPONSE:
+        services.phatic_cache.add(phatic["key"], result["text"])
+    return result
+
+
+async def _generate(ctx, history):
+    draft = ctx.results.get("draft")
+    if draft is not None:
+        speculation_stats.hits += 1
+        deltas = draft.deltas()
+    elif ctx.emit is None:
+        text = await services.dual_model_response(ctx.transcript, ctx.intent, ctx.emotion, history)
+        return {"text": text}
+    else:
+        deltas = services.dual_model_response_stream(ctx.transcript, ctx.intent, ctx.emotion, history)
+    try:
+        return await _deliver(ctx, deltas)
+    finally:
+        if draft is not None:
+            speculation_stats.used_tokens += draft.tokens()
+
+
+async def _deliver(ctx, deltas):
+    if ctx.emit is None:
+        return {"text": "".join([delta async for delta in deltas]).strip()}
+    # Streaming clients get deltas and per-sentence audio as they are ready
+    urls = []
+    async for event in pipeline_events(deltas, services.tts_cached):
+        if event["type"] == "delta":
+            await ctx.emit({"response_delta": event["text"]})
+        elif event["type"] == "segment":
+            urls.append(services.tts_url(event["audio"]))
+            await _send_segment(ctx, event["index"], event["text"], event["audio"])
+        else:
+            return {"text": event["text"], "audio_urls": urls}
+
+
+async def _send_segment(ctx, index, text, filename):
+    if ctx.send_audio is not None and filename:
+        await ctx.send_audio(ctx.turn_id, index, text, filename)
+    else:
+        await ctx.emit({"tts_segment": {
+            "index": index, "text": text, "turn_id": ctx.turn_id, "tts_audio_url": services.tts_url(filename)
+        }})
+
+
+async def _speak(ctx):
+    return await services.tts_omani(ctx.results["respond"]["text"])
+
+
+async def _escalation_audio(ctx):
+    # Pre-rendered at startup, so this is a cache hit
+    filename = await services.tts_cached(ctx.safety["message"])
+    if ctx.emit is not None:
+        await _send_segment(ctx, 0, ctx.safety["message"], filename)
+    return services.tts_url(filename)
+
+
+async def _remember(ctx):
+    await sessions.session_store.record(ctx.session_id, ctx.transcript, ctx.response_text)
+
+
+async def _log(ctx):
+    # Queued for the write-behind logger, off the turn's critical path
+    await log_writer.conversation_logs.submit(
+        ctx.session_id, ctx.transcript, ctx.response_text, ctx.intent, ctx.emotion, ctx.escalate,
+        label_source=ctx.label_source
+    )
+
+
+turn_pipeline = TurnPipeline([
+    Stage("prescreen", _prescreen),
+    Stage("phatic", _phatic),
+    Stage("intent", _intent, deps=["phatic", "prescreen"]),
+    Stage("history", _history),
+    Stage("draft", _draft, deps=["prescreen", "phatic", "history"], when=_speculate),
+    Stage("safety", _safety, deps=["prescreen", "intent", "draft"]),
+    Stage("respond", _respond, deps=["safety", "history"], when=lambda ctx: not ctx.escalate),
+    Stage("speak", _speak, deps=["respond"], when=lambda ctx: not ctx.escalate and ctx.emit is None),
+    Stage("escalation_audio", _escalation_audio, deps=["safety"], when=lambda ctx: ctx.escalate),
+    Stage("remember", _remember, deps=["respond", "escalation_audio"]),
+    Stage("log", _log, deps=["respond", "speak", "escalation_audio"], when=lambda ctx: ctx.log),
+])
+
+
+async def run_turn(transcript, session_id=None, log=False, emit=None, send_audio=None, turn_id=None, endpoint="other"):
+    """
+    Run one turn through the shared pipeline and return its context. Without
+    a session id the turn starts a new session of its own.
+    """
+    session_id = session_id or sessions.session_store.new_session()
+    ctx = TurnContext(transcript, session_id=session_id, log=log, emit=emit, send_audio=send_audio,
+                      turn_id=turn_id, endpoint=endpoint)
+    return await turn_pipeline.run(ctx)
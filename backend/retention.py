@@ -0,0 +1,201 @@
+"""
+Partition maintenance and retention for conversation_logs.
+
+conversation_logs is partitioned by month (see Alembic revision 0003). This
+job keeps partitions created LOG_PARTITIONS_AHEAD months ahead, so inserts
+never fall into the default partition, and archives partitions older than
+LOG_RETENTION_MONTHS: each is exported in batches of LOG_ARCHIVE_BATCH rows
+to LOG_ARCHIVE_DIR/<partition>.jsonl.gz, the row count is checked, and only
+then is the partition detached and dropped. Inserts and recent reads only
+ever touch the current month's partition and indexes.
+
+Run it daily, e.g. from cron:
+
+    python retention.py maintain             # create ahead, archive, drop
+    python retention.py maintain --dry-run   # only report what would happen
+    python retention.py list
+
+Setting LOG_RETENTION_MONTHS=0 disables archiving.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timezone
+from sqlalchemy import text
+
+LOG_RETENTION_MONTHS = int(os.getenv("LOG_RETENTION_MONTHS", "12"))
+LOG_PARTITIONS_AHEAD = int(os.getenv("LOG_PARTITIONS_AHEAD", "3"))
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "archive/conversation_logs")
+LOG_ARCHIVE_BATCH = int(os.getenv("LOG_ARCHIVE_BATCH", "5000"))
+
+TABLE = "conversation_logs"
+COLUMNS = ["id", "session_id", "user_transcript", "bot_response", "intent", "emotion", "label_source", "escalate",
+           "created_at"]
+_PARTITION = re.compile(rf"^{TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+
+def add_months(month, n):
+    years, index = divmod(month.month - 1 + n, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def partition_name(month):
+    return f"{TABLE}_y{month:%Y}m{month:%m}"
+
+
+def partition_month(name):
+    """The month a partition holds, or None for the default partition or others."""
+    match = _PARTITION.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def months_to_create(today, ahead=None):
+    """The current month and the `ahead` months after it."""
+    ahead = LOG_PARTITIONS_AHEAD if ahead is None else ahead
+    current = today.replace(day=1)
+    return [add_months(current, n) for n in range(ahead + 1)]
+
+
+def partitions_to_archive(names, today, retention_months=None):
+    """
+    Monthly partitions entirely older than the retention window, oldest
+    first. The window counts the current month, so 12 keeps this month and
+    the eleven before it.
+    """
+    retention_months = LOG_RETENTION_MONTHS if retention_months is None else retention_months
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(today.replace(day=1), -(retention_months - 1))
+    months = [(partition_month(name), name) for name in names]
+    return [name for month, name in sorted(m for m in months if m[0] is not None) if month < cutoff]
+
+
+def _json_row(row):
+    row = dict(row)
+    if isinstance(row.get("created_at"), datetime):
+        row["created_at"] = row["created_at"].isoformat()
+    return row
+
+
+async def export_rows(fetch_batch, path):
+    """
+    Write every row returned by `fetch_batch(after_id)` (batches in id order,
+    empty when done) to a gzipped JSONL file. The file only appears under
+    its final name once complete. Returns the row count.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    part_path = path + ".part"
+    written = 0
+    after = 0
+    with gzip.open(part_path, "wt", encoding="utf-8") as out:
+        while True:
+            rows = await fetch_batch(after)
+            if not rows:
+                break
+            for row in rows:
+                out.write(json.dumps(_json_row(row), ensure_ascii=False) + "\n")
+            written += len(rows)
+            after = rows[-1]["id"]
+    os.replace(part_path, path)
+    return written
+
+
+async def list_partitions(conn):
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :table ORDER BY c.relname"
+    ), {"table": TABLE})
+    return [row[0] for row in result]
+
+
+async def ensure_partitions(conn, today, ahead=None):
+    """Create any missing monthly partitions up to `ahead` months out."""
+    existing = set(await list_partitions(conn))
+    created = []
+    for month in months_to_create(today, ahead):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        end = add_months(month, 1)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{end:%Y-%m-%d} 00:00:00+00')"
+        ))
+        created.append(name)
+    return created
+
+
+async def archive_partition(conn, name, directory=None, batch_size=None):
+    """Export one partition to <directory>/<name>.jsonl.gz, then detach and drop it."""
+    batch_size = batch_size or LOG_ARCHIVE_BATCH
+    path = os.path.join(directory or LOG_ARCHIVE_DIR, f"{name}.jsonl.gz")
+    query = text(f"SELECT {', '.join(COLUMNS)} FROM {name} WHERE id > :after ORDER BY id LIMIT :limit")
+
+    async def fetch_batch(after):
+        result = await conn.execute(query, {"after": after, "limit": batch_size})
+        return [dict(row._mapping) for row in result]
+
+    written = await export_rows(fetch_batch, path)
+    expected = (await conn.execute(text(f"SELECT count(*) FROM {name}"))).scalar()
+    if written != expected:
+        raise RuntimeError(f"Archived {written} rows of {name} but it holds {expected}; not dropping")
+    await conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+    await conn.execute(text(f"DROP TABLE {name}"))
+    logging.info(f"Archived {written} rows of {name} to {path} and dropped it")
+    return path, written
+
+
+async def maintain(engine, today=None, dry_run=False):
+    """Create partitions ahead and archive those past retention; returns a report."""
+    today = today or datetime.now(timezone.utc).date()
+    report = {"created": [], "archived": []}
+    async with engine.connect() as conn:
+        names = await list_partitions(conn)
+        report["partitions"] = names
+        due = partitions_to_archive(names, today)
+        if dry_run:
+            report["created"] = [partition_name(m) for m in months_to_create(today) if partition_name(m) not in names]
+            report["archived"] = due
+            return report
+        # One transaction per step, so a failed archive leaves the others done
+        async with conn.begin():
+            report["created"] = await ensure_partitions(conn, today)
+        for name in due:
+            async with conn.begin():
+                path, rows = await archive_partition(conn, name)
+            report["archived"].append({"partition": name, "path": path, "rows": rows})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["maintain", "list"])
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("set DATABASE_URL or pass --database-url")
+
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    async def run():
+        engine = create_async_engine(args.database_url)
+        try:
+            if args.command == "list":
+                async with engine.connect() as conn:
+                    return {"partitions": await list_partitions(conn)}
+            return await maintain(engine, dry_run=args.dry_run)
+        finally:
+            await engine.dispose()
+
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(asyncio.run(run()), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
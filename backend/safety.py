@@ -0,0 +1,132 @@
+"""
+Keyword matching for the safety check.
+
+Keywords and input are both normalized (diacritics and tatweel removed,
+alef/hamza forms, taa marbuta and alef maqsura folded, Latin lower-cased),
+and every keyword of every category is compiled into one trie-shaped
+regular expression, so a check is a single scan of the text no matter
+how large the lexicon grows.
+"""
+import json
+import os
+import re
+from collections import namedtuple
+
+SAFETY_LEXICON_PATH = os.getenv(
+    "SAFETY_LEXICON_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "safety_lexicon.json")
+)
+
+# Checked in this order when a text matches more than one category
+CATEGORY_PRIORITY = ["crisis", "violence", "referral"]
+
+SafetyMatch = namedtuple("SafetyMatch", ["category", "keyword", "start", "end"])
+
+_FOLD = {
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ؤ": "و", "ئ": "ي", "ى": "ي", "ة": "ه",
+}
+_DROP = re.compile(
+    "[\u0610-\u061a"    # Quranic marks
+    "\u064b-\u065f"     # harakat, tanwin, shadda, sukun
+    "\u0670\u0640"      # superscript alef, tatweel
+    "\u06d6-\u06ed]"    # Quranic annotation signs
+)
+
+
+def normalize_arabic(text):
+    # A handful of C-level replace() calls is several times faster than
+    # str.translate with a mapping table on non-ASCII text
+    text = _DROP.sub("", text)
+    for src, dst in _FOLD.items():
+        if src in text:
+            text = text.replace(src, dst)
+    return text.lower()
+
+
+def _normalize_with_offsets(text):
+    """Normalize and return, for each output character, its index in `text`."""
+    chars = []
+    offsets = []
+    for i, ch in enumerate(text):
+        for out in normalize_arabic(ch):
+            chars.append(out)
+            offsets.append(i)
+    return "".join(chars), offsets
+
+
+def _trie_pattern(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Greedy optional tail, so the longest keyword at a position wins
+        return "(?:" + body + ")?" if "" in node else body
+
+    return build(trie)
+
+
+class SafetyMatcher:
+    def __init__(self, lexicon):
+        self._category = {}
+        for category in CATEGORY_PRIORITY + [c for c in lexicon if c not in CATEGORY_PRIORITY]:
+            for keyword in lexicon.get(category, []):
+                normalized = normalize_arabic(keyword.strip())
+                if normalized:
+                    # A keyword listed twice keeps its higher-priority category
+                    self._category.setdefault(normalized, category)
+        self._rank = {c: i for i, c in enumerate(CATEGORY_PRIORITY)}
+        pattern = _trie_pattern(self._category)
+        self._regex = re.compile(pattern) if pattern else None
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def find_all(self, text):
+        """All keyword matches, with start/end indices into the original text."""
+        if self._regex is None:
+            return []
+        normalized = normalize_arabic(text)
+        hits = self._scan(normalized)
+        if not hits:
+            return []
+        renormalized, offsets = _normalize_with_offsets(text)
+        if renormalized != normalized:
+            # lower() changed length for some character; rescan the mapped text
+            hits = self._scan(renormalized)
+        return [
+            SafetyMatch(self._category[keyword], keyword, offsets[start], offsets[end - 1] + 1)
+            for start, end, keyword in hits
+        ]
+
+    def _scan(self, normalized):
+        # Resume one character after each match start rather than at its end,
+        # so overlapping keywords are all reported, e.g. both "اقتل نفسي"
+        # and the "قتل" inside it. Clean text costs a single search.
+        hits = []
+        pos = 0
+        while True:
+            m = self._regex.search(normalized, pos)
+            if m is None:
+                return hits
+            hits.append((m.start(), m.end(), m.group()))
+            pos = m.start() + 1
+
+    def first(self, text):
+        """The match with the highest-priority category, earliest first; None if clean."""
+        matches = self.find_all(text)
+        if not matches:
+            return None
+        return min(matches, key=lambda m: (self._rank.get(m.category, len(self._rank)), m.start))
+
+
+safety_matcher = SafetyMatcher.from_file(SAFETY_LEXICON_PATH)
@@ -1,89 +1,241 @@
-import openai
-import anthropic
 import azure.cognitiveservices.speech as speechsdk
 import os
-import tempfile
 import asyncio
+import re
+import time
+from collections import OrderedDict
+from contextlib import aclosing
+from llm_clients import get_openai
+from llm_router import router as llm_router
+from tts_cache import speech_cache
+import storage
+from safety import safety_matcher, normalize_arabic
+import intent_classifier
+from admission import limiters, Overloaded
+from speech_pool import speech_pools
 
-async def stt_omani(audio_path):
+INTENT_TIMEOUT = float(os.getenv("INTENT_TIMEOUT", "10"))
+RESPONSE_TIMEOUT = float(os.getenv("RESPONSE_TIMEOUT", "10"))
+
+# Saudi Arabic voice is used as primary (faster and more reliable than ar-OM)
+TTS_VOICE = os.getenv("TTS_VOICE", "ar-SA-HamedNeural")
+TTS_LANGUAGE = os.getenv("TTS_LANGUAGE", "ar-SA")
+TTS_OUTPUT_FORMAT = "Audio16Khz32KBitRateMonoMp3"
+STT_LANGUAGE = os.getenv("STT_LANGUAGE", "ar-OM")
+# Origin clients fetch audio from: the load balancer's address when there are several nodes
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8000").rstrip("/")
+
+async def stt_omani_pcm(pcm):
     """
-    Uses Azure Speech-to-Text to transcribe Omani Arabic audio.
-    Assumes audio_path is a WAV file (16kHz, mono recommended).
+    Transcribes 16 kHz mono 16-bit PCM held in memory, without a WAV file.
     """
-    speech_key = os.getenv("AZURE_SPEECH_KEY")
-    service_region = os.getenv("AZURE_SERVICE_REGION")
-    speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=service_region)
-    speech_config.speech_recognition_language = "ar-OM"
-    audio_input = speechsdk.AudioConfig(filename=audio_path)
-    speech_recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_input)
-    result = speech_recognizer.recognize_once()
+    async with limiters["stt"].slot() as permit:
+        # A recognizer built and connected ahead of time, with its own push stream
+        async with speech_pools.recognizers(STT_LANGUAGE).lease() as lease:
+            result = await speech_pools.run(lease.obj.recognize_pcm, pcm)
+            if result.reason == speechsdk.ResultReason.Canceled:
+                permit.fail()
+                lease.fail()
     if result.reason == speechsdk.ResultReason.RecognizedSpeech:
         return result.text.strip()
     else:
         return ""
 
 async def analyze_intent(text):
+    """
+    Returns (intent, emotion, source): the local classifier answers when it
+    is confident (source "local"); otherwise the text goes to GPT-4o ("llm").
+    """
+    model = intent_classifier.intent_model
+    if model is not None:
+        local = model.classify(text)
+        if local is not None:
+            intent_classifier.tier_stats.local += 1
+            return (*local, "local")
+    intent_classifier.tier_stats.llm += 1
+    return (*await analyze_intent_llm(text), "llm")
+
+async def analyze_intent_llm(text):
     """
     Uses OpenAI GPT-4o to analyze intent and emotion from the user's text.
     Returns (intent, emotion) as strings.
     """
+    import json
+    
     system_prompt = (
         "أنت محلل نفسي عماني محترف. استخرج نية المستخدم (استشارة، أزمة، دعم، إلخ) "
         "واستخرج الشعور الأساسي (قلق، حزن، غضب، أمل، إلخ) من النص التالي. "
         "أجب فقط بصيغة JSON: {\"intent\": intent, \"emotion\": emotion}"
     )
-    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": text}
-        ],
-        temperature=0.2,
-        max_tokens=100
-    )
-    import json
-    import re
-    response = completion.choices[0].message.content
-    match = re.search(r'\{.*\}', response, re.DOTALL)
-    if match:
-        data = json.loads(match.group(0))
-        return data.get("intent", "unknown"), data.get("emotion", "unknown")
-    return "unknown", "unknown"
+    async with limiters["llm"].slot():
+        completion = await get_openai().chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": text}
+            ],
+            temperature=0.2,
+            max_tokens=100,
+            timeout=INTENT_TIMEOUT,
+            response_format={"type": "json_object"}
+        )
+    try:
+        data = json.loads(completion.choices[0].message.content)
+    except (TypeError, ValueError):
+        return "unknown", "unknown"
+    return data.get("intent", "unknown"), data.get("emotion", "unknown")
+
+CRISIS_MESSAGE = "يبدو أنك تمر بأزمة حرجة. أنصحك بالتواصل فوراً مع جهة طوارئ أو مختص نفسي. هل ترغب في الاتصال بخط المساعدة الوطني: 1234؟"
+VIOLENCE_MESSAGE = "تم رصد إشارات عنف. سيتم تصعيد الجلسة لمختص فوراً حفاظاً على سلامتك وسلامة الآخرين."
+REFERRAL_MESSAGE = "يبدو أنك بحاجة لدعم مختص. هل ترغب في التواصل مع طبيب أو مستشفى معتمد؟"
+DISTRESS_MESSAGE = "أشعر أنك تمر بمشاعر صعبة جداً. أنصحك بالتواصل مع مختص أو جهة دعم فوراً."
+FALLBACK_RESPONSE = "أعتذر، حدث خطأ تقني. هل يمكنك إعادة المحاولة؟"
+
+# Fixed replies that are pre-rendered into the TTS cache at startup
+STATIC_PHRASES = [CRISIS_MESSAGE, VIOLENCE_MESSAGE, REFERRAL_MESSAGE, DISTRESS_MESSAGE, FALLBACK_RESPONSE]
+# Safety replies; their speech is never shed by admission control
+ESCALATION_MESSAGES = {CRISIS_MESSAGE, VIOLENCE_MESSAGE, REFERRAL_MESSAGE, DISTRESS_MESSAGE}
+
+PHATIC_CACHE_TTL = float(os.getenv("PHATIC_CACHE_TTL", "3600"))
+PHATIC_CACHE_MAX_ENTRIES = int(os.getenv("PHATIC_CACHE_MAX_ENTRIES", "256"))
+PHATIC_CACHE_VARIANTS = int(os.getenv("PHATIC_CACHE_VARIANTS", "3"))
+
+# Non-clinical small talk whose replies may be reused: class -> (intent, emotion, phrases).
+# Only a whole utterance matching one of these phrases is eligible.
+PHATIC_PHRASES = {
+    "greeting": ("تحية", "محايد", [
+        "مرحبا", "هلا", "هلا والله", "أهلا", "أهلين", "السلام عليكم", "السلام عليكم ورحمة الله",
+        "صباح الخير", "مساء الخير", "كيف حالك", "شلونك", "كيف الحال",
+    ]),
+    "thanks": ("شكر", "امتنان", [
+        "شكرا", "شكرا لك", "شكرا جزيلا", "مشكور", "تسلم", "يعطيك العافية", "الله يعطيك العافية",
+    ]),
+    "farewell": ("وداع", "محايد", [
+        "مع السلامة", "في أمان الله", "باي", "تصبح على خير", "إلى اللقاء",
+    ]),
+}
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+def normalize_utterance(text):
+    return " ".join(_PUNCTUATION.sub(" ", normalize_arabic(text)).split())
+
+class PhaticCache:
+    """
+    Reply cache for allow-listed small talk. Entries are keyed on the
+    normalized utterance plus intent/emotion, hold up to `variants` replies
+    that are handed out in rotation, expire after `ttl` seconds and are
+    evicted least-recently-used first beyond `max_entries`.
+    """
+
+    def __init__(self, phrases=PHATIC_PHRASES, ttl=PHATIC_CACHE_TTL, max_entries=PHATIC_CACHE_MAX_ENTRIES, variants=PHATIC_CACHE_VARIANTS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.variants = variants
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._allow = {}
+        for category, (intent, emotion, utterances) in phrases.items():
+            for utterance in utterances:
+                self._allow[normalize_utterance(utterance)] = (intent, emotion)
+        self._entries = OrderedDict()  # key -> {"replies", "next", "expires"}
+
+    def classify(self, text):
+        """
+        (key, intent, emotion) if `text` is eligible, otherwise None. Never
+        eligible when the safety matcher finds anything in it.
+        """
+        utterance = normalize_utterance(text)
+        labels = self._allow.get(utterance)
+        if labels is None or safety_matcher.first(text) is not None:
+            return None
+        return (utterance,) + labels, labels[0], labels[1]
+
+    def get(self, key, now=None):
+        """A cached reply, rotating through the variants; None until all variants exist."""
+        now = time.monotonic() if now is None else now
+        entry = self._entries.get(key)
+        if entry is not None and entry["expires"] <= now:
+            del self._entries[key]
+            entry = None
+        if entry is None or len(entry["replies"]) < self.variants:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        reply = entry["replies"][entry["next"]]
+        entry["next"] = (entry["next"] + 1) % len(entry["replies"])
+        return reply
+
+    def add(self, key, reply, now=None):
+        now = time.monotonic() if now is None else now
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = {"replies": [], "next": 0, "expires": now + self.ttl}
+            self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if reply not in entry["replies"] and len(entry["replies"]) < self.variants:
+            entry["replies"].append(reply)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+# Process-wide cache used by the turn pipeline
+phatic_cache = PhaticCache()
 
 async def safety_check(text, intent, emotion):
     """
     Advanced safety check for Crisis, self-harm, violence, and escalation triggers.
     Returns escalation status and appropriate message.
     """
-    crisis_keywords = [
-        "انتحار", "أنتحر", "أقتل نفسي", "أموت", "أموت نفسي", "suicide", "kill myself", "die", "self-harm", "إيذاء نفسي"
-    ]
-    violence_keywords = [
-        "قتل", "عنف", "أؤذي أحد", "أؤذي شخص", "violence", "harm someone"
-    ]
-    referral_keywords = [
-        "طبيب نفسي", "مستشفى", "مساعدة مختص", "أحتاج مختص", "أحتاج طبيب", "أحتاج علاج", "أحتاج دعم"
-    ]
-    if any(k in text for k in crisis_keywords) or intent == "crisis":
+    return safety_decision(safety_matcher.first(text), intent, emotion)
+
+def safety_decision(match, intent, emotion):
+    """
+    Escalation decision from a keyword match (safety_matcher.first, or None)
+    plus the analyzed intent and emotion. Lets a caller that has already
+    scanned the text decide without scanning it again.
+    """
+    category = match.category if match else None
+    if category == "crisis" or intent == "crisis":
         return {
             "escalate": True,
-            "message": "يبدو أنك تمر بأزمة حرجة. أنصحك بالتواصل فوراً مع جهة طوارئ أو مختص نفسي. هل ترغب في الاتصال بخط المساعدة الوطني: 1234؟"
+            "category": "crisis",
+            "match": match._asdict() if match else None,
+            "message": CRISIS_MESSAGE
         }
-    if any(k in text for k in violence_keywords):
+    if category == "violence":
         return {
             "escalate": True,
-            "message": "تم رصد إشارات عنف. سيتم تصعيد الجلسة لمختص فوراً حفاظاً على سلامتك وسلامة الآخرين."
+            "category": "violence",
+            "match": match._asdict(),
+            "message": VIOLENCE_MESSAGE
         }
-    if any(k in text for k in referral_keywords):
+    if category == "referral":
         return {
             "escalate": True,
-            "message": "يبدو أنك بحاجة لدعم مختص. هل ترغب في التواصل مع طبيب أو مستشفى معتمد؟"
+            "category": "referral",
+            "match": match._asdict(),
+            "message": REFERRAL_MESSAGE
         }
     if emotion in ["يأس", "حزن شديد", "غضب شديد", "خوف شديد"]:
         return {
             "escalate": True,
-            "message": "أشعر أنك تمر بمشاعر صعبة جداً. أنصحك بالتواصل مع مختص أو جهة دعم فوراً."
+            "category": "distress",
+            "match": None,
+            "message": DISTRESS_MESSAGE
         }
     return {"escalate": False}
 
@@ -96,108 +248,200 @@ def _cultural_clinical_prompt(text, intent, emotion):
         f"نية المستخدم: {intent}\nشعور المستخدم: {emotion}\nالنص: {text}"
     )
 
-async def dual_model_response(text, intent, emotion):
-    """
-    Ultra-fast response generation optimized for Omani Arabic conversations.
-    Uses GPT-4o-mini for instant responses with cultural adaptation.
-    """
-    import logging
-    
-    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
+def _response_messages(text, intent, emotion, history=None):
     # Optimized system prompt for faster processing
     system_prompt = (
         "أنت معالج نفسي عماني. تحدث باللهجة العمانية بشكل طبيعي ومريح. "
         "قدم ردود قصيرة ومفيدة (50-100 كلمة). راعِ القيم الإسلامية والثقافة العمانية. "
-        f"المشاعر: {emotion}، النية: {intent}"
     )
+    # Speculative replies start before intent analysis and go without it
+    if intent is not None:
+        system_prompt += f"المشاعر: {emotion}، النية: {intent}"
+    messages = [{"role": "system", "content": system_prompt}]
+    # Recent turns of the session, oldest first
+    for user_text, bot_text in history or ():
+        messages.append({"role": "user", "content": user_text})
+        messages.append({"role": "assistant", "content": bot_text})
+    messages.append({"role": "user", "content": text})
+    return messages
+
+async def dual_model_response(text, intent, emotion, history=None):
+    """
+    Ultra-fast response generation optimized for Omani Arabic conversations.
+    Uses GPT-4o-mini for instant responses with cultural adaptation, hedged
+    to the next provider in llm_router when it is slow or failing.
+    """
+    import logging
     
     try:
         # Use GPT-4o-mini for ultra-fast responses
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": text}
-            ],
-            temperature=0.8,  # Slightly higher for more natural responses
-            max_tokens=150,   # Reduced for faster response
-            timeout=10        # 10 second timeout for instant response
-        )
+        async with limiters["llm"].slot():
+            result = await llm_router.complete(
+                _response_messages(text, intent, emotion, history),
+                temperature=0.8,  # Slightly higher for more natural responses
+                max_tokens=150,   # Reduced for faster response
+                timeout=RESPONSE_TIMEOUT  # 10 second timeout for instant response
+            )
         
-        result = response.choices[0].message.content.strip()
         logging.info(f"Generated response in Omani Arabic: {len(result)} characters")
         return result
         
+    except Overloaded:
+        # Shed load: the caller answers 503 rather than a canned apology
+        raise
     except Exception as e:
         logging.error(f"Response generation failed: {e}")
         # Fallback response in Omani Arabic
-        return "أعتذر، حدث خطأ تقني. هل يمكنك إعادة المحاولة؟"
+        return FALLBACK_RESPONSE
 
-async def analyze_intent_and_safety(text):
-    intent_emotion_task = asyncio.create_task(analyze_intent(text))
-    # Wait for intent/emotion to finish, then run safety check
-    intent, emotion = await intent_emotion_task
-    safety_task = asyncio.create_task(safety_check(text, intent, emotion))
-    safety_result = await safety_task
-    return intent, emotion, safety_result
+async def dual_model_response_stream(text, intent, emotion, history=None):
+    """
+    Streaming variant of dual_model_response: yields text deltas as the
+    model emits them. Falls back to the canned apology only if nothing has
+    been produced yet; a stream that breaks midway just ends early.
+    """
+    import logging
+    
+    produced = 0
+    try:
+        # The slot is held until the stream is finished
+        async with limiters["llm"].slot(), aclosing(llm_router.stream(
+            _response_messages(text, intent, emotion, history),
+            temperature=0.8,
+            max_tokens=150,
+            timeout=RESPONSE_TIMEOUT
+        )) as stream:
+            async for delta in stream:
+                produced += len(delta)
+                yield delta
+        logging.info(f"Streamed response in Omani Arabic: {produced} characters")
+    except Overloaded:
+        raise
+    except Exception as e:
+        logging.error(f"Response streaming failed: {e}")
+        if not produced:
+            yield FALLBACK_RESPONSE
 
-async def tts_omani(text):
+async def synthesize_speech(text):
+    """
+    Synthesizes `text` with Azure TTS and returns the MP3 bytes, or None on failure.
+    """
     import logging
-    import uuid
     
     speech_key = os.getenv("AZURE_SPEECH_KEY")
     service_region = os.getenv("AZURE_SERVICE_REGION")
     
     if not speech_key or not service_region:
         logging.error("Azure Speech credentials not found")
-        return ""
+        return None
     
-    # Prioritize Omani Arabic voice for instant response
-    voice_name = "ar-SA-HamedNeural"  # Use Saudi Arabic as primary (faster and more reliable)
-    language = "ar-SA"
+    voice_name = TTS_VOICE
     
     try:
-        speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=service_region)
-        speech_config.speech_synthesis_language = language
-        speech_config.speech_synthesis_voice_name = voice_name
-        
-        # Set output format for optimization
-        speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat.Audio16Khz32KBitRateMonoMp3)
-        
-        # Create synthesizer without audio config to get audio data directly
-        synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-        
-        # Use executor for non-blocking synthesis
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, lambda: synthesizer.speak_text_async(text).get())
+        async with limiters["tts"].slot(priority=text in ESCALATION_MESSAGES) as permit:
+            # A connected synthesizer for the voice, reused across turns
+            async with speech_pools.synthesizers(voice_name, TTS_LANGUAGE, TTS_OUTPUT_FORMAT).lease() as lease:
+                result = await speech_pools.run(lambda: lease.obj.speak_text_async(text).get())
+                if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+                    permit.fail()
+                    lease.fail()
         
         logging.info(f"TTS attempt with {voice_name}: {result.reason}")
         
         if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-            audio_id = str(uuid.uuid4())
-            filename = f"{audio_id}.wav"
-            filepath = f"tmp/{filename}"
-            
-            # Ensure tmp directory exists
-            os.makedirs("tmp", exist_ok=True)
-            
-            # Write audio data immediately
-            with open(filepath, "wb") as out:
-                out.write(result.audio_data)
-            
-            logging.info(f"TTS success with {voice_name}: {filepath}, size: {len(result.audio_data)} bytes")
-            # Return absolute URL that frontend can access from different port
-            return f"http://localhost:8000/api/audio/{filename}"
+            logging.info(f"TTS success with {voice_name}, size: {len(result.audio_data)} bytes")
+            return result.audio_data
         elif result.reason == speechsdk.ResultReason.Canceled:
             cancellation_details = speechsdk.CancellationDetails(result)
             logging.error(f"TTS canceled with {voice_name}: {cancellation_details.reason}, {cancellation_details.error_details}")
         else:
             logging.error(f"TTS failed with {voice_name}: {result.reason}")
             
+    except Overloaded as e:
+        # Degrade to a text-only reply instead of queueing behind a saturated TTS
+        logging.warning(f"TTS skipped: {e}")
     except Exception as e:
         logging.error(f"TTS error with {voice_name}: {e}")
     
-    # Fallback: return empty string if TTS fails
-    logging.error("TTS failed - no audio will be generated")
-    return ""
+    return None
+
+# Syntheses in flight, so concurrent requests for the same phrase share one call
+_tts_inflight = {}
+
+async def tts_cached(text):
+    """
+    Returns the TTS cache filename for `text` spoken in the configured voice,
+    or None if synthesis failed. Served from the content-addressed cache when
+    possible; otherwise synthesized and cached.
+    """
+    import logging
+    
+    key = speech_cache.key(TTS_VOICE, TTS_OUTPUT_FORMAT, text)
+    filename = speech_cache.get(key)
+    if filename is None:
+        task = _tts_inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(_shared_or_synthesized(key + speech_cache.extension, text))
+            _tts_inflight[key] = task
+            task.add_done_callback(lambda _: _tts_inflight.pop(key, None))
+        audio_data = await asyncio.shield(task)
+        if not audio_data:
+            logging.error("TTS failed - no audio will be generated")
+            return None
+        filename = await speech_cache.put(key, audio_data)
+    return filename
+
+async def _shared_or_synthesized(filename, text):
+    """
+    Audio another node already synthesized, or a fresh synthesis that is
+    shared before its URL goes out, so whichever node the client asks can serve it.
+    """
+    audio_data = await storage.fetch_audio(filename)
+    if audio_data is None:
+        audio_data = await synthesize_speech(text)
+        if audio_data:
+            await storage.share_audio(filename, audio_data)
+    return audio_data
+
+def tts_url(filename):
+    """URL of a TTS cache file; empty when there is no audio."""
+    if not filename:
+        return ""
+    # Absolute, since the frontend is served from a different origin
+    return f"{PUBLIC_BASE_URL}/api/audio/cache/{filename}"
+
+async def tts_omani(text):
+    """
+    Returns a URL for `text` spoken in the configured voice, or an empty
+    string if synthesis failed.
+    """
+    return tts_url(await tts_cached(text))
+
+async def maintain_speech_pools(streaming=False):
+    """
+    Connect recognizers (continuous ones when STT is `streaming`) and
+    synthesizers before the first turn needs them, then keep the pools
+    healthy until cancelled.
+    """
+    import logging
+    
+    if not os.getenv("AZURE_SPEECH_KEY") or not os.getenv("AZURE_SERVICE_REGION"):
+        logging.warning("Azure Speech credentials not found; speech pools are not pre-connected")
+        return
+    if streaming:
+        speech_pools.streaming_recognizers(STT_LANGUAGE)
+    else:
+        speech_pools.recognizers(STT_LANGUAGE)
+    speech_pools.synthesizers(TTS_VOICE, TTS_LANGUAGE, TTS_OUTPUT_FORMAT)
+    await speech_pools.run_maintenance()
+
+async def prewarm_tts(phrases):
+    """Renders fixed phrases into the TTS cache so they are served instantly."""
+    import logging
+    
+    rendered = 0
+    for phrase in phrases:
+        speech_cache.pin(speech_cache.key(TTS_VOICE, TTS_OUTPUT_FORMAT, phrase))
+        if await tts_omani(phrase):
+            rendered += 1
+    logging.info(f"TTS cache pre-warmed {rendered}/{len(phrases)} phrases")
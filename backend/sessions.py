@@ -0,0 +1,235 @@
+"""
+Per-session conversation memory.
+
+Each session keeps its most recent turns in an in-memory LRU, capped at
+SESSION_HISTORY_TURNS turns and SESSION_HISTORY_TOKENS (estimated) tokens,
+so the response prompt can carry a short history window without reading
+the database on every turn. A session that is not in memory (resumed after
+eviction or a restart) is loaded once from conversation_logs.
+
+With SESSION_STORE=redis the turns are kept in Redis instead
+(RedisSessionStore), so consecutive turns of one session can land on
+different workers or nodes.
+
+Session ids are issued by the server. Clients get a signed token for their
+session (session_token) and send it back to continue the conversation or
+to read its history; a token the server did not sign starts a new session.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import uuid
+from collections import OrderedDict, deque
+from storage import get_redis
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_CACHE_MAX = int(os.getenv("SESSION_CACHE_MAX", "10000"))
+SESSION_HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "6"))
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "600"))
+# Redis keeps a session's turns this long after its last turn
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(24 * 3600)))
+# Signs session tokens. Every node must share it, or tokens from one node
+# start a new session on another; the random default only suits one process
+SESSION_SECRET = os.getenv("SESSION_SECRET") or secrets.token_hex(32)
+
+
+def estimate_tokens(text):
+    # About three characters per token for Arabic; only used for the budget
+    return len(text) // 3 + 1
+
+
+def session_token(session_id):
+    """The credential a client presents for a session the server issued."""
+    signature = hmac.new(SESSION_SECRET.encode(), session_id.encode(), hashlib.sha256).digest()
+    return f"{session_id}.{base64.urlsafe_b64encode(signature).decode().rstrip('=')}"
+
+
+def session_from_token(token):
+    """The session id a token was issued for, or None if it was not signed here."""
+    if not token or "." not in token:
+        return None
+    session_id = token.rsplit(".", 1)[0]
+    if hmac.compare_digest(token.encode(), session_token(session_id).encode()):
+        return session_id
+    return None
+
+
+def trim_turns(turns, max_turns, max_tokens):
+    """Drop the oldest turns of a deque until it fits both budgets."""
+    while len(turns) > max_turns:
+        turns.popleft()
+    while turns and sum(estimate_tokens(u) + estimate_tokens(b) for u, b in turns) > max_tokens:
+        turns.popleft()
+    return turns
+
+
+async def load_recent_turns(session_id, limit):
+    """Newest `limit` turns of a session from conversation_logs, oldest first."""
+    from crud import conversation_history
+    from database import SessionLocal
+
+    async with SessionLocal() as db:
+        rows = await conversation_history(db, session_id, limit=limit)
+    return [(row.user_transcript or "", row.bot_response or "") for row in reversed(rows)]
+
+
+class SessionStore:
+    def __init__(self, loader=load_recent_turns, max_sessions=SESSION_CACHE_MAX,
+                 max_turns=SESSION_HISTORY_TURNS, max_tokens=SESSION_HISTORY_TOKENS):
+        self.loader = loader
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._sessions = OrderedDict()  # session id -> deque of (user, bot), least recently used first
+
+    def new_session(self):
+        """A fresh session id, known to have no history."""
+        session_id = str(uuid.uuid4())
+        self._remember(session_id, deque())
+        return session_id
+
+    def open(self, token=None):
+        """The session of a token the server issued, otherwise a new session."""
+        session_id = session_from_token(token)
+        if session_id is not None:
+            return session_id
+        return self.new_session()
+
+    async def history(self, session_id):
+        """Recent (user, bot) turns of the session, oldest first."""
+        turns = self._sessions.get(session_id)
+        if turns is not None:
+            self.hits += 1
+            self._sessions.move_to_end(session_id)
+            return list(turns)
+        self.loads += 1
+        loaded = []
+        if self.loader is not None:
+            try:
+                loaded = await self.loader(session_id, self.max_turns)
+            except Exception as e:
+                logging.error(f"Loading history for session {session_id} failed: {e}")
+        # A turn may have been appended while loading; keep it after the loaded ones
+        turns = deque(loaded)
+        turns.extend(self._sessions.get(session_id, ()))
+        self._remember(session_id, turns)
+        return list(turns)
+
+    def append(self, session_id, user_text, bot_text):
+        turns = self._sessions.get(session_id)
+        if turns is None:
+            turns = deque()
+        turns.append((user_text, bot_text))
+        self._remember(session_id, turns)
+
+    async def record(self, session_id, user_text, bot_text):
+        """Add a finished turn; the async form every session store has."""
+        self.append(session_id, user_text, bot_text)
+
+    def _remember(self, session_id, turns):
+        self._sessions[session_id] = trim_turns(turns, self.max_turns, self.max_tokens)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+
+class RedisSessionStore:
+    """
+    Session history shared through Redis: one capped list of turns per
+    session that expires SESSION_TTL after the last turn. Like SessionStore,
+    a session Redis does not know (expired, or from before the switch) is
+    loaded once from conversation_logs. If Redis is unreachable the history
+    comes from conversation_logs and new turns are only logged there.
+    """
+
+    def __init__(self, client, loader=load_recent_turns, max_turns=SESSION_HISTORY_TURNS,
+                 max_tokens=SESSION_HISTORY_TOKENS, ttl=SESSION_TTL, prefix="session:", max_new=SESSION_CACHE_MAX):
+        self.client = client
+        self.loader = loader
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.ttl = ttl
+        self.prefix = prefix
+        self.max_new = max_new
+        self.hits = 0
+        self.loads = 0
+        self.errors = 0
+        # Sessions started here that have no turns yet; nothing to load for them
+        self._new = OrderedDict()
+
+    def new_session(self):
+        session_id = str(uuid.uuid4())
+        self._new[session_id] = True
+        while len(self._new) > self.max_new:
+            self._new.popitem(last=False)
+        return session_id
+
+    def open(self, token=None):
+        session_id = session_from_token(token)
+        if session_id is not None:
+            return session_id
+        return self.new_session()
+
+    async def history(self, session_id):
+        key = self.prefix + session_id
+        try:
+            stored = await self.client.execute("LRANGE", key, -self.max_turns, -1)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Reading session {session_id} from Redis failed: {e!r}")
+            stored = None
+        if stored:
+            self.hits += 1
+            turns = deque(tuple(json.loads(turn)) for turn in stored)
+            return list(trim_turns(turns, self.max_turns, self.max_tokens))
+        if session_id in self._new:
+            return []
+        self.loads += 1
+        loaded = []
+        if self.loader is not None:
+            try:
+                loaded = await self.loader(session_id, self.max_turns)
+            except Exception as e:
+                logging.error(f"Loading history for session {session_id} failed: {e}")
+        if loaded and stored is not None:
+            # LPUSH, newest first, so a turn another node added meanwhile stays last
+            pushed = [json.dumps(turn, ensure_ascii=False) for turn in reversed(loaded)]
+            await self._write(session_id, ("LPUSH", key, *pushed))
+        return list(trim_turns(deque(loaded), self.max_turns, self.max_tokens))
+
+    async def record(self, session_id, user_text, bot_text):
+        self._new.pop(session_id, None)
+        turn = json.dumps([user_text, bot_text], ensure_ascii=False)
+        await self._write(session_id, ("RPUSH", self.prefix + session_id, turn))
+
+    async def _write(self, session_id, command):
+        key = self.prefix + session_id
+        try:
+            await self.client.pipeline([command, ("LTRIM", key, -self.max_turns, -1), ("EXPIRE", key, self.ttl)])
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Writing session {session_id} to Redis failed: {e!r}")
+
+    def stats(self):
+        return {"backend": "redis", "hits": self.hits, "loads": self.loads, "errors": self.errors}
+
+
+# Process-wide store used by the turn pipeline
+session_store = RedisSessionStore(get_redis()) if SESSION_STORE == "redis" else SessionStore()
@@ -0,0 +1,305 @@
+"""
+Ready-to-use Azure speech objects, so a turn does not pay for SDK setup and
+a new service connection.
+
+Each voice or language gets a SpeechPool that keeps up to SPEECH_POOL_SIZE
+objects built and connected ahead of time (speechsdk.Connection.open). A
+lease hands out the most recently used healthy object, or builds one when
+none is ready; on return the object is kept unless it has been used
+SPEECH_POOL_MAX_USES times, failed SPEECH_POOL_MAX_ERRORS times, raised,
+lost its connection, or sat idle longer than SPEECH_POOL_MAX_IDLE (the
+service drops idle connections). Recycled objects are replaced in the
+background.
+
+A recognizer reads one push stream, so recognizers (single-shot for
+batch STT, continuous for streaming STT) are used once each and the pool
+only saves their setup and connect time. Synthesizers are reused.
+
+Every blocking SDK call runs on one dedicated executor of SPEECH_THREADS
+threads, so slow speech calls cannot starve the default executor that
+file I/O and other blocking work share.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import azure.cognitiveservices.speech as speechsdk
+from streaming_stt import AzureStreamingRecognizer
+
+SPEECH_THREADS = int(os.getenv("SPEECH_THREADS", "16"))
+SPEECH_POOL_SIZE = int(os.getenv("SPEECH_POOL_SIZE", "4"))
+SPEECH_POOL_MAX_USES = int(os.getenv("SPEECH_POOL_MAX_USES", "100"))
+SPEECH_POOL_MAX_ERRORS = int(os.getenv("SPEECH_POOL_MAX_ERRORS", "1"))
+SPEECH_POOL_MAX_IDLE = float(os.getenv("SPEECH_POOL_MAX_IDLE", "240"))
+SPEECH_POOL_CHECK_INTERVAL = float(os.getenv("SPEECH_POOL_CHECK_INTERVAL", "30"))
+
+
+class Lease:
+    """One pooled object (`obj`) with its connection and health."""
+
+    def __init__(self, obj, connection, now):
+        self.obj = obj
+        self.connection = connection
+        self.uses = 0
+        self.errors = 0
+        self.healthy = True
+        self.last_used = now
+
+    def fail(self):
+        """The call failed without raising (e.g. a Canceled result)."""
+        self.errors += 1
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception as e:
+                logging.debug(f"Closing speech connection failed: {e}")
+
+
+class SpeechPool:
+    def __init__(self, name, build, connect=None, executor=None, size=SPEECH_POOL_SIZE, max_uses=SPEECH_POOL_MAX_USES,
+                 max_errors=SPEECH_POOL_MAX_ERRORS, max_idle=SPEECH_POOL_MAX_IDLE, clock=time.monotonic):
+        # build() returns a new object; connect(obj) opens and returns its
+        # connection. Both block, so they run on `executor`.
+        self.name = name
+        self.build = build
+        self.connect = connect
+        self.executor = executor
+        self.size = size
+        self.max_uses = max_uses
+        self.max_errors = max_errors
+        self.max_idle = max_idle
+        self.clock = clock
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+        self.build_errors = 0
+        self._idle = deque()  # most recently used last
+        self._building = 0
+        self._fill_task = None
+
+    def _new(self):
+        obj = self.build()
+        lease = Lease(obj, None, self.clock())
+        if self.connect is not None:
+            lease.connection = self.connect(obj)
+            # Fired from an SDK thread; the flag is read on the next lease
+            lease.connection.disconnected.connect(lambda evt: setattr(lease, "healthy", False))
+        self.created += 1
+        return lease
+
+    async def _new_async(self):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._new)
+
+    def _usable(self, lease):
+        return lease.healthy and self.clock() - lease.last_used < self.max_idle
+
+    async def fill(self):
+        """Build and connect objects, in parallel, until `size` are ready."""
+        missing = self.size - len(self._idle) - self._building
+        if missing > 0:
+            await asyncio.gather(*(self._add() for _ in range(missing)))
+
+    async def _add(self):
+        self._building += 1
+        try:
+            lease = await self._new_async()
+        except Exception as e:
+            self.build_errors += 1
+            logging.error(f"Speech pool {self.name}: building an object failed: {e!r}")
+            return
+        finally:
+            self._building -= 1
+        if len(self._idle) < self.size:
+            self._idle.append(lease)
+        else:
+            self._discard(lease)
+
+    def prune(self):
+        """Recycle idle objects that lost their connection or sat idle too long."""
+        kept = [lease for lease in self._idle if self._usable(lease)]
+        for lease in self._idle:
+            if not self._usable(lease):
+                self._discard(lease)
+        self._idle = deque(kept)
+
+    async def take(self):
+        """
+        Check out the most recently used healthy object, or build one when
+        none is ready. Hand it back with give(); lease() does both.
+        """
+        lease = None
+        while self._idle:
+            candidate = self._idle.pop()
+            if self._usable(candidate):
+                lease = candidate
+                break
+            self._discard(candidate)
+        if lease is None:
+            self.misses += 1
+            lease = await self._new_async()
+        else:
+            self.hits += 1
+        self._refill()
+        return lease
+
+    def give(self, lease, ok=True):
+        """Return a taken object; ok=False (it raised) means it is never handed out again."""
+        if not ok:
+            lease.healthy = False
+        lease.uses += 1
+        lease.last_used = self.clock()
+        self._release(lease)
+
+    @asynccontextmanager
+    async def lease(self):
+        lease = await self.take()
+        ok = False
+        try:
+            yield lease
+            ok = True
+        finally:
+            # If it raised, the SDK call may still be running in its thread
+            self.give(lease, ok)
+
+    def _release(self, lease):
+        if (not lease.healthy or lease.uses >= self.max_uses or lease.errors >= self.max_errors
+                or len(self._idle) >= self.size):
+            self._discard(lease)
+        else:
+            self._idle.append(lease)
+        self._refill()
+
+    def _refill(self):
+        if len(self._idle) + self._building >= self.size:
+            return
+        loop = asyncio.get_running_loop()
+        task = self._fill_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._fill_task = loop.create_task(self.fill())
+
+    def _discard(self, lease):
+        self.recycled += 1
+        if lease.connection is None:
+            return
+        if self.executor is not None:
+            self.executor.submit(lease.close)
+        else:
+            lease.close()
+
+    def close(self):
+        while self._idle:
+            self._discard(self._idle.pop())
+
+    def stats(self):
+        leases = self.hits + self.misses
+        return {
+            "ready": len(self._idle),
+            "size": self.size,
+            "created": self.created,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / leases if leases else 0.0,
+            "recycled": self.recycled,
+            "build_errors": self.build_errors,
+        }
+
+
+# Azure objects
+
+def _speech_config():
+    return speechsdk.SpeechConfig(subscription=os.getenv("AZURE_SPEECH_KEY"), region=os.getenv("AZURE_SERVICE_REGION"))
+
+
+class PushRecognizer:
+    """A recognizer with its own 16 kHz mono push stream, for one utterance."""
+
+    def __init__(self, language):
+        speech_config = _speech_config()
+        speech_config.speech_recognition_language = language
+        stream_format = speechsdk.audio.AudioStreamFormat(samples_per_second=16000, bits_per_sample=16, channels=1)
+        self.stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+        audio_config = speechsdk.audio.AudioConfig(stream=self.stream)
+        self.recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
+
+    def recognize_pcm(self, pcm):
+        self.stream.write(bytes(pcm))
+        self.stream.close()
+        return self.recognizer.recognize_once()
+
+
+def _synthesizer(voice, language, output_format):
+    speech_config = _speech_config()
+    speech_config.speech_synthesis_language = language
+    speech_config.speech_synthesis_voice_name = voice
+    speech_config.set_speech_synthesis_output_format(getattr(speechsdk.SpeechSynthesisOutputFormat, output_format))
+    # No audio config: the audio comes back in the result instead of playing
+    return speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+
+
+def _connect_recognizer(recognizer, continuous=False):
+    connection = speechsdk.Connection.from_recognizer(recognizer.recognizer)
+    connection.open(continuous)
+    return connection
+
+
+def _connect_synthesizer(synthesizer):
+    connection = speechsdk.Connection.from_speech_synthesizer(synthesizer)
+    connection.open(True)
+    return connection
+
+
+class SpeechPools:
+    def __init__(self, threads=SPEECH_THREADS, **pool_options):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="speech")
+        self.pool_options = pool_options
+        self.pools = {}
+
+    def _pool(self, name, build, connect, **options):
+        pool = self.pools.get(name)
+        if pool is None:
+            pool = self.pools[name] = SpeechPool(name, build, connect, self.executor, **{**self.pool_options, **options})
+        return pool
+
+    def streaming_recognizers(self, language):
+        """Continuous recognizers for /ws/audio; like push recognizers, each reads one stream."""
+        return self._pool(f"stream:{language}", lambda: AzureStreamingRecognizer(language),
+                          lambda recognizer: _connect_recognizer(recognizer, continuous=True), max_uses=1)
+
+    def recognizers(self, language):
+        return self._pool(f"stt:{language}", lambda: PushRecognizer(language), _connect_recognizer, max_uses=1)
+
+    def synthesizers(self, voice, language, output_format):
+        return self._pool(f"tts:{voice}:{output_format}", lambda: _synthesizer(voice, language, output_format),
+                          _connect_synthesizer)
+
+    async def run(self, fn, *args):
+        """Run a blocking SDK call on the speech executor."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def run_maintenance(self, interval=None):
+        """Fill every pool now, then prune and refill every `interval` seconds until cancelled."""
+        interval = interval or SPEECH_POOL_CHECK_INTERVAL
+        while True:
+            for pool in self.pools.values():
+                pool.prune()
+            await asyncio.gather(*(pool.fill() for pool in list(self.pools.values())))
+            await asyncio.sleep(interval)
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+        # Queued connection closes are dropped; the process is exiting
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+# Process-wide pools used by services
+speech_pools = SpeechPools()
@@ -0,0 +1,190 @@
+"""
+Shared state for running several workers or nodes behind a load balancer.
+
+By default everything a turn produces stays on the node that ran it: TTS
+audio in the local cache directory and session history in process memory.
+Set these to share it instead, so any node can serve any request:
+
+AUDIO_STORE      local (default), directory (copies under AUDIO_STORE_DIR,
+                 e.g. a volume every node mounts) or redis
+SESSION_STORE    memory (default) or redis (see sessions.RedisSessionStore)
+REDIS_URL        redis://[:password@]host:port/db for the redis backends
+
+Each node still serves audio from its own TTS cache; a file it does not
+have is pulled from the shared store on first request. Redis is reached
+through redis-py's asyncio client.
+"""
+import asyncio
+import logging
+import os
+import uuid
+import redis.asyncio as redis
+from redis.exceptions import RedisError, ResponseError
+from artifacts import shard_path
+
+AUDIO_STORE = os.getenv("AUDIO_STORE", "local")
+AUDIO_STORE_DIR = os.getenv("AUDIO_STORE_DIR", "tmp/shared_audio")
+# Shared copies outlive any one node's cache; the audio is content-addressed
+AUDIO_STORE_TTL = int(os.getenv("AUDIO_STORE_TTL", str(7 * 24 * 3600)))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "2"))
+
+
+class RedisClient:
+    """
+    redis-py's asyncio client over a bounded, blocking connection pool,
+    behind the execute/pipeline interface the blob and session stores use.
+    Counts commands, and transport errors (not error replies), for /api/stats.
+    """
+
+    def __init__(self, url=REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_TIMEOUT):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.commands = 0
+        self.errors = 0
+        # Waits up to `timeout` for a free connection instead of opening more.
+        # RESP2, which every Redis-compatible server speaks (newer redis-py defaults to RESP3)
+        self._pool = redis.BlockingConnectionPool.from_url(
+            url, max_connections=max_connections, timeout=timeout,
+            socket_timeout=timeout, socket_connect_timeout=timeout, protocol=2
+        )
+        self._client = redis.Redis(connection_pool=self._pool)
+
+    async def execute(self, *args):
+        """Run one command and return its reply."""
+        return (await self.pipeline([args]))[0]
+
+    async def pipeline(self, commands):
+        """
+        Send several commands in one round trip and return their replies in
+        order. An error reply raises RedisError after all replies are read.
+        """
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                for command in commands:
+                    pipe.execute_command(*command)
+                replies = await pipe.execute()
+        except ResponseError:
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        self.commands += len(commands)
+        return replies
+
+    async def aclose(self):
+        await self._client.aclose()
+        await self._pool.disconnect()
+
+    def stats(self):
+        return {"commands": self.commands, "errors": self.errors, "max_connections": self.max_connections}
+
+
+_redis = None
+
+
+def get_redis():
+    """Shared RedisClient for the process; it connects on first use."""
+    global _redis
+    if _redis is None:
+        _redis = RedisClient()
+    return _redis
+
+
+async def aclose():
+    if _redis is not None:
+        await _redis.aclose()
+
+
+# Blob stores: get(name) returns the bytes or None, put(name, data) stores them
+
+class DirectoryBlobStore:
+    def __init__(self, root=AUDIO_STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _read(self, name):
+        try:
+            with open(shard_path(self.root, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, name, data):
+        path = shard_path(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A unique temporary name, since other nodes may write the same file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        with open(tmp_path, "wb") as out:
+            out.write(data)
+        os.replace(tmp_path, path)
+
+    async def get(self, name):
+        # Network volumes can be slow; keep their I/O off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self._read, name)
+
+    async def put(self, name, data):
+        await asyncio.get_running_loop().run_in_executor(None, self._write, name, data)
+
+
+class RedisBlobStore:
+    def __init__(self, client, prefix="audio:", ttl=AUDIO_STORE_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    async def get(self, name):
+        return await self.client.execute("GET", self.prefix + name)
+
+    async def put(self, name, data):
+        await self.client.execute("SET", self.prefix + name, data, "EX", self.ttl)
+
+
+def _audio_blobs():
+    if AUDIO_STORE == "directory":
+        return DirectoryBlobStore()
+    if AUDIO_STORE == "redis":
+        return RedisBlobStore(get_redis())
+    if AUDIO_STORE != "local":
+        logging.error(f"Unknown AUDIO_STORE {AUDIO_STORE!r}; audio stays on this node")
+    return None
+
+
+# Where synthesized audio is shared between nodes; None keeps it local
+audio_blobs = _audio_blobs()
+audio_stats = {"shared": 0, "pulled": 0, "errors": 0}
+
+
+async def fetch_audio(name):
+    """Bytes of audio another node shared under `name`, or None."""
+    if audio_blobs is None:
+        return None
+    try:
+        data = await audio_blobs.get(name)
+    except Exception as e:
+        audio_stats["errors"] += 1
+        logging.error(f"Reading shared audio {name} failed: {e!r}")
+        return None
+    if data is not None:
+        audio_stats["pulled"] += 1
+    return data
+
+
+async def share_audio(name, data):
+    """Make audio available to the other nodes. Failures are logged, not raised."""
+    if audio_blobs is None:
+        return
+    try:
+        await audio_blobs.put(name, data)
+        audio_stats["shared"] += 1
+    except Exception as e:
+        audio_stats["errors"] += 1
+        logging.error(f"Sharing audio {name} failed: {e!r}")
+
+
+def stats():
+    result = {"audio_store": AUDIO_STORE, **audio_stats}
+    if _redis is not None:
+        result["redis"] = _redis.stats()
+    return result
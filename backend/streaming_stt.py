@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import time
+import azure.cognitiveservices.speech as speechsdk
+
+# Decoder reads the browser's webm/opus chunks on stdin and writes raw
+# 16 kHz mono 16-bit PCM on stdout, which is what the push stream expects.
+# AUDIO_DECODE_CMD replaces it, e.g. "cat" when clients already send PCM.
+FFMPEG_DECODE_CMD = os.getenv("AUDIO_DECODE_CMD", "").split() or [
+    'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+    '-f', 's16le', '-ar', '16000', '-ac', '1', 'pipe:1'
+]
+PCM_READ_SIZE = 3200  # 100 ms of 16 kHz mono s16le
+
+
+class AzureStreamingRecognizer:
+    """
+    Push-style recognizer backed by Azure continuous recognition.
+    PCM is written as it arrives; callbacks fire from SDK threads.
+    """
+
+    def __init__(self, language):
+        speech_config = speechsdk.SpeechConfig(
+            subscription=os.getenv("AZURE_SPEECH_KEY"),
+            region=os.getenv("AZURE_SERVICE_REGION")
+        )
+        speech_config.speech_recognition_language = language
+        stream_format = speechsdk.audio.AudioStreamFormat(samples_per_second=16000, bits_per_sample=16, channels=1)
+        self._stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+        audio_config = speechsdk.audio.AudioConfig(stream=self._stream)
+        self.recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
+
+    def start(self, on_partial, on_final, on_stopped):
+        def recognized(evt):
+            if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
+                on_final(evt.result.text)
+
+        self.recognizer.recognizing.connect(lambda evt: on_partial(evt.result.text))
+        self.recognizer.recognized.connect(recognized)
+        self.recognizer.session_stopped.connect(lambda evt: on_stopped())
+        self.recognizer.canceled.connect(lambda evt: on_stopped())
+        self.recognizer.start_continuous_recognition_async().get()
+
+    def write(self, pcm):
+        self._stream.write(pcm)
+
+    def close(self):
+        # Closing the push stream lets the service flush the last phrase and
+        # then fire session_stopped, which resolves StreamingTranscriber.finish().
+        self._stream.close()
+
+    def stop(self):
+        self.recognizer.stop_continuous_recognition_async().get()
+
+
+class StreamingTranscriber:
+    """
+    Feeds audio chunks through a long-lived decoder into a push recognizer
+    and exposes partial hypotheses as they are produced.
+
+    decoder_cmd=None skips decoding and treats chunks as PCM already. With a
+    `gate` (vad.SpeechGate) only speech is passed to the recognizer, and
+    `endpointed` is set once the speaker has gone quiet. With a `limiter`
+    (admission.AdaptiveLimiter) the stream holds one of its slots from
+    start() until it is finished or closed; start() raises Overloaded when
+    none is free.
+
+    Instead of a `recognizer`, `recognizers` (a speech_pool.SpeechPool) hands
+    one out, built and connected ahead of time, in start(). Blocking
+    recognizer calls run on `executor` (the default one if None).
+    """
+
+    def __init__(self, recognizer=None, decoder_cmd=FFMPEG_DECODE_CMD, gate=None, limiter=None,
+                 recognizers=None, executor=None):
+        self.recognizer = recognizer
+        self.decoder_cmd = decoder_cmd
+        self.gate = gate
+        self.limiter = limiter
+        self.recognizers = recognizers
+        self.executor = executor
+        self._admitted = False
+        self._lease = None
+        self._recognizing = False
+        self.endpointed = asyncio.Event()
+        self.partials = asyncio.Queue()
+        self._segments = []
+        self._decoder = None
+        self._pump_task = None
+        self._stopped = None
+        self._loop = None
+        self._closed = False
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = self._loop.create_future()
+        if self.limiter is not None:
+            await self.limiter.acquire()
+            self._admitted = True
+        if self.recognizer is None:
+            self._lease = await self.recognizers.take()
+            self.recognizer = self._lease.obj
+        await self._loop.run_in_executor(
+            self.executor, self.recognizer.start, self._on_partial, self._on_final, self._on_stopped
+        )
+        self._recognizing = True
+        if self.decoder_cmd:
+            self._decoder = await asyncio.create_subprocess_exec(
+                *self.decoder_cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            self._pump_task = asyncio.create_task(self._pump())
+
+    # Recognizer callbacks may run on SDK threads, so hop back onto the loop.
+    def _on_partial(self, text):
+        self._loop.call_soon_threadsafe(self._push_partial, text)
+
+    def _on_final(self, text):
+        self._loop.call_soon_threadsafe(self._push_final, text)
+
+    def _on_stopped(self):
+        self._loop.call_soon_threadsafe(self._mark_stopped)
+
+    def _push_partial(self, text):
+        if text:
+            self.partials.put_nowait(" ".join(self._segments + [text]).strip())
+
+    def _push_final(self, text):
+        text = text.strip()
+        if text:
+            self._segments.append(text)
+            self.partials.put_nowait(self.transcript)
+
+    def _mark_stopped(self):
+        if not self._stopped.done():
+            self._stopped.set_result(None)
+
+    @property
+    def transcript(self):
+        return " ".join(self._segments)
+
+    async def _pump(self):
+        while True:
+            pcm = await self._decoder.stdout.read(PCM_READ_SIZE)
+            if not pcm:
+                break
+            self._write_pcm(pcm)
+
+    def _write_pcm(self, pcm):
+        if self.gate is not None:
+            pcm = self.gate.push(pcm)
+            if self.gate.ended:
+                self.endpointed.set()
+        if pcm:
+            self.recognizer.write(pcm)
+
+    async def feed(self, chunk):
+        if self._decoder is None:
+            self._write_pcm(chunk)
+            return
+        self._decoder.stdin.write(chunk)
+        await self._decoder.stdin.drain()
+
+    async def finish(self, timeout=10):
+        """Flush the decoder, close the audio stream and return the final transcript."""
+        if self._decoder is not None:
+            self._decoder.stdin.close()
+            await self._pump_task
+            await self._decoder.wait()
+            if self._decoder.returncode != 0:
+                logging.error(f"Streaming decoder exited with code {self._decoder.returncode}")
+        held = self.gate.flush() if self.gate is not None else b""
+        if held:
+            # The gate never heard speech; let the recognizer decide on all of it
+            logging.info(f"No speech detected, sending {len(held)} held bytes to the recognizer")
+            self.recognizer.write(held)
+        self.recognizer.close()
+        # The provider is judged on how long the final result takes after the audio ends
+        started = time.monotonic()
+        stopped = True
+        try:
+            await asyncio.wait_for(asyncio.shield(self._stopped), timeout)
+        except asyncio.TimeoutError:
+            stopped = False
+            logging.warning("Streaming recognizer did not stop in time, using transcript so far")
+        if self._admitted:
+            self._admitted = False
+            self.limiter.release(time.monotonic() - started, ok=stopped)
+        await self.aclose()
+        return self.transcript
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._admitted:
+            self._admitted = False
+            self.limiter.abandon()
+        if self._pump_task is not None and not self._pump_task.done():
+            self._pump_task.cancel()
+        if self._decoder is not None and self._decoder.returncode is None:
+            self._decoder.kill()
+            await self._decoder.wait()
+        # A recognizer whose start() failed is never reused
+        stopped = self._recognizing
+        if self._recognizing:
+            self._recognizing = False
+            try:
+                await self._loop.run_in_executor(self.executor, self.recognizer.stop)
+            except Exception as e:
+                stopped = False
+                logging.error(f"Failed to stop streaming recognizer: {e}")
+        if self._lease is not None:
+            self.recognizers.give(self._lease, stopped)
+            self._lease = None
@@ -0,0 +1,128 @@
+import asyncio
+import pytest
+import intent_classifier
+import services
+import speech_pool
+from admission import AdaptiveLimiter, Overloaded
+from benchmarks import fake_speech_sdk
+from pipeline import run_turn
+from tts_cache import TTSCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_limit_grows_on_success_and_backs_off_once_per_interval():
+    clock = Clock()
+    limiter = AdaptiveLimiter("llm", latency_target=1.0, initial_limit=4, backoff=0.5,
+                              backoff_interval=1.0, clock=clock)
+
+    async def run():
+        for _ in range(8):
+            async with limiter.slot():
+                clock.now += 0.1
+        grown = limiter.limit
+        # A burst of failures within one interval halves the limit only once
+        for _ in range(3):
+            with pytest.raises(RuntimeError):
+                async with limiter.slot():
+                    raise RuntimeError("429")
+        after_burst = limiter.limit
+        # So does a call that succeeds but blows the latency target
+        clock.now += 1.0
+        async with limiter.slot():
+            clock.now += 2.0
+        return grown, after_burst
+
+    grown, after_burst = asyncio.run(run())
+    assert 5.5 < grown < 6
+    assert after_burst == pytest.approx(grown / 2)
+    assert limiter.limit == pytest.approx(grown / 4)
+    assert limiter.stats()["failed"] == 3 and limiter.stats()["slow"] == 1
+
+
+def test_queue_is_bounded_and_has_a_deadline():
+    limiter = AdaptiveLimiter("tts", latency_target=1.0, initial_limit=1, max_queue=1, queue_timeout=0.05)
+
+    async def run():
+        await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as full:
+            await limiter.acquire()
+        with pytest.raises(Overloaded) as late:
+            await waiting
+        # A freed slot goes straight to the next waiter
+        queued = asyncio.create_task(limiter.acquire(timeout=1))
+        await asyncio.sleep(0)
+        limiter.release(0.01, ok=True)
+        await queued
+        return full.value, late.value
+
+    full, late = asyncio.run(run())
+    assert full.reason == "queue full" and late.reason == "queue timeout"
+    stats = limiter.stats()
+    assert (stats["inflight"], stats["queued"], stats["rejected"], stats["timed_out"]) == (1, 0, 1, 1)
+
+
+def test_abandoned_stream_releases_its_slot_without_backoff():
+    limiter = AdaptiveLimiter("llm", latency_target=1.0, initial_limit=2)
+
+    async def stream():
+        async with limiter.slot():
+            for i in range(10):
+                yield i
+
+    async def run():
+        agen = stream()
+        assert await agen.__anext__() == 0
+        await agen.aclose()
+
+    asyncio.run(run())
+    assert limiter.inflight == 0 and limiter.limit == 2 and limiter.failed == 0
+
+
+def test_shed_reply_raises_instead_of_apologizing(monkeypatch):
+    saturated = AdaptiveLimiter("llm", latency_target=1.0, initial_limit=1, max_queue=0)
+    saturated.inflight = 1
+    monkeypatch.setitem(services.limiters, "llm", saturated)
+
+    async def run():
+        with pytest.raises(Overloaded):
+            await services.dual_model_response("مرحبا", "دعم", "قلق")
+        with pytest.raises(Overloaded):
+            async for _ in services.dual_model_response_stream("مرحبا", "دعم", "قلق"):
+                pass
+
+    asyncio.run(run())
+    assert saturated.rejected == 2
+
+
+def test_crisis_turn_escalates_while_providers_are_saturated(monkeypatch, tmp_path):
+    def saturated(name):
+        limiter = AdaptiveLimiter(name, latency_target=1.0, initial_limit=1, max_queue=0)
+        limiter.inflight = 1
+        monkeypatch.setitem(services.limiters, name, limiter)
+        return limiter
+
+    llm, tts = saturated("llm"), saturated("tts")
+    monkeypatch.setattr(intent_classifier, "intent_model", None)
+    monkeypatch.setattr(services, "speechsdk", fake_speech_sdk)
+    monkeypatch.setattr(speech_pool, "speechsdk", fake_speech_sdk)
+    monkeypatch.setattr(services, "speech_pools", speech_pool.SpeechPools(threads=1, size=1))
+    monkeypatch.setattr(services, "speech_cache", TTSCache(str(tmp_path)))
+    monkeypatch.setattr(fake_speech_sdk, "settings", dict(fake_speech_sdk.settings))
+    monkeypatch.setenv("AZURE_SPEECH_KEY", "test")
+    monkeypatch.setenv("AZURE_SERVICE_REGION", "local")
+    fake_speech_sdk.configure(tts_latency=0, connect_latency=0, error_rate=0)
+
+    ctx = asyncio.run(run_turn("أفكر في الانتحار"))
+    assert ctx.escalate and ctx.safety["category"] == "crisis"
+    assert ctx.intent == "unknown" and llm.rejected == 1
+    # The crisis message is still spoken, on a slot the limit did not allow
+    assert ctx.tts_audio_urls[0] and tts.rejected == 0 and tts.inflight == 1
@@ -0,0 +1,62 @@
+import os
+import uuid
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+from artifacts import ArtifactStore, content_type
+
+
+def _write(store, data, extension):
+    """An artifact as earlier versions wrote them."""
+    name = uuid.uuid4().hex + extension
+    os.makedirs(os.path.dirname(store.path(name)), exist_ok=True)
+    with open(store.path(name), "wb") as out:
+        out.write(data)
+    return name
+
+
+def test_paths_are_sharded_and_names_validated(tmp_path):
+    store = ArtifactStore(str(tmp_path / "store"), legacy_dir=None)
+    name = _write(store, b"data", ".webm")
+    assert store.path(name) == os.path.join(str(tmp_path / "store"), name[:2], name[2:4], name)
+    assert content_type(name) == "audio/webm" and content_type("x.mp3") == "audio/mpeg"
+    assert store.path("../../etc/passwd") is None
+    assert store.path("abcdef12.exe") is None
+
+
+def test_sweep_by_ttl_then_size(tmp_path):
+    legacy = tmp_path / "legacy"
+    legacy.mkdir()
+    (legacy / "old.wav").write_bytes(b"x")
+    (legacy / "keep.jsonl").write_bytes(b"x")
+    store = ArtifactStore(str(tmp_path / "store"), ttl=100, max_bytes=250, legacy_dir=str(legacy))
+    names = [_write(store, b"x" * 100, ".mp3") for _ in range(4)]
+    now = 10_000
+    for age, name in zip([500, 50, 40, 30], names):
+        os.utime(store.path(name), (now - age, now - age))
+    os.utime(legacy / "old.wav", (now - 500, now - 500))
+
+    result = store.sweep(now=now)
+    # names[0] expired; of the rest the oldest goes to get under 250 bytes
+    assert (result["expired"], result["over_cap"]) == (2, 1)
+    assert [os.path.exists(store.path(n)) for n in names] == [False, False, True, True]
+    assert not (legacy / "old.wav").exists() and (legacy / "keep.jsonl").exists()
+
+
+def test_served_with_etag_and_ranges(tmp_path):
+    store = ArtifactStore(str(tmp_path), legacy_dir=None)
+    name = _write(store, bytes(range(100)), ".mp3")
+    app = FastAPI()
+
+    @app.get("/a/{name}")
+    async def serve(name: str, request: Request):
+        response = store.response(name, request.headers)
+        if response is None:
+            raise HTTPException(404)
+        return response
+
+    client = TestClient(app)
+    full = client.get(f"/a/{name}")
+    assert full.headers["content-type"] == "audio/mpeg" and full.headers["etag"]
+    assert client.get(f"/a/{name}", headers={"if-none-match": full.headers["etag"]}).status_code == 304
+    part = client.get(f"/a/{name}", headers={"range": "bytes=10-19"})
+    assert part.status_code == 206 and part.content == bytes(range(10, 20))
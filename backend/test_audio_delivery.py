@@ -0,0 +1,60 @@
+import json
+import uuid
+from fastapi.testclient import TestClient
+import audio_delivery
+import main
+import services
+from audio_delivery import decode_frame, encode_frame, negotiate
+from tts_cache import TTSCache
+
+
+def test_frames_round_trip_and_negotiation():
+    turn_id = str(uuid.uuid4())
+    frame = encode_frame(turn_id, 3, 7, True, b"mp3")
+    assert len(frame) == 23 + 3
+    assert decode_frame(frame) == (turn_id, 3, 7, True, b"mp3")
+    assert negotiate({"audio": "binary"}) == "binary"
+    assert negotiate({"audio": "carrier-pigeon"}) == "url"
+    assert negotiate({}) == "url"
+
+
+def test_ws_binary_delivery(tmp_path, monkeypatch):
+    cache = TTSCache(str(tmp_path))
+    audio = {"هلا.": b"a" * 5, "أنا هنا.": b"b" * 12}
+
+    async def analyze_intent(text):
+        return "دعم", "قلق", "llm"
+
+    async def dual_model_response_stream(text, intent, emotion, history=None):
+        yield "هلا. "
+        yield "أنا هنا."
+
+    async def tts_cached(text):
+        return await cache.put(cache.key("v", "f", text), audio[text])
+
+    monkeypatch.setattr(services, "analyze_intent", analyze_intent)
+    monkeypatch.setattr(services, "dual_model_response_stream", dual_model_response_stream)
+    monkeypatch.setattr(services, "tts_cached", tts_cached)
+    monkeypatch.setattr(audio_delivery, "speech_cache", cache)
+    monkeypatch.setattr(audio_delivery, "WS_AUDIO_CHUNK_BYTES", 8)
+
+    with TestClient(main.app).websocket_connect("/ws?audio=binary") as ws:
+        assert ws.receive_json()["audio_delivery"] == "binary"
+        ws.send_json({"message": "ضايق شوي"})
+        received = {}
+        announced = []
+        while True:
+            message = ws.receive()
+            if message.get("bytes") is not None:
+                turn_id, index, seq, last, payload = decode_frame(message["bytes"])
+                received.setdefault(index, []).append((seq, last, payload))
+                continue
+            data = json.loads(message["text"])
+            if "tts_segment" in data:
+                announced.append(data["tts_segment"])
+            if "response" in data:
+                break
+    assert [s["bytes"] for s in announced] == [5, 12]
+    assert all(s["turn_id"] == turn_id for s in announced)
+    assert b"".join(p for _, _, p in received[1]) == b"b" * 12
+    assert [(seq, last) for seq, last, _ in received[1]] == [(0, False), (1, True)]
@@ -0,0 +1,125 @@
+import asyncio
+import tempfile
+import pytest
+from audio_ingest import iter_multipart_file, decode_to_pcm, UploadTooLarge, AudioTooLong, MissingAudioField
+from audio_ingest import AudioBuffer, StatusThrottle
+from transcoding import TranscodePool
+
+BOUNDARY = "----ingest"
+
+
+class FakeRequest:
+    """Just enough of starlette's Request for iter_multipart_file."""
+
+    def __init__(self, body, chunk_size=7):
+        self.headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for i in range(0, len(self.body), self.chunk_size):
+            yield self.body[i:i + self.chunk_size]
+
+
+def _multipart(fields):
+    body = b""
+    for name, value in fields:
+        body += (
+            f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{name}.webm\"\r\n"
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode() + value + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+async def _collect(agen):
+    return b"".join([piece async for piece in agen])
+
+
+def test_multipart_field_is_streamed_in_pieces():
+    request = FakeRequest(_multipart([("other", b"x" * 20), ("audio", b"webm-audio-bytes" * 10)]))
+    assert asyncio.run(_collect(iter_multipart_file(request, "audio"))) == b"webm-audio-bytes" * 10
+
+
+def test_missing_field_raises():
+    request = FakeRequest(_multipart([("other", b"abc")]))
+    with pytest.raises(MissingAudioField):
+        asyncio.run(_collect(iter_multipart_file(request, "audio")))
+
+
+async def _chunks(count, size):
+    for _ in range(count):
+        yield b"\x00" * size
+
+
+def test_decode_collects_pcm_in_memory():
+    pool = TranscodePool(max_concurrency=1, queue_timeout=1, job_timeout=5)
+    pcm = asyncio.run(decode_to_pcm(_chunks(10, 3200), pool, cmd=["cat"]))
+    assert len(pcm) == 32000
+    assert pool.stats()["completed"] == 1
+
+
+def test_upload_size_limit():
+    pool = TranscodePool(max_concurrency=1, queue_timeout=1, job_timeout=5)
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(decode_to_pcm(_chunks(10, 1000), pool, max_bytes=5000, cmd=["cat"]))
+    assert pool.running == 0
+
+
+def test_duration_limit():
+    pool = TranscodePool(max_concurrency=1, queue_timeout=1, job_timeout=5)
+    # 2 s of PCM against a 1 s cap
+    with pytest.raises(AudioTooLong):
+        asyncio.run(decode_to_pcm(_chunks(20, 3200), pool, max_seconds=1, cmd=["cat"]))
+
+
+def test_m4a_upload_is_decoded_from_a_spooled_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    audio = b"\x00\x00\x00\x1cftypM4A " + b"\x02" * 5000
+    body = (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"audio\"; filename=\"note.m4a\"\r\n"
+        "Content-Type: audio/x-m4a\r\n\r\n"
+    ).encode() + audio + f"\r\n--{BOUNDARY}--\r\n".encode()
+    pool = TranscodePool(max_concurrency=1, queue_timeout=1, job_timeout=5)
+    # Fails unless the decoder is handed a regular file in place of pipe:0
+    cmd = ["sh", "-c", 'test -f "$0" && cat "$0"', "pipe:0"]
+    upload = {}
+    pcm = asyncio.run(decode_to_pcm(iter_multipart_file(FakeRequest(body, chunk_size=512), "audio", upload), pool,
+                                    cmd=cmd, upload=upload))
+    assert pcm == audio
+    assert upload == {"filename": "note.m4a", "content_type": "audio/x-m4a"}
+    assert not list(tmp_path.iterdir())
+
+
+def test_audio_buffer_is_capped_and_decodes_without_copies():
+    buffer = AudioBuffer(max_bytes=10000, block_size=4096)
+    for _ in range(3):
+        buffer.append(b"\x01" * 3000)
+    assert buffer.size == 9000 and len(buffer._data) == 10000
+    with pytest.raises(UploadTooLarge):
+        buffer.append(b"\x01" * 1001)
+    pool = TranscodePool(max_concurrency=1, queue_timeout=1, job_timeout=5)
+    pcm = asyncio.run(decode_to_pcm(buffer.chunks(size=4000), pool, cmd=["cat"]))
+    assert pcm == b"\x01" * 9000
+    buffer.release()
+    assert buffer.size == 0
+
+
+def test_status_messages_are_coalesced():
+    sent = []
+    now = [0.0]
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        status = StatusThrottle(send, interval=1.0, clock=lambda: now[0])
+        for i in range(12):
+            await status.send({"n": i})
+            now[0] += 0.25
+        await status.flush()
+        return status
+
+    status = asyncio.run(run())
+    # One message per second of chunks, plus the latest one on flush
+    assert sent == [{"n": 0}, {"n": 4}, {"n": 8}, {"n": 11}]
+    assert status.coalesced == 8
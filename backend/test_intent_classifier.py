@@ -0,0 +1,105 @@
+import asyncio
+import json
+import time
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine
+import intent_classifier
+import services
+from database import Base
+from intent_classifier import IntentClassifier, evaluate, read_database, read_jsonl, split_holdout
+from models import ConversationLog
+
+ROWS = [
+    ("أحس بقلق كبير من الامتحانات", "دعم", "قلق"),
+    ("متوتر وايد من الامتحان بكرة", "دعم", "قلق"),
+    ("قلقان من الشغل الجديد", "دعم", "قلق"),
+    ("خايف وقلقان من المستقبل", "دعم", "قلق"),
+    ("أبي نصيحة كيف أنظم وقتي", "استشارة", "أمل"),
+    ("أبي نصيحة عن الدراسة", "استشارة", "أمل"),
+    ("كيف أقدر أنظم يومي", "استشارة", "أمل"),
+    ("عطني نصيحة للنوم", "استشارة", "أمل"),
+    ("زعلان من أخوي وايد", "دعم", "غضب"),
+    ("معصب من الشغل ومن المدير", "دعم", "غضب"),
+    ("زعلان ومعصب من كل شي", "دعم", "غضب"),
+    ("معصب وايد اليوم", "دعم", "غضب"),
+]
+
+
+def _model(threshold=0.5):
+    model = IntentClassifier.train(ROWS * 3, epochs=20)
+    model.threshold = threshold
+    return model
+
+
+def test_learns_training_examples_and_round_trips(tmp_path):
+    model = _model()
+    assert model.classify("أبي نصيحة كيف أنظم وقتي") == ("استشارة", "أمل")
+    assert model.classify("معصب وايد من المدير") == ("دعم", "غضب")
+    path = str(tmp_path / "model.json")
+    model.save(path)
+    loaded = IntentClassifier.load(path, threshold=0.5)
+    assert loaded.predict("قلقان من الامتحان") == model.predict("قلقان من الامتحان")
+
+
+def test_prediction_is_well_under_a_millisecond():
+    model = _model()
+    text = "والله متوتر وايد من الامتحانات وما أقدر أنام زين هالأيام"
+    started = time.perf_counter()
+    for _ in range(200):
+        model.predict(text)
+    assert (time.perf_counter() - started) / 200 < 0.0005
+
+
+def test_evaluate_reports_coverage_by_threshold():
+    train, holdout = split_holdout(ROWS * 3, 0.0)
+    assert holdout == []
+    report = evaluate(_model(), ROWS, thresholds=(0.0, 1.0))
+    assert report["intent_accuracy"] == 1.0
+    assert report["thresholds"][0]["coverage"] == 1.0
+    assert report["thresholds"][1]["coverage"] == 0.0
+
+
+def test_low_confidence_goes_to_llm(monkeypatch):
+    llm_calls = []
+
+    async def analyze_intent_llm(text):
+        llm_calls.append(text)
+        return "crisis", "يأس"
+
+    stats = intent_classifier.TierStats()
+    monkeypatch.setattr(services, "analyze_intent_llm", analyze_intent_llm)
+    monkeypatch.setattr(intent_classifier, "tier_stats", stats)
+    monkeypatch.setattr(intent_classifier, "intent_model", _model(threshold=0.5))
+
+    assert asyncio.run(services.analyze_intent("أبي نصيحة عن النوم")) == ("استشارة", "أمل", "local")
+    intent_classifier.intent_model.threshold = 1.0
+    assert asyncio.run(services.analyze_intent("أبي نصيحة عن النوم")) == ("crisis", "يأس", "llm")
+    assert llm_calls == ["أبي نصيحة عن النوم"]
+    assert (stats.local, stats.llm) == (1, 1)
+
+    monkeypatch.setattr(intent_classifier, "intent_model", None)
+    asyncio.run(services.analyze_intent("أي شي"))
+    assert stats.llm == 2
+
+
+def test_trains_only_on_llm_labels(tmp_path):
+    rows = [
+        {"user_transcript": "أحس بقلق", "intent": "دعم", "emotion": "قلق", "label_source": "llm"},
+        {"user_transcript": "مرحبا", "intent": "تحية", "emotion": "محايد", "label_source": "phatic"},
+        {"user_transcript": "قلقان شوي", "intent": "دعم", "emotion": "قلق", "label_source": "local"},
+        {"user_transcript": "قبل العمود", "intent": "دعم", "emotion": "قلق", "label_source": None},
+    ]
+    path = tmp_path / "turns.jsonl"
+    path.write_text("\n".join(json.dumps(r, ensure_ascii=False) for r in rows), encoding="utf-8")
+    url = f"sqlite+aiosqlite:///{tmp_path / 'logs.db'}"
+
+    async def fill():
+        engine = create_async_engine(url)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(ConversationLog).values(rows))
+        await engine.dispose()
+
+    asyncio.run(fill())
+    assert read_jsonl(str(path)) == [("أحس بقلق", "دعم", "قلق")]
+    assert asyncio.run(read_database(url)) == [("أحس بقلق", "دعم", "قلق")]
@@ -0,0 +1,150 @@
+import asyncio
+import time
+import pytest
+import llm_clients
+import llm_router
+from benchmarks.fake_providers import FakeProviderServer
+from llm_router import AllProvidersFailed, CircuitBreaker, LLMRouter, Provider
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _provider(name, delay=0.0, reply="هلا", fail=False, log=None):
+    async def complete(messages, **params):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if log is not None:
+                log.append(f"{name} cancelled")
+            raise
+        if fail:
+            raise RuntimeError(f"{name} down")
+        return reply
+
+    async def stream(messages, **params):
+        try:
+            await asyncio.sleep(delay)
+            if fail:
+                raise RuntimeError(f"{name} down")
+            for word in reply.split():
+                yield word + " "
+        finally:
+            if log is not None:
+                log.append(f"{name} closed")
+
+    return Provider(name, complete, stream)
+
+
+def test_breaker_opens_on_errors_and_probes_once():
+    clock = Clock()
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, slow_seconds=1, open_seconds=5, clock=clock)
+    for ok in (True, False, True):
+        breaker.record(ok, 0.1)
+    assert breaker.allow()
+    breaker.record(True, 2.0)  # slow calls count against the provider too
+    assert breaker.state == "open" and not breaker.allow()
+    clock.now += 5
+    assert breaker.allow() and not breaker.allow()  # one probe at a time
+    breaker.record(True, 0.1)
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_breaker_p95_uses_recent_successes():
+    clock = Clock()
+    breaker = CircuitBreaker(window=10, min_calls=5, clock=clock)
+    for latency in (0.1, 0.2, 0.3, 0.4, 2.0):
+        breaker.record(True, latency)
+    assert breaker.p95() == 2.0
+    clock.now += 11
+    assert breaker.p95() is None
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    log = []
+    router = LLMRouter([_provider("a", delay=1.0, reply="بطيء", log=log), _provider("b", delay=0.01, reply="سريع")],
+                       min_delay=0.05, max_delay=0.05)
+    started = time.perf_counter()
+    assert asyncio.run(router.complete([])) == "سريع"
+    assert time.perf_counter() - started < 0.5
+    assert log == ["a cancelled"]
+    assert (router.hedged, router.hedge_wins) == (1, 1)
+
+
+def test_always_hedged_primary_trips_its_breaker():
+    slow = _provider("a", delay=1.0, reply="بطيء")
+    slow.breaker = CircuitBreaker(min_calls=3, error_rate=0.5, slow_seconds=5)
+    router = LLMRouter([slow, _provider("b", delay=0.01, reply="سريع")], min_delay=0.05, max_delay=0.05)
+
+    async def run():
+        for _ in range(3):
+            assert await router.complete([]) == "سريع"
+
+    asyncio.run(run())
+    # Each call lost well under slow_seconds, but losing to a hedge counts as slow
+    assert slow.breaker.state == "open" and slow.breaker.stats()["lost"] == 3
+    assert slow.breaker.p95() is None
+
+
+def test_failed_primary_fails_over_without_waiting():
+    router = LLMRouter([_provider("a", fail=True), _provider("b", reply="تمام")], min_delay=1, max_delay=1)
+    started = time.perf_counter()
+    assert asyncio.run(router.complete([])) == "تمام"
+    assert time.perf_counter() - started < 0.5
+    assert router.failovers == 1 and router.hedged == 0
+
+
+def test_open_circuits_fail_fast():
+    providers = [_provider("a", fail=True), _provider("b", fail=True)]
+    for provider in providers:
+        provider.breaker = CircuitBreaker(min_calls=1, open_seconds=60)
+    router = LLMRouter(providers)
+    with pytest.raises(AllProvidersFailed):
+        asyncio.run(router.complete([]))
+    with pytest.raises(AllProvidersFailed, match="No LLM provider available"):
+        asyncio.run(router.complete([]))
+    assert router.exhausted == 2
+
+
+def test_stream_hedges_on_time_to_first_token():
+    log = []
+    router = LLMRouter([_provider("a", delay=1.0, reply="بطيء جدا", log=log),
+                        _provider("b", delay=0.01, reply="هلا والله", log=log)],
+                       min_delay=0.05, max_delay=0.05)
+
+    async def run():
+        return [delta async for delta in router.stream([])]
+
+    assert asyncio.run(run()) == ["هلا ", "والله "]
+    assert sorted(log) == ["a closed", "b closed"]
+
+
+def test_anthropic_streams_when_openai_rejects(monkeypatch):
+    async def run():
+        openai_server = await FakeProviderServer(latency=0, error="400 Bad Request").start()
+        anthropic_server = await FakeProviderServer(latency=0, token_delay=0, reply="هلا والله، كيف حالك؟").start()
+        monkeypatch.setenv("OPENAI_BASE_URL", openai_server.base_url + "/v1")
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        monkeypatch.setenv("ANTHROPIC_BASE_URL", anthropic_server.base_url)
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+        router = LLMRouter([llm_router._ADAPTERS["openai"](), llm_router._ADAPTERS["anthropic"]()])
+        messages = [{"role": "system", "content": "كن لطيفا"}, {"role": "user", "content": "مرحبا"}]
+        try:
+            deltas = [d async for d in router.stream(messages, max_tokens=50, temperature=0.8, timeout=5)]
+            text = await router.complete(messages, max_tokens=50, temperature=0.8, timeout=5)
+            return deltas, text, router
+        finally:
+            await llm_clients.aclose()
+            await openai_server.stop()
+            await anthropic_server.stop()
+
+    deltas, text, router = asyncio.run(run())
+    assert "".join(deltas) == "هلا والله، كيف حالك؟" and len(deltas) == 4
+    assert text == "هلا والله، كيف حالك؟"
+    assert router.failovers == 2
+    assert router.stats()["providers"]["anthropic"]["wins"] == 2
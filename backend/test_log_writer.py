@@ -0,0 +1,97 @@
+import asyncio
+import json
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from database import Base
+from log_writer import ConversationLogWriter
+from models import ConversationLog
+
+
+async def _sqlite(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'logs.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def _count(engine):
+    async with engine.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(ConversationLog))).scalar()
+
+
+def _row(i, escalate=False):
+    return (f"s{i}", f"نص {i}", "رد", "دعم", "قلق", escalate)
+
+
+def test_rows_are_batched_by_size_and_interval(tmp_path):
+    async def run():
+        engine, sessions = await _sqlite(tmp_path)
+        writer = ConversationLogWriter(sessions, batch_size=10, flush_interval=0.2)
+        for i in range(25):
+            await writer.submit(*_row(i))
+        await asyncio.sleep(0.05)
+        assert await _count(engine) == 20  # two full batches, the rest waits
+        await asyncio.sleep(0.3)
+        assert await _count(engine) == 25
+        assert writer.stats()["batches"] == 3
+        await writer.close()
+        await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_escalations_flush_immediately(tmp_path):
+    async def run():
+        engine, sessions = await _sqlite(tmp_path)
+        writer = ConversationLogWriter(sessions, batch_size=100, flush_interval=10)
+        await writer.submit(*_row(1))
+        await writer.submit(*_row(2, escalate=True))
+        await asyncio.sleep(0.05)
+        assert await _count(engine) == 2
+        await writer.close()
+        await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_backpressure_and_spill_on_shutdown(tmp_path):
+    class Broken:
+        async def __aenter__(self):
+            raise ConnectionError("database down")
+
+        async def __aexit__(self, *exc):
+            return False
+
+    async def run():
+        spill = tmp_path / "spill.jsonl"
+        writer = ConversationLogWriter(lambda: Broken(), batch_size=2, flush_interval=0.01,
+                                       max_queue=2, retry_delay=0.01, spill_path=str(spill))
+        for i in range(4):
+            await writer.submit(*_row(i))
+        # Queue full and the batch in flight keeps failing: the next submit waits
+        try:
+            await asyncio.wait_for(writer.submit(*_row(4)), 0.1)
+            blocked = False
+        except asyncio.TimeoutError:
+            blocked = True
+        assert blocked
+        await writer.close(timeout=0.1)
+        rows = [json.loads(line) for line in spill.read_text(encoding="utf-8").splitlines()]
+        assert sorted(r["session_id"] for r in rows) == ["s0", "s1", "s2", "s3"]
+        assert writer.stats()["spilled"] == 4
+
+    asyncio.run(run())
+
+
+def test_drains_queue_on_close(tmp_path):
+    async def run():
+        engine, sessions = await _sqlite(tmp_path)
+        writer = ConversationLogWriter(sessions, batch_size=100, flush_interval=10)
+        for i in range(5):
+            await writer.submit(*_row(i))
+        await writer.close()
+        assert await _count(engine) == 5
+        await engine.dispose()
+
+    asyncio.run(run())
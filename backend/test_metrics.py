@@ -0,0 +1,74 @@
+import json
+from fastapi.testclient import TestClient
+import main
+import services
+from benchmarks.load_test import histogram_quantile, scrape_histogram, stage_report
+from metrics import Callback, Counter, Histogram, Registry
+
+
+def test_exposition_format():
+    registry = Registry()
+    latency = registry.register(Histogram("t_seconds", "Latency.", ("stage",), buckets=(0.01, 0.1, 1)))
+    for value in (0.005, 0.01, 0.5, 7):
+        latency.labels("stt").observe(value)
+    errors = registry.register(Counter("t_errors_total", "Errors.", ("kind",)))
+    errors.labels('say "hi"\n').inc(2)
+    registry.register(Callback("t_inflight", "In flight.", ("provider",), lambda: [(("llm",), 3)]))
+    lines = registry.render().splitlines()
+    assert "# TYPE t_seconds histogram" in lines
+    assert 't_seconds_bucket{stage="stt",le="0.01"} 2' in lines
+    assert 't_seconds_bucket{stage="stt",le="1"} 3' in lines
+    assert 't_seconds_bucket{stage="stt",le="+Inf"} 4' in lines
+    assert 't_seconds_count{stage="stt"} 4' in lines
+    assert 't_errors_total{kind="say \\"hi\\"\\n"} 2' in lines
+    assert 't_inflight{provider="llm"} 3' in lines
+
+
+def test_ws_turn_is_traced_and_measured(monkeypatch):
+    async def analyze_intent(text):
+        return "دعم", "قلق", "llm"
+
+    async def dual_model_response_stream(text, intent, emotion, history=None):
+        yield "هلا."
+
+    async def tts_cached(text):
+        return "f.mp3"
+
+    monkeypatch.setattr(services, "analyze_intent", analyze_intent)
+    monkeypatch.setattr(services, "dual_model_response_stream", dual_model_response_stream)
+    monkeypatch.setattr(services, "tts_cached", tts_cached)
+
+    client = TestClient(main.app)
+    with client.websocket_connect("/ws") as ws:
+        ws.receive_json()
+        ws.send_json({"message": "ضايق شوي"})
+        segments = []
+        while True:
+            data = json.loads(ws.receive_text())
+            if "tts_segment" in data:
+                segments.append(data["tts_segment"])
+            if "response" in data:
+                break
+    assert segments and all(s["turn_id"] == data["trace_id"] for s in segments)
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'voice_stage_seconds_count{endpoint="ws",stage="respond"}' in body
+    assert 'voice_turn_seconds_count{endpoint="ws",outcome="ok"}' in body
+    assert 'websocket_connections{endpoint="ws"} 0' in body
+    assert 'provider_inflight_calls{provider="llm"} 0' in body
+
+
+def test_load_test_reads_quantiles_from_exposition():
+    registry = Registry()
+    latency = registry.register(Histogram("voice_stage_seconds", "Latency.", ("endpoint", "stage"), buckets=(0.1, 0.2, 0.4)))
+    for value in [0.05] * 50 + [0.15] * 40 + [0.3] * 10:
+        latency.labels("ws", "respond").observe(value)
+    before = registry.render()
+    latency.labels("ws", "respond").observe(5)
+    buckets = scrape_histogram(registry.render(), "voice_stage_seconds")[(("endpoint", "ws"), ("stage", "respond"))]
+    assert buckets[0.2] == 90 and buckets[float("inf")] == 101
+    assert abs(histogram_quantile(0.5, buckets) - 0.101) < 1e-3
+    assert histogram_quantile(0.999, buckets) == 0.4  # beyond the last bucket
+    assert stage_report(before, registry.render())["ws"]["respond"]["count"] == 1
@@ -0,0 +1,207 @@
+import asyncio
+import time
+import pytest
+import pipeline
+import services
+import sessions
+from admission import Overloaded
+from pipeline import Stage, StageFailed, TurnContext, TurnPipeline, SpeculationStats, run_turn
+from sessions import estimate_tokens
+
+
+def _sleeper(name, delay, log):
+    async def fn(ctx):
+        log.append(("start", name))
+        await asyncio.sleep(delay)
+        log.append(("end", name))
+        return name
+    return fn
+
+
+def test_independent_stages_overlap_and_dependents_wait():
+    log = []
+    pipeline = TurnPipeline([
+        Stage("c", _sleeper("c", 0, log), deps=["a", "b"]),
+        Stage("a", _sleeper("a", 0.05, log)),
+        Stage("b", _sleeper("b", 0.05, log)),
+    ])
+    ctx = asyncio.run(pipeline.run(TurnContext("x")))
+    assert log[:2] == [("start", "a"), ("start", "b")]
+    assert log.index(("start", "c")) > log.index(("end", "a"))
+    assert ctx.results == {"a": "a", "b": "b", "c": "c"}
+    assert ctx.timings["c"]["start_ms"] >= 40
+
+
+def test_skipped_stage_and_failure_reporting():
+    async def boom(ctx):
+        raise RuntimeError("provider down")
+
+    pipeline = TurnPipeline([
+        Stage("a", _sleeper("a", 0, [])),
+        Stage("skip", boom, deps=["a"], when=lambda ctx: False),
+        Stage("fail", boom, deps=["a"]),
+    ])
+    ctx = TurnContext("x")
+    with pytest.raises(StageFailed) as excinfo:
+        asyncio.run(pipeline.run(ctx))
+    assert excinfo.value.stage == "fail"
+    assert ctx.timings["skip"]["status"] == "skipped"
+    assert ctx.timings["fail"]["status"] == "error"
+
+
+def test_cycles_are_rejected():
+    with pytest.raises(ValueError):
+        TurnPipeline([Stage("a", None, deps=["b"]), Stage("b", None, deps=["a"])])
+
+
+@pytest.fixture
+def fake_services(monkeypatch):
+    calls = []
+
+    async def analyze_intent(text):
+        calls.append("intent")
+        return "دعم", "قلق", "llm"
+
+    async def dual_model_response(text, intent, emotion, history=None):
+        calls.append("respond")
+        return "هلا، أنا هنا أسمعك."
+
+    async def tts_cached(text):
+        calls.append(f"tts:{text}")
+        return "f.mp3"
+
+    monkeypatch.setattr(services, "analyze_intent", analyze_intent)
+    monkeypatch.setattr(services, "dual_model_response", dual_model_response)
+    monkeypatch.setattr(services, "tts_cached", tts_cached)
+    return calls
+
+
+def test_normal_turn_runs_each_stage_once(fake_services):
+    ctx = asyncio.run(run_turn("ضايق شوي اليوم"))
+    assert fake_services == ["intent", "respond", "tts:هلا، أنا هنا أسمعك."]
+    assert not ctx.escalate
+    assert ctx.response_text == "هلا، أنا هنا أسمعك."
+    assert ctx.tts_audio_urls == [services.tts_url("f.mp3")]
+    assert ctx.timings["escalation_audio"]["status"] == "skipped"
+
+
+def test_escalation_skips_generation(fake_services):
+    ctx = asyncio.run(run_turn("أفكر في الانتحار"))
+    assert ctx.escalate and ctx.safety["category"] == "crisis"
+    assert fake_services == ["intent", f"tts:{services.CRISIS_MESSAGE}"]
+    assert ctx.timings["respond"]["status"] == "skipped"
+
+
+@pytest.fixture
+def speculative(monkeypatch):
+    calls = []
+    stats = SpeculationStats()
+    monkeypatch.setattr(pipeline, "SPECULATIVE_RESPONSE", True)
+    monkeypatch.setattr(pipeline, "speculation_stats", stats)
+
+    async def analyze_intent(text):
+        calls.append("intent")
+        await asyncio.sleep(0.1)
+        return ("crisis" if "وداع" in text else "دعم"), "قلق", "llm"
+
+    async def dual_model_response_stream(text, intent, emotion, history=None):
+        calls.append(("stream", intent))
+        for word in ["هلا. ", "أنا ", "هنا."]:
+            await asyncio.sleep(0.04)
+            yield word
+
+    async def tts_cached(text):
+        return "f.mp3"
+
+    monkeypatch.setattr(services, "analyze_intent", analyze_intent)
+    monkeypatch.setattr(services, "dual_model_response_stream", dual_model_response_stream)
+    monkeypatch.setattr(services, "tts_cached", tts_cached)
+    return calls, stats
+
+
+def test_speculative_reply_overlaps_intent(speculative):
+    calls, stats = speculative
+    sent = []
+
+    async def emit(message):
+        sent.append(message)
+
+    started = time.perf_counter()
+    ctx = asyncio.run(run_turn("ضايق شوي اليوم", emit=emit))
+    elapsed = time.perf_counter() - started
+    # Sequential would be 0.1 s of intent plus 0.12 s of generation
+    assert elapsed < 0.18
+    assert ("stream", None) in calls
+    assert ctx.response_text == "هلا. أنا هنا."
+    assert [m["response_delta"] for m in sent if "response_delta" in m] == ["هلا. ", "أنا ", "هنا."]
+    assert stats.stats()["hits"] == 1 and stats.stats()["used_tokens"] == estimate_tokens("هلا. أنا هنا.")
+
+
+def test_speculative_reply_discarded_on_escalation(speculative):
+    calls, stats = speculative
+    sent = []
+
+    async def emit(message):
+        sent.append(message)
+
+    ctx = asyncio.run(run_turn("أبي أقول وداع", emit=emit))
+    assert ctx.escalate
+    assert not any("response_delta" in m for m in sent)
+    # Cancelled after the first or second delta
+    assert stats.misses == 1 and stats.wasted_tokens in (estimate_tokens("هلا. "), estimate_tokens("هلا. أنا "))
+    assert ctx.results["draft"].task.cancelled()
+
+
+def test_shed_draft_fails_the_turn(speculative, monkeypatch):
+    async def shed_stream(text, intent, emotion, history=None):
+        raise Overloaded("llm", "queue full")
+        yield
+
+    monkeypatch.setattr(services, "dual_model_response_stream", shed_stream)
+    with pytest.raises(StageFailed) as excinfo:
+        asyncio.run(run_turn("ضايق شوي اليوم", emit=lambda m: asyncio.sleep(0)))
+    assert excinfo.value.stage == "respond"
+    assert isinstance(excinfo.value.error, Overloaded)
+
+
+def test_no_speculation_when_prescreen_matches(speculative):
+    calls, stats = speculative
+    ctx = asyncio.run(run_turn("أفكر في الانتحار"))
+    assert ctx.escalate
+    assert calls == ["intent"]
+    assert stats.skipped == 1
+
+
+def test_phatic_turns_skip_intent_and_reuse_replies(fake_services, monkeypatch):
+    monkeypatch.setattr(services, "phatic_cache", services.PhaticCache(variants=1))
+    first = asyncio.run(run_turn("مرحبا"))
+    second = asyncio.run(run_turn("مرحبا!"))
+    assert first.intent == "تحية"
+    assert second.response_text == first.response_text
+    # One generation for the first turn, none for the second; no intent calls
+    assert fake_services.count("respond") == 1 and "intent" not in fake_services
+
+
+def test_cached_phatic_replies_never_carry_session_history(monkeypatch):
+    histories = []
+
+    async def dual_model_response(text, intent, emotion, history=None):
+        histories.append(history)
+        return f"رد يذكر {history[-1][0]}" if history else "هلا والله"
+
+    async def tts_cached(text):
+        return "f.mp3"
+
+    monkeypatch.setattr(services, "dual_model_response", dual_model_response)
+    monkeypatch.setattr(services, "tts_cached", tts_cached)
+    monkeypatch.setattr(services, "phatic_cache", services.PhaticCache(variants=1))
+    monkeypatch.setattr(sessions, "session_store", sessions.SessionStore(loader=None))
+    first = sessions.session_store.new_session()
+    second = sessions.session_store.new_session()
+    asyncio.run(sessions.session_store.record(first, "أمس تطلقت", "الله يعينك"))
+
+    # The first session's greeting fills the cache; the second is served from it
+    mine = asyncio.run(run_turn("مرحبا", session_id=first))
+    theirs = asyncio.run(run_turn("مرحبا", session_id=second))
+    assert histories == [[]]
+    assert mine.response_text == theirs.response_text == "هلا والله"
@@ -0,0 +1,46 @@
+import asyncio
+import json
+import services
+from safety import SafetyMatcher, normalize_arabic, safety_matcher
+
+
+def test_normalization_folds_variants():
+    assert normalize_arabic("أَنْتَحِرُ") == "انتحر"
+    assert normalize_arabic("إنتـــحار") == "انتحار"
+    assert normalize_arabic("مستشفى الطوارئ") == "مستشفي الطواري"
+    assert normalize_arabic("مساعدة") == "مساعده"
+    assert normalize_arabic("Kill Myself") == "kill myself"
+
+
+def test_variants_match_and_positions_refer_to_original_text():
+    text = "والله أبي أقـتـلُ نفسِي اليوم"
+    match = safety_matcher.first(text)
+    assert match.category == "crisis"
+    assert text[match.start:match.end] == "أقـتـلُ نفسِي"
+
+
+def test_overlapping_keywords_are_all_reported():
+    categories = {m.category for m in safety_matcher.find_all("أقتل نفسي")}
+    assert categories == {"crisis", "violence"}
+
+
+def test_category_priority_beats_position():
+    # Referral keyword comes first in the text but crisis wins
+    match = safety_matcher.first("أحتاج طبيب لأني أفكر في الانتحار")
+    assert match.category == "crisis"
+
+
+def test_lexicon_loads_from_file(tmp_path):
+    path = tmp_path / "lexicon.json"
+    path.write_text(json.dumps({"crisis": ["ما أبي أعيش"], "referral": []}, ensure_ascii=False), encoding="utf-8")
+    matcher = SafetyMatcher.from_file(str(path))
+    assert matcher.first("صراحة ما ابي اعيش").keyword == "ما ابي اعيش"
+    assert matcher.first("كل شي تمام") is None
+
+
+def test_safety_check_reports_category_and_match():
+    result = asyncio.run(services.safety_check("سأؤذي شخصاً", "دعم", "غضب"))
+    assert result["escalate"] and result["category"] == "violence"
+    assert result["message"] == services.VIOLENCE_MESSAGE
+    assert result["match"]["keyword"] == "اوذي شخص"
+    assert asyncio.run(services.safety_check("الحمد لله بخير", "دعم", "أمل")) == {"escalate": False}
@@ -0,0 +1,91 @@
+import asyncio
+import llm_clients
+import services
+import speech_pool
+from benchmarks import fake_speech_sdk
+from benchmarks.fake_providers import FakeProviderServer
+
+
+def _with_fake_openai(monkeypatch, coro_fn, **server_kwargs):
+    async def run():
+        server = await FakeProviderServer(**server_kwargs).start()
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url + "/v1")
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        # OpenAI only; keep the router from hedging to a real Anthropic endpoint
+        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+        try:
+            return await coro_fn()
+        finally:
+            await llm_clients.aclose()
+            await server.stop()
+
+    return asyncio.run(run())
+
+
+async def _collect(agen):
+    return [piece async for piece in agen]
+
+
+def test_response_stream_yields_deltas(monkeypatch):
+    deltas = _with_fake_openai(
+        monkeypatch,
+        lambda: _collect(services.dual_model_response_stream("مرحبا", "دعم", "قلق")),
+        latency=0, token_delay=0, reply="هلا والله، كيف حالك؟"
+    )
+    assert len(deltas) == 4
+    assert "".join(deltas) == "هلا والله، كيف حالك؟"
+
+
+def test_response_stream_falls_back_when_provider_is_down(monkeypatch):
+    monkeypatch.setenv("OPENAI_BASE_URL", "http://127.0.0.1:9/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+
+    async def run():
+        try:
+            return await _collect(services.dual_model_response_stream("مرحبا", "دعم", "قلق"))
+        finally:
+            await llm_clients.aclose()
+
+    assert asyncio.run(run()) == [services.FALLBACK_RESPONSE]
+
+
+def test_phatic_cache_eligibility():
+    cache = services.PhaticCache()
+    key, intent, emotion = cache.classify("  السلام عليكم!! ")
+    assert key[0] == "السلام عليكم" and intent == "تحية"
+    assert cache.classify("مرحبا، أبي أتكلم عن مشكلة") is None
+    # Allow-listed phrase plus a safety keyword is never eligible
+    assert cache.classify("مع السلامة انتحار") is None
+
+
+def test_phatic_cache_rotates_variants_and_expires():
+    cache = services.PhaticCache(ttl=10, max_entries=1, variants=2)
+    key = cache.classify("شكرا")[0]
+    cache.add(key, "العفو", now=0)
+    assert cache.get(key, now=1) is None  # not all variants seen yet
+    cache.add(key, "حياك الله", now=1)
+    assert [cache.get(key, now=2) for _ in range(3)] == ["العفو", "حياك الله", "العفو"]
+    assert cache.get(key, now=11) is None
+    cache.add(key, "العفو", now=12)
+    cache.add(cache.classify("مرحبا")[0], "هلا", now=12)
+    assert cache.stats()["entries"] == 1 and cache.stats()["evictions"] == 1
+    assert cache.stats()["hits"] == 3
+
+
+def test_speech_calls_against_fake_sdk(monkeypatch):
+    monkeypatch.setattr(services, "speechsdk", fake_speech_sdk)
+    monkeypatch.setattr(speech_pool, "speechsdk", fake_speech_sdk)
+    monkeypatch.setattr(services, "speech_pools", speech_pool.SpeechPools(threads=2, size=1))
+    monkeypatch.setattr(fake_speech_sdk, "settings", dict(fake_speech_sdk.settings))
+    monkeypatch.setenv("AZURE_SPEECH_KEY", "test")
+    monkeypatch.setenv("AZURE_SERVICE_REGION", "local")
+    fake_speech_sdk.configure(stt_latency=0, tts_latency=0, error_rate=0, transcript="أنا بخير")
+    assert asyncio.run(services.stt_omani_pcm(b"\x00" * 3200)) == "أنا بخير"
+    assert asyncio.run(services.synthesize_speech("هلا")).startswith(b"\xff\xfb")
+
+    # Failures come back as Canceled results, which count against the provider
+    fake_speech_sdk.configure(error_rate=1)
+    assert asyncio.run(services.stt_omani_pcm(b"\x00" * 3200)) == ""
+    assert asyncio.run(services.synthesize_speech("هلا")) is None
+    assert [fake_speech_sdk.calls[k] for k in ("recognize", "synthesize", "failed")] == [1, 1, 2]
@@ -0,0 +1,250 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from fastapi.testclient import TestClient
+import log_writer
+import main
+import pipeline
+import services
+import sessions
+from crud import conversation_history, insert_conversation_logs
+from database import Base
+from log_writer import ConversationLogWriter
+from benchmarks.fake_redis import FakeRedisServer
+from sessions import RedisSessionStore, SessionStore, estimate_tokens, session_token
+from storage import RedisClient
+
+
+def test_history_is_capped_by_turns_and_tokens():
+    store = SessionStore(loader=None, max_turns=3, max_tokens=1000)
+    sid = store.new_session()
+    for i in range(5):
+        store.append(sid, f"سؤال {i}", f"جواب {i}")
+    assert asyncio.run(store.history(sid)) == [(f"سؤال {i}", f"جواب {i}") for i in (2, 3, 4)]
+
+    long_reply = "ك" * 300
+    store = SessionStore(loader=None, max_turns=10, max_tokens=2 * estimate_tokens(long_reply) + 10)
+    sid = store.new_session()
+    for i in range(4):
+        store.append(sid, "س", long_reply)
+    assert len(asyncio.run(store.history(sid))) == 2
+
+
+def test_sessions_load_once_and_are_evicted_lru():
+    loads = []
+
+    async def loader(session_id, limit):
+        loads.append(session_id)
+        return [("قديم", "رد قديم")]
+
+    store = SessionStore(loader=loader, max_sessions=2)
+    sid = "2f0c1d9e-5a7b-4c3d-8e9f-0123456789ab"
+    assert store.open(session_token(sid)) == sid
+    # Ids the server did not sign start a new session
+    assert store.open(sid) != sid
+    token = session_token(sid)
+    assert store.open(token[:-1] + ("A" if token[-1] != "A" else "B")) != sid
+    asyncio.run(store.history(sid))
+    store.append(sid, "جديد", "رد جديد")
+    assert asyncio.run(store.history(sid)) == [("قديم", "رد قديم"), ("جديد", "رد جديد")]
+    assert loads == [sid]
+    # New sessions never hit the loader
+    asyncio.run(store.history(store.new_session()))
+    assert loads == [sid]
+    store.new_session()
+    assert store.stats()["evictions"] == 3  # the two rejected tokens also started sessions
+
+
+def test_keyset_pagination(tmp_path):
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'logs.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        start = datetime(2026, 1, 1)
+        async with factory() as db:
+            await insert_conversation_logs(db, [
+                {"session_id": sid, "user_transcript": f"{sid}{i}", "created_at": start + timedelta(minutes=i)}
+                for sid in ("a", "b") for i in range(5)
+            ])
+            pages, before = [], None
+            while True:
+                rows = await conversation_history(db, "a", before=before, limit=2)
+                if not rows:
+                    break
+                pages.append([r.user_transcript for r in rows])
+                before = (rows[-1].created_at, rows[-1].id)
+        await engine.dispose()
+        return pages
+
+    assert asyncio.run(run()) == [["a4", "a3"], ["a2", "a1"], ["a0"]]
+
+
+def test_history_endpoint_requires_the_session_token(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'logs.db'}")
+    factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with factory() as db:
+            await insert_conversation_logs(db, [{"session_id": "a", "user_transcript": "سر"}])
+
+    async def get_db():
+        async with factory() as db:
+            yield db
+
+    asyncio.run(setup())
+    main.app.dependency_overrides[main.get_db] = get_db
+    try:
+        client = TestClient(main.app)
+        url = "/api/sessions/a/history"
+        assert client.get(url).status_code == 401
+        assert client.get(url, headers={"Authorization": "Bearer a"}).status_code == 401
+        assert client.get(url, headers={"Authorization": f"Bearer {session_token('b')}"}).status_code == 401
+        response = client.get(url, headers={"Authorization": f"Bearer {session_token('a')}"})
+    finally:
+        main.app.dependency_overrides.clear()
+        asyncio.run(engine.dispose())
+    assert response.status_code == 200
+    assert [turn["user_transcript"] for turn in response.json()["turns"]] == ["سر"]
+
+
+def test_turns_carry_the_session_history(monkeypatch):
+    prompts = []
+
+    async def analyze_intent(text):
+        return "دعم", "قلق", "llm"
+
+    async def dual_model_response(text, intent, emotion, history=None):
+        prompts.append(history)
+        return f"رد على {text}"
+
+    async def tts_cached(text):
+        return "f.mp3"
+
+    monkeypatch.setattr(services, "analyze_intent", analyze_intent)
+    monkeypatch.setattr(services, "dual_model_response", dual_model_response)
+    monkeypatch.setattr(services, "tts_cached", tts_cached)
+    monkeypatch.setattr(sessions, "session_store", SessionStore(loader=None))
+
+    sid = sessions.session_store.new_session()
+    asyncio.run(pipeline.run_turn("أول", session_id=sid))
+    asyncio.run(pipeline.run_turn("ثاني", session_id=sid))
+    asyncio.run(pipeline.run_turn("ثالث"))
+    assert prompts == [[], [("أول", "رد على أول")], []]
+
+
+def test_ws_turns_are_logged_and_reloaded_after_eviction(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'logs.db'}")
+    factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    prompts = []
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def loader(session_id, limit):
+        async with factory() as db:
+            rows = await conversation_history(db, session_id, limit=limit)
+        return [(row.user_transcript, row.bot_response) for row in reversed(rows)]
+
+    async def analyze_intent(text):
+        return "دعم", "قلق", "llm"
+
+    async def dual_model_response_stream(text, intent, emotion, history=None):
+        prompts.append(history)
+        yield f"رد على {text}."
+
+    async def tts_cached(text):
+        return "f.mp3"
+
+    async def idle(*args):
+        pass
+
+    def turn(ws, message):
+        ws.send_json({"message": message})
+        while "response" not in ws.receive_json():
+            pass
+
+    asyncio.run(create_tables())
+    monkeypatch.setattr(services, "analyze_intent", analyze_intent)
+    monkeypatch.setattr(services, "dual_model_response_stream", dual_model_response_stream)
+    monkeypatch.setattr(services, "tts_cached", tts_cached)
+    # Only the lifespan's log writer is wanted; no TTS prewarm or artifact sweeps
+    monkeypatch.setattr(main, "prewarm_tts", idle)
+    monkeypatch.setattr(main.artifact_store, "run_sweeper", idle)
+    store = SessionStore(loader=loader, max_sessions=1)
+    monkeypatch.setattr(sessions, "session_store", store)
+    monkeypatch.setattr(main, "session_store", store)
+    writer = ConversationLogWriter(factory, flush_interval=0.01)
+    monkeypatch.setattr(log_writer, "conversation_logs", writer)
+
+    with TestClient(main.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            token = ws.receive_json()["session_token"]
+            turn(ws, "أول")
+        # Another session pushes the first out of memory
+        with client.websocket_connect("/ws") as ws:
+            ws.receive_json()
+        for _ in range(100):
+            if writer.written:
+                break
+            time.sleep(0.01)
+        with client.websocket_connect(f"/ws?session={token}") as ws:
+            ws.receive_json()
+            turn(ws, "ثاني")
+    asyncio.run(engine.dispose())
+    assert store.stats()["loads"] == 1
+    assert prompts == [[], [("أول", "رد على أول.")]]
+    assert writer.written == 2
+
+
+def test_redis_sessions_follow_the_client_between_nodes():
+    loads = []
+
+    async def loader(session_id, limit):
+        loads.append(session_id)
+        return [("قديم", "رد قديم")]
+
+    async def run():
+        server = await FakeRedisServer().start()
+        client = RedisClient(server.url)
+        node_a = RedisSessionStore(client, loader=loader, max_turns=3)
+        node_b = RedisSessionStore(client, loader=loader, max_turns=3)
+        try:
+            fresh = node_a.new_session()
+            assert await node_a.history(fresh) == []
+            await node_a.record(fresh, "أول", "رد أول")
+            await node_b.record(fresh, "ثاني", "رد ثاني")
+            shared = await node_a.history(fresh)
+
+            # A session Redis does not know is loaded once, then kept there
+            token = "client-token-0123456789"
+            first = await node_b.history(token)
+            await node_a.record(token, "جديد", "رد جديد")
+            await node_a.record(token, "آخر", "رد آخر")
+            await node_a.record(token, "أخير", "رد أخير")
+            resumed = await node_b.history(token)
+            return shared, first, resumed
+        finally:
+            await client.aclose()
+            await server.stop()
+
+    shared, first, resumed = asyncio.run(run())
+    assert shared == [("أول", "رد أول"), ("ثاني", "رد ثاني")]
+    assert first == [("قديم", "رد قديم")]
+    assert resumed == [("جديد", "رد جديد"), ("آخر", "رد آخر"), ("أخير", "رد أخير")]
+    assert loads == ["client-token-0123456789"]
+
+
+def test_redis_outage_falls_back_to_the_logs():
+    async def loader(session_id, limit):
+        return [("قديم", "رد قديم")]
+
+    store = RedisSessionStore(RedisClient("redis://127.0.0.1:9/0", timeout=0.5), loader=loader)
+    asyncio.run(store.record("client-token-0123456789", "س", "ج"))
+    assert asyncio.run(store.history("client-token-0123456789")) == [("قديم", "رد قديم")]
+    assert store.stats()["errors"] == 2
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import services
+import speech_pool
+import streaming_stt
+from benchmarks import fake_speech_sdk
+from speech_pool import SpeechPool, SpeechPools
+from streaming_stt import StreamingTranscriber
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Connection:
+    def __init__(self):
+        self.closed = False
+        self.disconnected = fake_speech_sdk._Signal()
+
+    def close(self):
+        self.closed = True
+
+
+def _pool(**options):
+    built = []
+
+    def build():
+        built.append(threading.current_thread().name)
+        return len(built)
+
+    return SpeechPool("test", build, lambda obj: Connection(), **options), built
+
+
+def test_prewarmed_objects_are_reused_until_max_uses():
+    pool, built = _pool(size=2, max_uses=3)
+
+    async def run():
+        await pool.fill()
+        used = []
+        for _ in range(4):
+            async with pool.lease() as lease:
+                used.append(lease.obj)
+        await asyncio.sleep(0.05)  # background refill
+        return used
+
+    used = asyncio.run(run())
+    assert used == [2, 2, 2, 1]  # most recently used first, recycled after three uses
+    assert pool.stats()["hits"] == 4 and pool.stats()["misses"] == 0
+    assert pool.recycled == 1 and len(built) == 3 and pool.stats()["ready"] == 2
+
+
+def test_failed_disconnected_and_stale_objects_are_recycled():
+    clock = Clock()
+    pool, built = _pool(size=1, max_idle=60, clock=clock)
+
+    async def lease_once(fail=False, error=None):
+        async with pool.lease() as lease:
+            if fail:
+                lease.fail()
+            if error:
+                raise error
+            return lease
+
+    async def run():
+        await pool.fill()
+        first = await lease_once(fail=True)
+        await pool.fill()
+        try:
+            await lease_once(error=RuntimeError("sdk"))
+        except RuntimeError:
+            pass
+        await pool.fill()
+        third = await lease_once()
+        third.connection.disconnected.fire(None)  # the service dropped it
+        fourth = await lease_once()
+        await asyncio.sleep(0.05)  # background refill
+        clock.now += 61
+        pool.prune()
+        return first, third, fourth
+
+    first, third, fourth = asyncio.run(run())
+    assert first.connection.closed and third.connection.closed
+    assert fourth.obj != third.obj
+    assert pool.stats()["ready"] == 0 and fourth.connection.closed  # idle too long
+
+
+def test_services_use_connected_objects_on_speech_threads(monkeypatch):
+    monkeypatch.setattr(services, "speechsdk", fake_speech_sdk)
+    monkeypatch.setattr(speech_pool, "speechsdk", fake_speech_sdk)
+    monkeypatch.setattr(fake_speech_sdk, "settings", dict(fake_speech_sdk.settings))
+    monkeypatch.setenv("AZURE_SPEECH_KEY", "test")
+    monkeypatch.setenv("AZURE_SERVICE_REGION", "local")
+    pools = SpeechPools(threads=4, size=2)
+    monkeypatch.setattr(services, "speech_pools", pools)
+    fake_speech_sdk.configure(stt_latency=0, tts_latency=0, connect_latency=0.2, error_rate=0, transcript="أنا بخير")
+    threads = set()
+    monkeypatch.setattr(fake_speech_sdk.SpeechSynthesizer, "speak_text_async",
+                        lambda self, text: threads.add(threading.current_thread().name) or fake_speech_sdk._Future(
+                            lambda: fake_speech_sdk._Result(fake_speech_sdk.ResultReason.SynthesizingAudioCompleted,
+                                                            audio_data=b"mp3")))
+
+    async def run():
+        maintenance = asyncio.ensure_future(services.maintain_speech_pools())
+        await asyncio.sleep(0.5)  # both pools connect in parallel
+        started = asyncio.get_running_loop().time()
+        transcript = await services.stt_omani_pcm(b"\x00" * 3200)
+        audio = await services.synthesize_speech("هلا")
+        elapsed = asyncio.get_running_loop().time() - started
+        maintenance.cancel()
+        return transcript, audio, elapsed
+
+    transcript, audio, elapsed = asyncio.run(run())
+    assert (transcript, audio) == ("أنا بخير", b"mp3")
+    assert elapsed < 0.2  # neither call waited for a connection
+    assert threads and all(name.startswith("speech") for name in threads)
+    stats = pools.stats()
+    assert stats["stt:ar-OM"]["hits"] == 1 and stats["tts:ar-SA-HamedNeural:Audio16Khz32KBitRateMonoMp3"]["hits"] == 1
+
+
+def test_close_shuts_down_the_speech_threads():
+    pools = SpeechPools(threads=2, size=1)
+    asyncio.run(pools.run(lambda: None))
+    pools.close()
+    assert pools.executor._shutdown
+
+
+def test_streaming_transcriber_uses_a_pooled_recognizer(monkeypatch):
+    monkeypatch.setattr(speech_pool, "speechsdk", fake_speech_sdk)
+    monkeypatch.setattr(streaming_stt, "speechsdk", fake_speech_sdk)
+    monkeypatch.setattr(fake_speech_sdk, "settings", dict(fake_speech_sdk.settings))
+    fake_speech_sdk.configure(stt_latency=0.01, connect_latency=0.2, error_rate=0, transcript="أنا بخير",
+                              partial_every_bytes=3200)
+    pools = SpeechPools(threads=2, size=1)
+    threads = []
+    start = streaming_stt.AzureStreamingRecognizer.start
+    monkeypatch.setattr(streaming_stt.AzureStreamingRecognizer, "start",
+                        lambda self, *callbacks: threads.append(threading.current_thread().name) or start(self, *callbacks))
+
+    async def run():
+        recognizers = pools.streaming_recognizers("ar-OM")
+        await recognizers.fill()
+        started = asyncio.get_running_loop().time()
+        transcriber = StreamingTranscriber(recognizers=recognizers, decoder_cmd=None, executor=pools.executor)
+        await transcriber.start()
+        elapsed = asyncio.get_running_loop().time() - started
+        await transcriber.feed(b"\x00" * 3200)
+        return elapsed, await transcriber.finish(timeout=1), recognizers
+
+    elapsed, transcript, recognizers = asyncio.run(run())
+    pools.close()
+    assert transcript == "أنا بخير"
+    assert elapsed < 0.2  # connected ahead of time
+    assert threads and threads[0].startswith("speech")
+    assert recognizers.stats()["hits"] == 1 and recognizers.recycled == 1  # one stream per recognizer
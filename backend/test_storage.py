@@ -0,0 +1,105 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+import main
+import services
+import storage
+from benchmarks.fake_redis import FakeRedisServer
+from storage import DirectoryBlobStore, RedisBlobStore, RedisClient, RedisError
+from tts_cache import TTSCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_redis_client_round_trips_and_expires():
+    clock = Clock()
+
+    async def run():
+        server = await FakeRedisServer(password="s3cret", clock=clock).start()
+        client = RedisClient(f"redis://:s3cret@127.0.0.1:{server.port}/1", max_connections=2)
+        blobs = RedisBlobStore(client, ttl=60)
+        try:
+            await asyncio.gather(*(blobs.put(f"{i}.mp3", bytes([i]) * 1000) for i in range(5)))
+            data = await blobs.get("3.mp3")
+            replies = await client.pipeline([("RPUSH", "l", "a", "b", "c"), ("LTRIM", "l", -2, -1), ("LRANGE", "l", 0, -1)])
+            with pytest.raises(RedisError, match="WRONGTYPE"):
+                await client.execute("GET", "l")
+            clock.now += 61
+            expired = await blobs.get("3.mp3")
+            return data, replies, expired, server.connections, client.stats()
+        finally:
+            await client.aclose()
+            await server.stop()
+
+    data, replies, expired, connections, stats = asyncio.run(run())
+    assert data == b"\x03" * 1000
+    assert replies == [3, True, [b"b", b"c"]]
+    assert expired is None
+    assert connections <= 2 and stats["errors"] == 0
+
+
+def test_wrong_password_is_an_error():
+    async def run():
+        server = await FakeRedisServer(password="s3cret").start()
+        client = RedisClient(f"redis://:nope@127.0.0.1:{server.port}/0")
+        try:
+            await client.execute("PING")
+        finally:
+            await client.aclose()
+            await server.stop()
+
+    with pytest.raises(RedisError, match="invalid password"):
+        asyncio.run(run())
+
+
+def test_directory_blob_store(tmp_path):
+    store = DirectoryBlobStore(str(tmp_path))
+
+    async def run():
+        await store.put("abcdef.mp3", b"audio")
+        return await store.get("abcdef.mp3"), await store.get("missing.mp3")
+
+    assert asyncio.run(run()) == (b"audio", None)
+    assert (tmp_path / "ab" / "cd" / "abcdef.mp3").read_bytes() == b"audio"
+
+
+def test_audio_synthesized_on_one_node_is_served_by_another(tmp_path, monkeypatch):
+    calls = []
+
+    async def synthesize_speech(text):
+        calls.append(text)
+        return b"mp3 bytes"
+
+    monkeypatch.setattr(storage, "audio_blobs", DirectoryBlobStore(str(tmp_path / "shared")))
+    monkeypatch.setattr(services, "synthesize_speech", synthesize_speech)
+    # Node A synthesizes into its own cache and the shared store
+    monkeypatch.setattr(services, "speech_cache", TTSCache(str(tmp_path / "node_a")))
+    filename = asyncio.run(services.tts_cached("هلا والله"))
+
+    # Node B has an empty cache: it serves the file and reuses it instead of synthesizing
+    node_b = TTSCache(str(tmp_path / "node_b"))
+    monkeypatch.setattr(main, "speech_cache", node_b)
+    response = TestClient(main.app).get(f"/api/audio/cache/{filename}")
+    assert response.status_code == 200 and response.content == b"mp3 bytes"
+    monkeypatch.setattr(services, "speech_cache", TTSCache(str(tmp_path / "node_c")))
+    assert asyncio.run(services.tts_cached("هلا والله")) == filename
+    assert calls == ["هلا والله"]
+    assert TestClient(main.app).get(f"/api/audio/cache/{'0' * 64}.mp3").status_code == 404
+
+
+def test_shared_store_outage_does_not_fail_synthesis(tmp_path, monkeypatch):
+    async def synthesize_speech(text):
+        return b"mp3 bytes"
+
+    monkeypatch.setattr(storage, "audio_blobs", RedisBlobStore(RedisClient("redis://127.0.0.1:9/0", timeout=0.5)))
+    monkeypatch.setattr(services, "synthesize_speech", synthesize_speech)
+    monkeypatch.setattr(services, "speech_cache", TTSCache(str(tmp_path)))
+    errors = storage.audio_stats["errors"]
+    assert asyncio.run(services.tts_cached("هلا"))
+    assert storage.audio_stats["errors"] == errors + 2
@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+from admission import AdaptiveLimiter, Overloaded
+from fakes import FakeStreamingRecognizer
+import streaming_stt
+from benchmarks import fake_speech_sdk
+from streaming_stt import StreamingTranscriber
+
+
+def _drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_partials_arrive_before_finish():
+    async def run():
+        transcriber = StreamingTranscriber(FakeStreamingRecognizer("أنا بخير الحمد لله", bytes_per_word=100), decoder_cmd=None)
+        await transcriber.start()
+        for _ in range(3):
+            await transcriber.feed(b"\x00" * 100)
+        await asyncio.sleep(0)
+        partials = _drain(transcriber.partials)
+        transcript = await transcriber.finish(timeout=1)
+        return partials, transcript, transcriber.recognizer
+
+    partials, transcript, recognizer = asyncio.run(run())
+    assert partials == ["أنا", "أنا بخير", "أنا بخير الحمد"]
+    assert transcript == "أنا بخير الحمد لله"
+    assert recognizer.stopped
+
+
+def test_chunks_flow_through_decoder_process():
+    async def run():
+        recognizer = FakeStreamingRecognizer("مرحبا", bytes_per_word=1000)
+        transcriber = StreamingTranscriber(recognizer, decoder_cmd=["cat"])
+        await transcriber.start()
+        for _ in range(4):
+            await transcriber.feed(b"\x01" * 250)
+        transcript = await transcriber.finish(timeout=1)
+        return transcript, recognizer.received
+
+    transcript, received = asyncio.run(run())
+    assert transcript == "مرحبا"
+    assert received == 1000
+
+
+def test_finish_without_audio_returns_empty_transcript():
+    async def run():
+        transcriber = StreamingTranscriber(FakeStreamingRecognizer(), decoder_cmd=None)
+        await transcriber.start()
+        return await transcriber.finish(timeout=1)
+
+    assert asyncio.run(run()) == ""
+
+
+def test_azure_recognizer_against_fake_sdk(monkeypatch):
+    monkeypatch.setattr(streaming_stt, "speechsdk", fake_speech_sdk)
+    monkeypatch.setattr(fake_speech_sdk, "settings", dict(fake_speech_sdk.settings))
+    fake_speech_sdk.configure(stt_latency=0.01, error_rate=0, transcript="أنا بخير الحمد لله", partial_every_bytes=3200)
+
+    async def run():
+        transcriber = StreamingTranscriber(streaming_stt.AzureStreamingRecognizer("ar-OM"), decoder_cmd=None)
+        await transcriber.start()
+        for _ in range(2):
+            await transcriber.feed(b"\x00" * 3200)
+        await asyncio.sleep(0)
+        partials = _drain(transcriber.partials)
+        return partials, await transcriber.finish(timeout=1)
+
+    partials, transcript = asyncio.run(run())
+    assert partials == ["أنا", "أنا بخير"]
+    assert transcript == "أنا بخير الحمد لله"
+
+
+def test_stream_holds_an_stt_slot_until_finished():
+    limiter = AdaptiveLimiter("stt", latency_target=1.0, initial_limit=1, max_queue=0)
+
+    async def run():
+        first = StreamingTranscriber(FakeStreamingRecognizer(), decoder_cmd=None, limiter=limiter)
+        await first.start()
+        second = StreamingTranscriber(FakeStreamingRecognizer(), decoder_cmd=None, limiter=limiter)
+        with pytest.raises(Overloaded):
+            await second.start()
+        await first.feed(b"\x00" * 3200)
+        await first.finish(timeout=1)
+        # A stream closed without finishing returns its slot too
+        third = StreamingTranscriber(FakeStreamingRecognizer(), decoder_cmd=None, limiter=limiter)
+        await third.start()
+        await third.aclose()
+
+    asyncio.run(run())
+    stats = limiter.stats()
+    assert (stats["admitted"], stats["rejected"], stats["inflight"], stats["failed"]) == (2, 1, 0, 0)
+
+
+def test_failed_start_returns_its_slot_without_stopping():
+    limiter = AdaptiveLimiter("stt", latency_target=1.0, initial_limit=1, max_queue=0)
+    recognizer = FakeStreamingRecognizer()
+
+    def start(*callbacks):
+        raise RuntimeError("no connection")
+
+    recognizer.start = start
+
+    async def run():
+        transcriber = StreamingTranscriber(recognizer, decoder_cmd=None, limiter=limiter)
+        with pytest.raises(RuntimeError):
+            await transcriber.start()
+        await transcriber.aclose()
+
+    asyncio.run(run())
+    assert limiter.stats()["inflight"] == 0 and not recognizer.stopped
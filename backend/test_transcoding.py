@@ -0,0 +1,63 @@
+import asyncio
+import sys
+import pytest
+from transcoding import TranscodePool, TranscodeError, TranscodeQueueTimeout
+
+SLEEP = [sys.executable, "-c", "import time; time.sleep(0.3)"]
+
+
+def test_run_returns_stdout():
+    pool = TranscodePool(max_concurrency=2, queue_timeout=1, job_timeout=5)
+    out = asyncio.run(pool.run(["cat"], input=b"pcm bytes"))
+    assert out == b"pcm bytes"
+    assert pool.stats()["completed"] == 1
+
+
+def test_non_zero_exit_raises_with_stderr():
+    pool = TranscodePool(max_concurrency=1, queue_timeout=1, job_timeout=5)
+    cmd = [sys.executable, "-c", "import sys; sys.stderr.write('bad input'); sys.exit(3)"]
+    with pytest.raises(TranscodeError) as excinfo:
+        asyncio.run(pool.run(cmd))
+    assert excinfo.value.returncode == 3
+    assert excinfo.value.stderr == b"bad input"
+    assert pool.stats()["failed"] == 1
+
+
+def test_concurrency_cap_and_queue_timeout():
+    pool = TranscodePool(max_concurrency=1, queue_timeout=0.05, job_timeout=5)
+
+    async def run():
+        first = asyncio.create_task(pool.run(SLEEP))
+        await asyncio.sleep(0.1)
+        assert pool.running == 1
+        with pytest.raises(TranscodeQueueTimeout):
+            await pool.run(["cat"], input=b"")
+        await first
+
+    asyncio.run(run())
+    stats = pool.stats()
+    assert stats["rejected"] == 1
+    assert stats["completed"] == 1
+
+
+def test_cancel_kills_child_and_frees_slot():
+    pool = TranscodePool(max_concurrency=1, queue_timeout=1, job_timeout=5)
+    spawned = []
+
+    async def run():
+        async def job():
+            async with pool.open([sys.executable, "-c", "import time; time.sleep(30)"]) as (proc, _):
+                spawned.append(proc)
+                await proc.wait()
+
+        task = asyncio.create_task(job())
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Slot is free again
+        return await pool.run(["cat"], input=b"ok")
+
+    assert asyncio.run(run()) == b"ok"
+    assert spawned[0].returncode is not None
+    assert pool.stats()["cancelled"] == 1
@@ -2,6 +2,7 @@
 import asyncio
 import os
 from services import tts_omani
+from tts_cache import speech_cache
 
 async def test_tts():
     print("Testing TTS with simple Arabic text...")
@@ -12,7 +13,7 @@ async def test_tts():
         print("TTS test successful!")
         # Check if file exists
         filename = result.split('/')[-1]
-        filepath = f"tmp/{filename}"
+        filepath = speech_cache.path(filename)
         if os.path.exists(filepath):
             print(f"Audio file created: {filepath}")
             print(f"File size: {os.path.getsize(filepath)} bytes")
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import services
+from tts_cache import TTSCache
+
+
+def test_key_ignores_spacing_but_not_voice(tmp_path):
+    cache = TTSCache(str(tmp_path))
+    assert cache.key("v1", "mp3", "هلا  والله ") == cache.key("v1", "mp3", "هلا والله")
+    assert cache.key("v1", "mp3", "هلا") != cache.key("v2", "mp3", "هلا")
+
+
+def test_lru_eviction_by_size(tmp_path):
+    cache = TTSCache(str(tmp_path), max_bytes=250)
+    asyncio.run(cache.put("a", b"x" * 100))
+    asyncio.run(cache.put("b", b"x" * 100))
+    assert cache.get("a") == "a.mp3"  # a is now most recent
+    asyncio.run(cache.put("c", b"x" * 100))
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert not os.path.exists(cache.path("b.mp3"))
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == 200
+
+
+def test_pinned_entries_are_never_evicted(tmp_path):
+    cache = TTSCache(str(tmp_path), max_bytes=250)
+    cache.pin("crisis")
+
+    async def run():
+        await cache.put("crisis", b"x" * 100)
+        for key in "abcd":
+            await cache.put(key, b"x" * 100)
+
+    asyncio.run(run())
+    assert cache.get("crisis") == "crisis.mp3" and cache.get("d") == "d.mp3"
+    assert cache.stats()["evictions"] == 3
+
+
+def test_concurrent_writes_of_one_key_use_their_own_files(tmp_path):
+    cache = TTSCache(str(tmp_path))
+
+    async def run():
+        await asyncio.gather(*(cache.put("k", bytes([i]) * 100000) for i in range(8)))
+
+    asyncio.run(run())
+    with open(cache.path("k.mp3"), "rb") as f:
+        data = f.read()
+    assert len(set(data)) == 1 and len(data) == 100000
+    assert cache.total_bytes == 100000
+    assert not [name for name in os.listdir(os.path.dirname(cache.path("k.mp3"))) if name.endswith(".part")]
+
+
+def test_index_is_rebuilt_from_disk(tmp_path):
+    asyncio.run(TTSCache(str(tmp_path)).put("k", b"audio"))
+    cache = TTSCache(str(tmp_path))
+    assert cache.get("k") == "k.mp3"
+    assert cache.total_bytes == 5
+
+
+def test_flat_entries_move_into_shards(tmp_path):
+    (tmp_path / "abcdef.mp3").write_bytes(b"audio")
+    cache = TTSCache(str(tmp_path))
+    assert cache.get("abcdef") == "abcdef.mp3"
+    assert os.path.exists(tmp_path / "ab" / "cd" / "abcdef.mp3")
+
+
+def test_tts_omani_synthesizes_once_per_phrase(tmp_path, monkeypatch):
+    calls = []
+
+    async def fake_synthesize(text):
+        calls.append(text)
+        await asyncio.sleep(0.01)
+        return b"mp3"
+
+    monkeypatch.setattr(services, "speech_cache", TTSCache(str(tmp_path)))
+    monkeypatch.setattr(services, "synthesize_speech", fake_synthesize)
+
+    async def run():
+        # Concurrent misses share one synthesis, later calls hit the cache
+        first = await asyncio.gather(*(services.tts_omani(services.CRISIS_MESSAGE) for _ in range(3)))
+        second = await services.tts_omani(services.CRISIS_MESSAGE)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert calls == [services.CRISIS_MESSAGE]
+    assert len(set(first + [second])) == 1
+    assert second.startswith("http://localhost:8000/api/audio/cache/")
+    assert services.speech_cache.stats()["hits"] == 1
@@ -0,0 +1,52 @@
+import asyncio
+import time
+from fakes import FakeSynthesizer
+from tts_pipeline import SentenceSplitter, pipeline_events
+
+
+def test_splitter_handles_arabic_and_latin_boundaries():
+    splitter = SentenceSplitter()
+    sentences = []
+    for delta in ["هلا والله. كيف ", "حالك؟ I hear", " you! الرقم 3", ".5 مهم", "\nتمام"]:
+        sentences += splitter.feed(delta)
+    assert sentences == ["هلا والله.", "كيف حالك؟", "I hear you!", "الرقم 3.5 مهم"]
+    assert splitter.flush() == "تمام"
+
+
+async def _slow_deltas(words, delay):
+    for word in words:
+        await asyncio.sleep(delay)
+        yield word
+
+
+def _run(deltas, synth, max_parallel=2):
+    async def run():
+        events = []
+        async for event in pipeline_events(deltas, synth, max_parallel):
+            events.append((time.perf_counter(), event))
+        return events
+
+    return asyncio.run(run())
+
+
+def test_segments_are_released_in_order_while_generation_continues():
+    # Second sentence is much shorter, so it finishes synthesis first
+    synth = FakeSynthesizer(base_latency=0.01, per_char=0.004)
+    words = ["جملة أولى طويلة جدا جدا جدا. ", "قصيرة. ", "ثالثة ", "وأخيرة"]
+    events = _run(_slow_deltas(words, 0.03), synth)
+
+    segments = [e for _, e in events if e["type"] == "segment"]
+    assert [s["index"] for s in segments] == [0, 1, 2]
+    assert [s["audio"] for s in segments] == ["fake://tts/0", "fake://tts/1", "fake://tts/2"]
+    assert events[-1][1] == {"type": "done", "text": "".join(words).strip()}
+
+    # First sentence was being synthesized before generation finished
+    last_delta_at = max(t for t, e in events if e["type"] == "delta")
+    assert synth.calls[0][1] < last_delta_at
+
+
+def test_failed_segment_does_not_stop_the_stream():
+    synth = FakeSynthesizer(base_latency=0, fail_on="ثانية")
+    events = _run(_slow_deltas(["أولى. ", "ثانية. ", "ثالثة."], 0), synth)
+    audio = [e["audio"] for _, e in events if e["type"] == "segment"]
+    assert audio == ["fake://tts/0", None, "fake://tts/2"]
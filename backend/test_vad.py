@@ -0,0 +1,89 @@
+import numpy as np
+from streaming_stt import StreamingTranscriber
+from fakes import FakeStreamingRecognizer
+from vad import SpeechGate, VoiceActivityDetector, trim_silence
+import asyncio
+
+RATE = 16000
+
+
+def _silence(ms, seed=0):
+    # Quiet background hiss, well under the energy threshold
+    rng = np.random.default_rng(seed)
+    return (rng.normal(0, 30, RATE * ms // 1000)).astype("<i2").tobytes()
+
+
+def _speech(ms):
+    t = np.arange(RATE * ms // 1000) / RATE
+    return (8000 * np.sin(2 * np.pi * 220 * t)).astype("<i2").tobytes()
+
+
+def test_detector_hangover_and_endpoint():
+    vad = VoiceActivityDetector(onset_ms=60, hangover_ms=200, silence_ms=400)
+    vad.process(_silence(500))
+    assert not vad.speech_started
+    vad.process(_speech(300))
+    assert vad.in_speech
+    # A 160 ms pause between words is bridged by the hangover
+    flags = [speech for _, speech in vad.process(_silence(160))]
+    assert all(flags) and not vad.ended
+    # Silence counts towards the endpoint only once the hangover has run out
+    vad.process(_speech(200) + _silence(500))
+    assert not vad.ended
+    vad.process(_silence(100))
+    assert vad.ended
+
+
+def test_detector_is_chunking_independent():
+    audio = _silence(300) + _speech(400) + _silence(900)
+    whole = VoiceActivityDetector(silence_ms=800)
+    flags_whole = [s for _, s in whole.process(audio)]
+    pieces = VoiceActivityDetector(silence_ms=800)
+    flags_pieces = []
+    for i in range(0, len(audio), 777):
+        flags_pieces += [s for _, s in pieces.process(audio[i:i + 777])]
+    assert flags_whole == flags_pieces and whole.ended == pieces.ended
+
+
+def test_trim_keeps_padded_speech_only():
+    audio = _silence(1000) + _speech(500) + _silence(1000)
+    trimmed = trim_silence(audio, pad_ms=100)
+    assert len(trimmed) == len(_speech(700))
+    silence = _silence(300)
+    assert trim_silence(silence) == silence
+
+
+def test_gate_drops_silence_and_endpoints_transcriber():
+    gate = SpeechGate(VoiceActivityDetector(silence_ms=400), pad_ms=100)
+    recognizer = FakeStreamingRecognizer("مرحبا", bytes_per_word=3200)
+    transcriber = StreamingTranscriber(recognizer, decoder_cmd=None, gate=gate)
+
+    async def run():
+        await transcriber.start()
+        for chunk in (_silence(1000), _speech(400), _silence(600), _speech(400)):
+            await transcriber.feed(chunk)
+        assert transcriber.endpointed.is_set()
+        return await transcriber.finish()
+
+    assert asyncio.run(run()) == "مرحبا"
+    # Only pre-roll, speech and the silence before the endpoint reached the recognizer
+    assert recognizer.received < len(_silence(1000) + _speech(400) + _silence(600))
+    assert gate.dropped_bytes > len(_silence(800))
+
+
+def test_gate_fails_open_when_speech_is_never_detected():
+    t = np.arange(RATE * 1500 // 1000) / RATE
+    quiet = (100 * np.sin(2 * np.pi * 220 * t)).astype("<i2").tobytes()  # well under the speech threshold
+    gate = SpeechGate(VoiceActivityDetector(), pad_ms=100)
+    recognizer = FakeStreamingRecognizer("مرحبا", bytes_per_word=3200)
+    transcriber = StreamingTranscriber(recognizer, decoder_cmd=None, gate=gate)
+
+    async def run():
+        await transcriber.start()
+        for i in range(0, len(quiet), 3200):
+            await transcriber.feed(quiet[i:i + 3200])
+        assert recognizer.received == 0
+        return await transcriber.finish(timeout=1)
+
+    assert asyncio.run(run()) == "مرحبا"
+    assert recognizer.received == len(quiet) and gate.failed_open
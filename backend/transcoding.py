@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class TranscodeQueueTimeout(Exception):
+    """Raised when a job waited longer than queue_timeout for a free slot."""
+
+
+class TranscodeError(Exception):
+    """Raised when the transcoder exits with a non-zero status or times out."""
+
+    def __init__(self, message, returncode=None, stderr=b""):
+        super().__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class TranscodePool:
+    """
+    Runs ffmpeg (or any filter-style command) as asyncio subprocesses with a
+    concurrency cap. Jobs beyond the cap wait in FIFO order for up to
+    queue_timeout seconds. A job cancelled while running kills its child
+    process, so a client that disconnects does not leave ffmpeg behind.
+    """
+
+    def __init__(self, max_concurrency=None, queue_timeout=None, job_timeout=None, history=100):
+        self.max_concurrency = max_concurrency or int(os.getenv("FFMPEG_MAX_CONCURRENCY", "4"))
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv("FFMPEG_QUEUE_TIMEOUT", "10"))
+        self.job_timeout = job_timeout if job_timeout is not None else float(os.getenv("FFMPEG_JOB_TIMEOUT", "60"))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.recent_jobs = deque(maxlen=history)
+
+    @asynccontextmanager
+    async def open(self, args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE):
+        """
+        Acquire a slot and spawn `args`, yielding (process, job). The process
+        is killed on exit if it is still running.
+        """
+        job = {"cmd": args[0], "queued_ms": 0.0, "run_ms": 0.0, "returncode": None, "status": "queued"}
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            job["status"] = "rejected"
+            self.recent_jobs.append(job)
+            raise TranscodeQueueTimeout(f"No transcoder slot free after {self.queue_timeout}s")
+        finally:
+            self.waiting -= 1
+
+        started_at = time.perf_counter()
+        job["queued_ms"] = (started_at - queued_at) * 1000
+        self.running += 1
+        proc = None
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *args, stdin=stdin, stdout=stdout, stderr=asyncio.subprocess.PIPE
+            )
+            yield proc, job
+            job["status"] = "ok" if proc.returncode == 0 else "failed"
+        except asyncio.CancelledError:
+            job["status"] = "cancelled"
+            raise
+        except BaseException:
+            job["status"] = "failed"
+            raise
+        finally:
+            if proc is not None and proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            self.running -= 1
+            self._semaphore.release()
+            job["returncode"] = proc.returncode if proc is not None else None
+            job["run_ms"] = (time.perf_counter() - started_at) * 1000
+            self._record(job)
+
+    async def run(self, args, input=None):
+        """Run a job to completion and return its stdout, raising TranscodeError on failure."""
+        async with self.open(args) as (proc, job):
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(input), self.job_timeout)
+            except asyncio.TimeoutError:
+                raise TranscodeError(f"{args[0]} timed out after {self.job_timeout}s")
+            if proc.returncode != 0:
+                raise TranscodeError(
+                    f"{args[0]} exited with code {proc.returncode}", proc.returncode, stderr
+                )
+            return stdout
+
+    def _record(self, job):
+        if job["status"] == "ok":
+            self.completed += 1
+        elif job["status"] == "cancelled":
+            self.cancelled += 1
+        else:
+            self.failed += 1
+        self.recent_jobs.append(job)
+        logging.info(
+            f"Transcode {job['status']}: queued {job['queued_ms']:.1f} ms, ran {job['run_ms']:.1f} ms"
+        )
+
+    def stats(self):
+        run_times = sorted(j["run_ms"] for j in self.recent_jobs if j["status"] == "ok")
+        queue_times = sorted(j["queued_ms"] for j in self.recent_jobs if j["status"] != "rejected")
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "run_ms_p50": _percentile(run_times, 0.5),
+            "run_ms_p95": _percentile(run_times, 0.95),
+            "queued_ms_p95": _percentile(queue_times, 0.95),
+        }
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+# Process-wide pool shared by all handlers
+transcode_pool = TranscodePool()
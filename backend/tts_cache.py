@@ -0,0 +1,142 @@
+"""
+Content-addressed cache for synthesized speech.
+
+Entries are keyed by hash(voice, output format, normalized text) and kept
+as files in TTS_CACHE_DIR, sharded like the artifact store. The directory is
+capped at TTS_CACHE_MAX_BYTES and evicted least-recently-used first, except
+for pinned entries (the prewarmed fixed phrases); the index is rebuilt from
+the files' access times on startup.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import unicodedata
+from collections import OrderedDict
+from artifacts import shard_path
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tmp/tts_cache")
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def normalize_text(text):
+    # Only changes that cannot alter pronunciation: Unicode form and spacing
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class TTSCache:
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES, extension=".mp3"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._index = OrderedDict()  # filename -> size, least recently used first
+        self._pinned = set()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                if not name.endswith(self.extension):
+                    continue
+                path = os.path.join(dirpath, name)
+                if path != self.path(name):
+                    # Entry from the old flat layout; move it into its shard
+                    os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+                    os.replace(path, self.path(name))
+                stat = os.stat(self.path(name))
+                entries.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    def key(self, voice, output_format, text):
+        digest = hashlib.sha256(f"{voice}\x00{output_format}\x00{normalize_text(text)}".encode())
+        return digest.hexdigest()
+
+    def path(self, filename):
+        return shard_path(self.directory, filename)
+
+    def valid_filename(self, filename):
+        """Whether `filename` is one this cache could have produced (a hex digest plus extension)."""
+        key = filename[:-len(self.extension)]
+        return filename.endswith(self.extension) and len(key) == 64 and all(c in "0123456789abcdef" for c in key)
+
+    def get(self, key):
+        """Return the cached filename for `key`, or None on a miss."""
+        filename = key + self.extension
+        if filename in self._index and os.path.exists(self.path(filename)):
+            self._index.move_to_end(filename)
+            self.hits += 1
+            return filename
+        self._index.pop(filename, None)
+        self.misses += 1
+        return None
+
+    def pin(self, key):
+        """Never evict `key`; for phrases that must always be served instantly."""
+        self._pinned.add(key + self.extension)
+
+    async def put(self, key, data):
+        """Store audio bytes under `key` and return the filename."""
+        filename = key + self.extension
+        await asyncio.to_thread(self._write, self.path(filename), data)
+        self.total_bytes += len(data) - self._index.pop(filename, 0)
+        self._index[filename] = len(data)
+        self._evict()
+        return filename
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A unique temporary name, so concurrent writers of one key never share a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(data)
+            # Atomic so a concurrent reader never serves a half-written file
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # Least recently used first, skipping pinned entries and the newest one
+        candidates = [name for name in list(self._index)[:-1] if name not in self._pinned]
+        for filename in candidates:
+            if self.total_bytes <= self.max_bytes:
+                break
+            size = self._index.pop(filename)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self.path(filename))
+            except FileNotFoundError:
+                pass
+            logging.info(f"TTS cache evicted {filename} ({size} bytes)")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "pinned": len(self._pinned),
+        }
+
+
+# Process-wide cache used by services.tts_omani
+speech_cache = TTSCache()
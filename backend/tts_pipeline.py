@@ -0,0 +1,136 @@
+"""
+Sentence-pipelined speech synthesis.
+
+Response deltas are split into sentences as they stream in. Each finished
+sentence is handed to the synthesizer straight away, so sentence N is being
+synthesized while sentence N+1 is still being generated, and audio segments
+are released in order as soon as each one is ready.
+"""
+import asyncio
+import logging
+import os
+import re
+
+TTS_PIPELINE_PARALLEL = int(os.getenv("TTS_PIPELINE_PARALLEL", "2"))
+
+# Latin and Arabic sentence terminators: . ! ? … and ؟ (Arabic question
+# mark), ۔ (Arabic full stop), ؛ (Arabic semicolon), plus newlines.
+_BOUNDARY = re.compile(r"[.!?…؟۔؛]+[\"'»”)]*(?=\s)|\n+")
+
+
+class SentenceSplitter:
+    """Incrementally cuts streamed text into complete sentences."""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, delta):
+        """Add a delta and return any sentences it completed."""
+        self._buffer += delta
+        sentences = []
+        start = 0
+        # A terminator only counts once the following whitespace has arrived,
+        # so "3.5" or "..." split across deltas is not cut early.
+        for match in _BOUNDARY.finditer(self._buffer):
+            sentence = self._buffer[start:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return whatever is left once the stream has ended."""
+        rest, self._buffer = self._buffer.strip(), ""
+        return rest
+
+
+def split_sentences(text):
+    """Split a complete text the same way a stream of it would be split."""
+    splitter = SentenceSplitter()
+    sentences = splitter.feed(text)
+    rest = splitter.flush()
+    return sentences + [rest] if rest else sentences
+
+
+async def pipeline_events(deltas, synthesize, max_parallel=None):
+    """
+    Consume an async iterator of text deltas and yield events in a single
+    stream for one sender to forward:
+
+        {"type": "delta", "text": ...}          as each delta arrives
+        {"type": "segment", "index": i, "text": sentence, "audio": ...}
+                                                 in sentence order
+        {"type": "done", "text": full_text}     last
+
+    `synthesize` is an async callable taking a sentence; a failure yields a
+    segment with audio None rather than stopping the stream.
+    """
+    events = asyncio.Queue()
+    pending = asyncio.Queue()
+    slots = asyncio.Semaphore(max_parallel or TTS_PIPELINE_PARALLEL)
+    synth_tasks = []
+    parts = []
+
+    async def synthesize_bounded(sentence):
+        async with slots:
+            return await synthesize(sentence)
+
+    def schedule(sentence):
+        task = asyncio.create_task(synthesize_bounded(sentence))
+        synth_tasks.append(task)
+        pending.put_nowait((sentence, task))
+
+    async def produce():
+        splitter = SentenceSplitter()
+        try:
+            async for delta in deltas:
+                parts.append(delta)
+                await events.put({"type": "delta", "text": delta})
+                for sentence in splitter.feed(delta):
+                    schedule(sentence)
+            rest = splitter.flush()
+            if rest:
+                schedule(rest)
+        finally:
+            pending.put_nowait(None)
+
+    async def release_in_order():
+        index = 0
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            sentence, task = item
+            try:
+                audio = await task
+            except Exception as e:
+                logging.error(f"Segment {index} synthesis failed: {e}")
+                audio = None
+            await events.put({"type": "segment", "index": index, "text": sentence, "audio": audio})
+            index += 1
+
+    producer = asyncio.create_task(produce())
+    releaser = asyncio.create_task(release_in_order())
+
+    async def finish():
+        try:
+            await asyncio.gather(producer, releaser)
+        except Exception as e:
+            # e.g. the delta stream raised; re-raised to the consumer below
+            await events.put({"type": "error", "error": e})
+            return
+        await events.put({"type": "done", "text": "".join(parts).strip()})
+
+    finisher = asyncio.create_task(finish())
+    try:
+        while True:
+            event = await events.get()
+            if event["type"] == "error":
+                raise event["error"]
+            yield event
+            if event["type"] == "done":
+                break
+    finally:
+        for task in [producer, releaser, finisher] + synth_tasks:
+            task.cancel()
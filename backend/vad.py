@@ -0,0 +1,180 @@
+"""
+Voice activity detection on 16 kHz mono s16le PCM.
+
+Audio is cut into VAD_FRAME_MS frames. Per-frame energy (dBFS) and
+zero-crossing rate are computed for all frames of a chunk at once with
+NumPy. A frame is speech when it is loud enough and not hiss-like (high
+ZCR at modest energy), or simply very loud. Raw decisions are smoothed:
+VAD_ONSET_MS of speech starts an utterance and speech is held for
+VAD_HANGOVER_MS after the last speech frame, so short gaps between words
+do not count as silence. VAD_SILENCE_MS of silence after speech marks the
+end of the utterance.
+"""
+import os
+from collections import deque
+import numpy as np
+
+SAMPLE_RATE = 16000
+VAD_FRAME_MS = int(os.getenv("VAD_FRAME_MS", "20"))
+VAD_ENERGY_DB = float(os.getenv("VAD_ENERGY_DB", "-45"))
+VAD_LOUD_DB = float(os.getenv("VAD_LOUD_DB", "-30"))
+VAD_MAX_ZCR = float(os.getenv("VAD_MAX_ZCR", "0.35"))
+VAD_ONSET_MS = int(os.getenv("VAD_ONSET_MS", "60"))
+VAD_HANGOVER_MS = int(os.getenv("VAD_HANGOVER_MS", "200"))
+VAD_SILENCE_MS = int(os.getenv("VAD_SILENCE_MS", "800"))
+VAD_PAD_MS = int(os.getenv("VAD_PAD_MS", "200"))
+# Audio kept from before speech starts, in case the detector never hears any
+VAD_HOLD_MS = int(os.getenv("VAD_HOLD_MS", "30000"))
+# End /ws/audio turns automatically at end of speech instead of waiting for the client
+VAD_AUTO_ENDPOINT = os.getenv("VAD_AUTO_ENDPOINT", "true").lower() == "true"
+
+
+def frame_features(pcm, frame_len):
+    """(energy_db, zcr) arrays for each whole frame of int16 samples."""
+    frames = len(pcm) // frame_len
+    x = pcm[:frames * frame_len].reshape(frames, frame_len).astype(np.float32) / 32768.0
+    energy_db = 10.0 * np.log10(np.mean(x * x, axis=1) + 1e-10)
+    signs = np.signbit(x)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frame_len - 1)
+    return energy_db, zcr
+
+
+def speech_frames(pcm, frame_len, energy_db=None, max_zcr=None, loud_db=None):
+    """Raw (unsmoothed) speech decision for each whole frame."""
+    energy, zcr = frame_features(pcm, frame_len)
+    threshold = VAD_ENERGY_DB if energy_db is None else energy_db
+    loud = VAD_LOUD_DB if loud_db is None else loud_db
+    return ((energy >= threshold) & (zcr <= (VAD_MAX_ZCR if max_zcr is None else max_zcr))) | (energy >= loud)
+
+
+class VoiceActivityDetector:
+    """Streaming detector; feed PCM bytes in any chunk size."""
+
+    def __init__(self, frame_ms=None, onset_ms=None, hangover_ms=None, silence_ms=None, **thresholds):
+        self.frame_ms = frame_ms or VAD_FRAME_MS
+        self.frame_len = SAMPLE_RATE * self.frame_ms // 1000
+        self.frame_bytes = self.frame_len * 2
+        self.onset_frames = max(1, (VAD_ONSET_MS if onset_ms is None else onset_ms) // self.frame_ms)
+        self.hangover_frames = (VAD_HANGOVER_MS if hangover_ms is None else hangover_ms) // self.frame_ms
+        self.silence_frames = max(1, (VAD_SILENCE_MS if silence_ms is None else silence_ms) // self.frame_ms)
+        self.thresholds = thresholds
+        self.frames = 0
+        self.in_speech = False
+        self.speech_started = False
+        self.ended = False
+        self._run = 0          # consecutive raw speech frames
+        self._hold = 0         # hangover frames left
+        self._silent = 0       # frames since speech (after hangover)
+        self._rest = b""
+
+    def process(self, pcm):
+        """
+        Consume PCM bytes; returns a list of (frame_bytes, in_speech) for the
+        whole frames now available, with in_speech smoothed.
+        """
+        data = self._rest + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self._rest = data[usable:]
+        if not usable:
+            return []
+        samples = np.frombuffer(data[:usable], dtype="<i2")
+        raw = speech_frames(samples, self.frame_len, **self.thresholds)
+        out = []
+        for i, speech in enumerate(raw.tolist()):
+            self._step(speech)
+            out.append((data[i * self.frame_bytes:(i + 1) * self.frame_bytes], self.in_speech))
+        return out
+
+    def _step(self, speech):
+        self.frames += 1
+        self._run = self._run + 1 if speech else 0
+        if speech and (self.in_speech or self._run >= self.onset_frames):
+            self.in_speech = True
+            self.speech_started = True
+            self._hold = self.hangover_frames
+            self._silent = 0
+        elif self.in_speech and self._hold > 0:
+            self._hold -= 1
+        else:
+            self.in_speech = False
+            if self.speech_started:
+                self._silent += 1
+                if self._silent >= self.silence_frames:
+                    self.ended = True
+
+
+class SpeechGate:
+    """
+    Passes on only the audio worth recognizing: nothing before speech
+    starts except VAD_PAD_MS of pre-roll, and nothing once the utterance
+    has ended. `ended` is set at the automatic end-of-utterance point.
+
+    Audio before speech is held (up to VAD_HOLD_MS, oldest first out)
+    rather than thrown away: if the detector never hears speech, flush()
+    hands it all to the recognizer, the same fail-open as trim_silence.
+    """
+
+    def __init__(self, detector=None, pad_ms=None, hold_ms=None):
+        self.detector = detector or VoiceActivityDetector()
+        frame_ms = self.detector.frame_ms
+        self.pad_frames = max((VAD_PAD_MS if pad_ms is None else pad_ms) // frame_ms, 1)
+        hold_frames = (VAD_HOLD_MS if hold_ms is None else hold_ms) // frame_ms
+        self._held = deque(maxlen=max(hold_frames, self.pad_frames))
+        self.dropped_bytes = 0
+        self.failed_open = False
+
+    @property
+    def ended(self):
+        return self.detector.ended
+
+    def push(self, pcm):
+        """PCM to forward to the recognizer for this chunk (may be empty)."""
+        if self.detector.ended:
+            self.dropped_bytes += len(pcm)
+            return b""
+        out = []
+        for frame, _ in self.detector.process(pcm):
+            if self.detector.ended:
+                self.dropped_bytes += len(frame)
+            elif self.detector.speech_started:
+                if self._held:
+                    out.extend(self._preroll())
+                out.append(frame)
+            else:
+                if len(self._held) == self._held.maxlen:
+                    self.dropped_bytes += len(self._held[0])
+                self._held.append(frame)
+        return b"".join(out)
+
+    def _preroll(self):
+        frames = list(self._held)
+        self._held.clear()
+        self.dropped_bytes += sum(len(frame) for frame in frames[:-self.pad_frames])
+        return frames[-self.pad_frames:]
+
+    def flush(self):
+        """At the end of the turn: all held audio if speech was never detected, else nothing."""
+        if self.detector.speech_started or not self._held:
+            return b""
+        self.failed_open = True
+        held = b"".join(self._held)
+        self._held.clear()
+        return held
+
+
+def trim_silence(pcm, pad_ms=None, **thresholds):
+    """
+    Cut leading and trailing silence from a complete PCM buffer, keeping
+    VAD_PAD_MS around the speech. Audio with no speech at all comes back
+    unchanged, so the recognizer still gets to decide.
+    """
+    frame_len = SAMPLE_RATE * VAD_FRAME_MS // 1000
+    samples = np.frombuffer(memoryview(pcm)[:len(pcm) - len(pcm) % 2], dtype="<i2")
+    raw = speech_frames(samples, frame_len, **thresholds)
+    voiced = np.flatnonzero(raw)
+    if len(voiced) == 0:
+        return pcm
+    pad = (VAD_PAD_MS if pad_ms is None else pad_ms) // VAD_FRAME_MS
+    start = max(int(voiced[0]) - pad, 0) * frame_len * 2
+    end = min((int(voiced[-1]) + 1 + pad) * frame_len * 2, len(pcm))
+    return pcm[start:end]
@@ -7,6 +7,12 @@ interface Message {
   text: string;
 }
 
+// One conversation per tab: the server issues a session token on the first
+// connection and keeps recent turns of that session as context
+function getSessionToken(): string {
+  return sessionStorage.getItem("sessionToken") || "";
+}
+
 function App() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [recording, setRecording] = useState(false);
@@ -19,12 +25,30 @@ function App() {
   const handleStart = async () => {
     setRecording(true);
     wsRef.current = new WebSocket(
-      (window.location.protocol === "https:" ? "wss://" : "ws://") + window.location.host + "/ws/audio"
+      (window.location.protocol === "https:" ? "wss://" : "ws://") + window.location.host + "/ws/audio?audio=binary&session=" + encodeURIComponent(getSessionToken())
     );
     wsRef.current.binaryType = "arraybuffer";
     wsRef.current.onmessage = (event) => {
+      if (event.data instanceof ArrayBuffer) {
+        receiveAudioFrame(event.data);
+        return;
+      }
       const data = JSON.parse(event.data);
+      if (data.session_token) sessionStorage.setItem("sessionToken", data.session_token);
       if (data.partial_transcript) setPartialTranscript(data.partial_transcript);
+      // The server heard the end of speech and has started the turn itself
+      if (data.endpoint) {
+        setRecording(false);
+        if (mediaRecorderRef.current) stopRecording(mediaRecorderRef.current);
+      }
+      // Sentence audio arrives in order while the reply is still being generated,
+      // either as binary frames on this socket or as a URL to fetch
+      if (data.tts_segment && data.tts_segment.delivery === "binary") {
+        const seg = data.tts_segment;
+        pendingSegmentsRef.current[seg.turn_id + ":" + seg.index] = { type: seg.content_type, parts: [] };
+      } else if (data.tts_segment && data.tts_segment.tts_audio_url) {
+        enqueueAudio(data.tts_segment.tts_audio_url);
+      }
       if (data.final_transcript && data.response) {
         setMessages((msgs) => [
           ...msgs,
@@ -67,6 +91,50 @@ function App() {
     }
   };
 
+  const audioQueueRef = useRef<string[]>([]);
+  const audioPlayingRef = useRef(false);
+  const pendingSegmentsRef = useRef<{ [key: string]: { type: string; parts: ArrayBuffer[] } }>({});
+
+  // Binary frame: turn id (16 bytes) | segment index (uint16) | seq (uint32) | flags (uint8) | audio
+  const receiveAudioFrame = (frame: ArrayBuffer) => {
+    const view = new DataView(frame);
+    const hex = Array.from(new Uint8Array(frame, 0, 16), (b) => b.toString(16).padStart(2, "0")).join("");
+    const turnId = [hex.slice(0, 8), hex.slice(8, 12), hex.slice(12, 16), hex.slice(16, 20), hex.slice(20)].join("-");
+    const key = turnId + ":" + view.getUint16(16);
+    const segment = pendingSegmentsRef.current[key];
+    if (!segment) return;
+    segment.parts.push(frame.slice(23));
+    if (view.getUint8(22) & 1) {
+      delete pendingSegmentsRef.current[key];
+      enqueueAudio(URL.createObjectURL(new Blob(segment.parts, { type: segment.type })));
+    }
+  };
+
+  const playNextSegment = () => {
+    const next = audioQueueRef.current.shift();
+    if (!next) {
+      audioPlayingRef.current = false;
+      return;
+    }
+    audioPlayingRef.current = true;
+    const audio = new Audio(next);
+    const done = () => {
+      if (next.startsWith("blob:")) URL.revokeObjectURL(next);
+      playNextSegment();
+    };
+    audio.onended = done;
+    audio.onerror = done;
+    audio.play().catch((error) => {
+      console.error("Audio play failed:", error);
+      playNextSegment();
+    });
+  };
+
+  const enqueueAudio = (url: string) => {
+    audioQueueRef.current.push(url);
+    if (!audioPlayingRef.current) playNextSegment();
+  };
+
   const playAudio = (url: string) => {
     console.log("Attempting to play audio:", url);
     const audio = new Audio(url);